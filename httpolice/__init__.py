@@ -7,12 +7,16 @@ from httpolice.reports.html import html_report
 from httpolice.reports.text import text_report
 from httpolice.request import Request
 from httpolice.response import Response
+from httpolice.result_cache import ResultCache
+from httpolice.sampling import Sampler
 
 __all__ = [
     'Complaint',
     'Exchange',
     'Request',
     'Response',
+    'ResultCache',
+    'Sampler',
     'Severity',
     'check_exchange',
     'helpers',
@@ -1,7 +1,10 @@
 from collections import namedtuple
 import functools
+import types
 
-from httpolice.notice import all_notices
+from httpolice.header import HeadersView, HeaderView
+from httpolice.notice import Var, all_notices
+from httpolice.util import deadline, timing
 
 
 class Complaint(namedtuple('Complaint', ('notice', 'context'))):
@@ -29,7 +32,38 @@ class Complaint(namedtuple('Complaint', ('notice', 'context'))):
         return self.notice.severity
 
 
-class Blackboard:
+class _DerivedProperty(property):
+
+    """A :func:`derived_property`, as opposed to any other property."""
+
+
+def _slot(name):
+    # Where the value of the derived property `name` is memoized.
+    return u'_memo_' + name
+
+
+class _BlackboardType(type):
+
+    # If a blackboard class has ``__slots__``, it also gets a slot
+    # for every :func:`derived_property` defined in it (see :func:`_slot`).
+    # All of them, from this class and its bases,
+    # are listed in its `derived_names`.
+
+    def __new__(cls, name, bases, namespace):
+        derived = [key for (key, value) in namespace.items()
+                   if isinstance(value, _DerivedProperty)]
+        if '__slots__' in namespace:
+            namespace['__slots__'] = (tuple(namespace['__slots__']) +
+                                      tuple(_slot(key) for key in derived))
+        new_cls = super(_BlackboardType, cls).__new__(cls, name, bases,
+                                                      namespace)
+        new_cls.derived_names = tuple(sorted(
+            set(derived).union(*(base.derived_names for base in bases
+                                 if isinstance(base, _BlackboardType)))))
+        return new_cls
+
+
+class Blackboard(metaclass=_BlackboardType):
 
     """Shared state that various parts of the code can "write upon".
 
@@ -38,24 +72,71 @@ class Blackboard:
     are :meth:`complain` and :func:`derived_property`.
     """
 
+    # Blackboards are kept in memory for as long as the report needs them,
+    # so their attributes (including derived properties) live in slots
+    # instead of a ``__dict__`` for every instance.
+    __slots__ = ('_complaints', '_complaint_keys', '_visible', '_silenced')
+
     self_name = u'self'
 
+    #: The names of all derived properties of this class, sorted.
+    derived_names = ()
+
     def __init__(self):
         self._complaints = []
+        # Keys of `_complaints` (see :func:`_complaint_key`),
+        # to tell quickly if a complaint has already been reported.
+        self._complaint_keys = set()
+        # `_complaints` without the silenced ones,
+        # or `None` if they have changed since it was last needed.
+        self._visible = None
         self._silenced = set()
-        self.memoized = {}
 
     @property
     def children(self):
         return []
 
+    @property
+    def memoized(self):
+        """A dictionary of the derived properties known so far."""
+        r = {}
+        for name in self.derived_names:
+            try:
+                r[name] = getattr(self, _slot(name))
+            except AttributeError:
+                pass
+        return r
+
+    def forget(self):
+        """Forget all derived properties, so they are derived again."""
+        for name in self.derived_names:
+            try:
+                delattr(self, _slot(name))
+            except AttributeError:
+                pass
+
     def complain(self, notice_id, **kwargs):
         """Report a notice on this blackboard."""
         notice = all_notices[notice_id]
         context = dict({self.self_name: self}, **kwargs)
-        complaint = Complaint(notice, context)
-        if complaint not in self._complaints:
+        self._add_complaint(Complaint(notice, context))
+
+    def _add_complaint(self, complaint):
+        key = _complaint_key(complaint)
+        if key not in self._complaint_keys:
+            self._complaint_keys.add(key)
             self._complaints.append(complaint)
+            self._visible = None
+
+    def _reset(self, complaints, silenced):
+        # Start over with these `complaints` and `silenced` notice IDs
+        # (see :mod:`httpolice.result_cache`).
+        self._complaints = []
+        self._complaint_keys = set()
+        self._visible = None
+        self._silenced = set(silenced)
+        for complaint in complaints:
+            self._add_complaint(complaint)
 
     def silence(self, notice_ids):
         """Silence unwanted notices on this object.
@@ -65,17 +146,43 @@ class Blackboard:
           so they don't appear in :attr:`notices` or in reports.
         """
         self._silenced.update(notice_ids)
+        self._visible = None
         for child in self.children:
             child.silence(notice_ids)
 
+    def release(self, keep=()):
+        """Free the memory taken by payloads and by the contexts of notices.
+
+        Call this when the object has been checked and reported on,
+        but you still want to keep it (or its notices) around.
+
+        Payload bodies, and the data decoded or parsed from them
+        (such as ``decoded_body`` or ``json_data``), become unavailable,
+        except those whose names are in `keep` (such as ``[u'body']``).
+        The notices can still be rendered in reports, but their contexts
+        are replaced with snapshots of the values they show,
+        so they no longer refer to the messages.
+        This applies to every message in an exchange.
+        """
+        for child in self.children:
+            child.release(keep)
+        self._reset([_snapshot(complaint) for complaint in self._complaints],
+                    self._silenced)
+
+    def wants(self, notice_ids):
+        """Would any of `notice_ids` be seen if reported on this object?"""
+        return not self._silenced.issuperset(notice_ids)
+
     @property
     def complaints(self):
         """
         A list of :class:`~httpolice.Complaint` instances
         reported on this object.
         """
-        return [complaint for complaint in self._complaints
-                if complaint.notice.id not in self._silenced]
+        if self._visible is None:
+            self._visible = [complaint for complaint in self._complaints
+                             if complaint.notice.id not in self._silenced]
+        return list(self._visible)
 
     # Inside our codebase, there is a clear distinction
     # between a notice and a complaint.
@@ -84,6 +191,83 @@ class Blackboard:
     notices = complaints
 
 
+def _complaint_key(complaint):
+    # Two complaints are the same if they have the same notice
+    # and their contexts are equal, which is now a matter of hashing.
+    return (complaint.notice.id,
+            tuple(sorted((name, _value_key(value))
+                         for (name, value) in complaint.context.items())))
+
+
+def _value_key(value):
+    if isinstance(value, list):
+        return (list, tuple(_value_key(x) for x in value))
+    if value.__class__ is tuple:        # Not namedtuples, they are special.
+        return (tuple, tuple(_value_key(x) for x in value))
+    try:
+        hash(value)
+    except TypeError:
+        # Such as :class:`httpolice.header.HeaderView`,
+        # which is only equal to itself (as far as complaints go).
+        return (type(value), id(value))
+    return value
+
+
+class Snapshot(types.SimpleNamespace):
+
+    """What is left of an object in a notice's context after release.
+
+    It only has the attributes whose values the notice shows.
+    Others (which may be referred to for highlighting in HTML reports)
+    are empty snapshots.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith(u'__'):
+            raise AttributeError(name)
+        return Snapshot()
+
+
+def _snapshot(complaint):
+    paths = _shown_paths(complaint.notice)
+    return Complaint(complaint.notice, {
+        name: _lighten(value, [path[1:] for path in paths if path[0] == name])
+        for (name, value) in complaint.context.items()
+    })
+
+
+_shown = {}
+
+
+def _shown_paths(notice):
+    # The paths into a context (like ``['msg', 'request', 'method']``)
+    # whose values are shown by `notice`.
+    if notice.id not in _shown:
+        _shown[notice.id] = [elem.reference for elem in notice.iter()
+                             if isinstance(elem, Var)]
+    return _shown[notice.id]
+
+
+def _lighten(value, paths):
+    # Replace anything in `value` that refers to a message with what
+    # is needed to follow `paths` (with the first name already taken).
+    if isinstance(value, list):
+        return [_lighten(x, paths) for x in value]
+    if isinstance(value, HeaderView):
+        return value.detached()
+    if isinstance(value, (Blackboard, HeadersView)):
+        r = Snapshot()
+        for name in set(path[0] for path in paths if path):
+            setattr(r, name, _lighten(getattr(value, name),
+                                      [path[1:] for path in paths
+                                       if path and path[0] == name]))
+        return r
+    if isinstance(value, BaseException):
+        # Its traceback would keep the frames (and the messages in them).
+        value.__traceback__ = None
+    return value
+
+
 def derived_property(getter):
     """A property that can be derived from a blackboard's underlying data.
 
@@ -96,17 +280,62 @@ def derived_property(getter):
     (so it is always set to ``Unavailable()``),
     but sometimes we do know the `decoded_body`,
     so the HAR input module may assign directly to `decoded_body`.
+    It may also assign a :class:`Lazy` value, to avoid decoding the body
+    until someone actually needs it.
     """
+    name = getter.__name__
+    slot = _slot(name)
+    timing_name = u'property.' + name
 
-    @property
     @functools.wraps(getter)
-    def prop(self):
-        if getter.__name__ not in self.memoized:
-            self.memoized[getter.__name__] = getter(self)
-        return self.memoized[getter.__name__]
+    def get(self):
+        try:
+            value = getattr(self, slot)
+        except AttributeError:
+            deadline.check()
+            value = timing.measure(timing_name, getter, self)
+            setattr(self, slot, value)
+        else:
+            if isinstance(value, Lazy):
+                try:
+                    value = value.compute()
+                except ValueError:
+                    value = getter(self)
+                setattr(self, slot, value)
+        return value
+
+    def set_(self, value):
+        setattr(self, slot, value)
+
+    return _DerivedProperty(get, set_)
+
+
+class Lazy:
+
+    """A value for a :func:`derived_property` that is computed when needed.
+
+    It is computed by calling ``func(*args)`` on first access.
+    If that raises :exc:`ValueError`, the property is derived as usual,
+    as if nothing had been assigned to it.
+    Either way, `args` are not kept around after that.
+
+    >>> from httpolice import Response
+    >>> resp = Response(u'HTTP/1.1', 200, u'OK', [], body=b'hello')
+    >>> resp.decoded_body = Lazy(bytes.upper, b'world')
+    >>> resp.decoded_body
+    b'WORLD'
+    >>> resp.decoded_body = Lazy(int, u'not a number')
+    >>> resp.decoded_body
+    b'hello'
+    """
+
+    __slots__ = ('func', 'args')
 
-    @prop.setter
-    def prop(self, value):
-        self.memoized[getter.__name__] = value
+    def __init__(self, func, *args):
+        # `func` and `args` should be picklable, because exchanges
+        # may be sent between processes (see ``httpolice --jobs``).
+        self.func = func
+        self.args = args
 
-    return prop
+    def compute(self):
+        return self.func(*self.args)
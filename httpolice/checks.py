@@ -0,0 +1,80 @@
+"""A registry of checks, so that they can be selected by notice ID.
+
+A check is a function registered with :func:`check` for a *phase*
+(such as ``u'request'``), along with the IDs of all notices it can report.
+:func:`run_checks` applies the checks of a phase in the order of registration,
+but skips those whose notices are all silenced, because nothing they report
+would be seen anyway. This is what makes ``httpolice --only`` fast:
+when only a few notices are wanted, most checks are skipped,
+and so is the parsing of the headers and bodies they would look at.
+
+The properties that a check needs are not declared:
+headers and derived properties are computed lazily, on first access,
+so a check that is skipped simply never computes them.
+But if that computation reports notices,
+they must be declared by the first check of the object that accesses them.
+For headers and payload bodies, these are the checks that force parsing them
+at the start of the ``u'message'`` phase.
+"""
+
+import collections
+
+from httpolice.util import deadline, timing
+
+
+#: A registered check: its `name` (the function's name),
+#: the function itself, and the `notice_ids` it can report (a frozenset).
+Check = collections.namedtuple('Check', ['name', 'func', 'notice_ids'])
+
+#: A dictionary from phase names to lists of :class:`Check`.
+registry = collections.defaultdict(list)
+
+#: If not `None`, a function that is called with the `notice_ids`
+#: and the `args` of every check right before and right after it is applied,
+#: and also between the steps of some checks (see :func:`step`).
+#: This is how :mod:`httpolice.result_cache` knows
+#: where the notices of every check are.
+tracer = None
+
+
+def check(phase, *notice_ids):
+    """Register the decorated function as a check for `phase`."""
+    def decorator(func):
+        registry[phase].append(
+            Check(func.__name__.lstrip(u'_'), func, frozenset(notice_ids)))
+        return func
+    return decorator
+
+
+def run_checks(phase, *args):
+    """Apply the checks for `phase` to `args`.
+
+    All `args` must be blackboards, the first one being the object checked.
+    The others are its context (such as the request to a response),
+    on which a check may also report notices through derived properties.
+    So a check is only skipped if its notices are silenced on all of `args`.
+    """
+    for chk in registry[phase]:
+        if any(obj.wants(chk.notice_ids) for obj in args):
+            deadline.check()
+            if tracer is not None:
+                tracer(chk.notice_ids, args)
+            if timing.enabled:
+                timing.measure(u'check.%s.%s' % (phase, chk.name),
+                               chk.func, *args)
+            else:
+                chk.func(*args)
+            if tracer is not None:
+                tracer(chk.notice_ids, args)
+
+
+def step(notice_ids, *args):
+    """Mark a point between the steps of a check on `args`.
+
+    `notice_ids` are those of the check. Call this from a check that
+    goes through the same steps every time (such as one for every header),
+    so that :mod:`httpolice.result_cache` can put the notices
+    that it reports again in the right places among the others.
+    """
+    if tracer is not None:
+        tracer(notice_ids, args)
@@ -2,13 +2,26 @@
 
 import argparse
 import collections
+import contextlib
+import functools
+import hashlib
+import inspect
+import io
+import json
+import os
 import sys
 import traceback
 
 import httpolice
 from httpolice import inputs, reports
-from httpolice.exchange import check_exchange
-from httpolice.notice import Severity
+from httpolice.exchange import check_exchange, complaint_box
+from httpolice.inputs.ndjson import ndjson_record
+from httpolice.inputs.filters import exchange_matches, parse_timestamp
+from httpolice.notice import Severity, all_notices
+from httpolice.parallel import run_parts
+from httpolice.result_cache import ResultCache, default_volatile
+from httpolice.sampling import Sampler, sample_key
+from httpolice.util import stats, timing
 
 
 def parse_args(argv):
@@ -23,31 +36,285 @@ def parse_args(argv):
                         default=u'text', help=u'output format')
     parser.add_argument(u'-s', u'--silence', metavar=u'ID', type=int,
                         action='append', help=u'silence the given notice ID')
+    parser.add_argument(u'--only', metavar=u'ID,...', type=_notice_ids,
+                        action='append',
+                        help=u'report only these notice IDs, skipping '
+                             u'the checks that cannot produce them')
+    parser.add_argument(u'--headers-only', action='store_true',
+                        help=u'skip message bodies and the checks '
+                             u'that depend on them')
+    parser.add_argument(u'--cache', metavar=u'N', type=int,
+                        help=u'remember the notices of up to N distinct '
+                             u'exchanges, and reuse them for exchanges '
+                             u'that differ only in volatile headers')
+    parser.add_argument(u'--volatile-header', metavar=u'NAME',
+                        type=_volatile_header, action='append',
+                        help=u'with --cache, also ignore the value of '
+                             u'this header (may be given several times)')
+    parser.add_argument(u'--index', metavar=u'FILE',
+                        help=u'keep the framing index of the input in FILE, '
+                             u'so that later runs do not have to reframe it '
+                             u'(only for stream-based input formats, '
+                             u'and for har with --jobs)')
+    parser.add_argument(u'--no-reorder', dest=u'reorder',
+                        action='store_false',
+                        help=u'do not interleave exchanges from different '
+                             u'connections by time, just take them in order '
+                             u'(only for stream-based input formats)')
+    parser.add_argument(u'--jobs', metavar=u'N', type=int, default=1,
+                        help=u'check the input in N worker processes, '
+                             u'or one per CPU if N is 0')
+    parser.add_argument(u'--budget', metavar=u'SECONDS', type=float,
+                        help=u'stop checking an exchange after this long, '
+                             u'and report notice 1313 on it')
+    parser.add_argument(u'--quarantine', metavar=u'DIR',
+                        help=u'with --budget, save the exchanges that took '
+                             u'too long to DIR, for -i ndjson')
+    parser.add_argument(u'--lines', metavar=u'FIRST-LAST', type=_line_range,
+                        help=u'read only these lines of every input file, '
+                             u'such as 1001-2000 or 1001- '
+                             u'(only for -i ndjson)')
+    parser.add_argument(u'--since', metavar=u'TIME', type=_timestamp,
+                        help=u'skip connections and exchanges before TIME, '
+                             u'such as 2019-06-27T12:00:00Z '
+                             u'(only for -i tcpflow, tcpick, pcap, and har)')
+    parser.add_argument(u'--until', metavar=u'TIME', type=_timestamp,
+                        help=u'skip connections and exchanges after TIME '
+                             u'(only for -i tcpflow, tcpick, pcap, and har)')
+    parser.add_argument(u'--sample-rate', metavar=u'RATE', type=float,
+                        help=u'check only this fraction (such as 0.01) '
+                             u'of the URLs, the same on every run')
+    parser.add_argument(u'--sample-by', choices=[u'url', u'connection'],
+                        help=u'with --sample-rate, sample connections '
+                             u'instead of URLs (only for -i tcpflow, '
+                             u'tcpick, and pcap)')
+    parser.add_argument(u'--max-per-key', metavar=u'N', type=int,
+                        help=u'check at most N exchanges with the same '
+                             u'method, host, path (with IDs collapsed), '
+                             u'and status')
+    parser.add_argument(u'--host', metavar=u'HOST', action='append',
+                        help=u'check only requests to HOST '
+                             u'(may be given several times)')
+    parser.add_argument(u'--target-prefix', metavar=u'PREFIX',
+                        action='append',
+                        help=u'check only requests whose target '
+                             u'(path and query) starts with PREFIX '
+                             u'(may be given several times)')
+    parser.add_argument(u'--follow', action='store_true',
+                        help=u'keep watching the input directories '
+                             u'and report exchanges as they are captured, '
+                             u'until interrupted (only for -i tcpflow '
+                             u'and -i tcpick)')
+    parser.add_argument(u'--idle-timeout', metavar=u'SECONDS', type=float,
+                        help=u'with --follow, consider a connection finished '
+                             u'when its files have not grown for this long')
+    parser.add_argument(u'--checkpoint', metavar=u'FILE',
+                        help=u'with --follow, keep track of progress in FILE, '
+                             u'so that a restarted run does not report '
+                             u'the same exchanges again')
+    parser.add_argument(u'--stats', metavar=u'FILE',
+                        help=u'write counters of what happened during the run '
+                             u'(such as how many files had to be reopened) '
+                             u'to FILE as JSON')
+    parser.add_argument(u'--timings', action='store_true',
+                        help=u'measure the time spent in every phase '
+                             u'and check, print a table of it '
+                             u'to standard error, and add it to --stats')
     parser.add_argument(u'--fail-on',
                         choices=[severity.name for severity in Severity],
                         help=u'exit with a non-zero status '
                              u'if any notices with this or higher severity '
                              u'have been reported')
+    parser.add_argument(u'--fail-fast', action='store_true',
+                        help=u'with --fail-on, stop reading the input '
+                             u'as soon as such a notice has been reported, '
+                             u'and exit with a non-zero status')
+    parser.add_argument(u'--max-failures', metavar=u'N', type=int,
+                        help=u'with --fail-fast, stop only after N such '
+                             u'notices (default: 1)')
     parser.add_argument(u'--full-traceback', action='store_true',
                         help=u'do not hide the traceback on exceptions')
     parser.add_argument(u'path', nargs='+')
-    return parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[1:])
+    if args.volatile_header and not args.cache:
+        parser.error(u'--volatile-header requires --cache')
+    if args.quarantine and args.budget is None:
+        parser.error(u'--quarantine requires --budget')
+    if args.sample_rate is not None and not 0 < args.sample_rate <= 1:
+        parser.error(u'--sample-rate must be more than 0 and at most 1')
+    if args.sample_by is not None and args.sample_rate is None:
+        parser.error(u'--sample-by requires --sample-rate')
+    if args.max_per_key is not None and args.max_per_key < 1:
+        parser.error(u'--max-per-key must be at least 1')
+    if args.fail_fast and args.fail_on is None:
+        parser.error(u'--fail-fast requires --fail-on')
+    if args.max_failures is not None:
+        if not args.fail_fast:
+            parser.error(u'--max-failures requires --fail-fast')
+        if args.max_failures < 1:
+            parser.error(u'--max-failures must be at least 1')
+    return args
+
+
+def _line_range(s):
+    (first, sep, last) = s.partition(u'-')
+    try:
+        r = (int(first) if first else None, int(last) if last else None)
+    except ValueError:
+        r = None
+    if not sep or r is None or any(n is not None and n < 1 for n in r):
+        raise argparse.ArgumentTypeError(u'bad line range: %s' % s)
+    return r
+
+
+def _notice_ids(s):
+    try:
+        ids = [int(n) for n in s.split(u',')]
+    except ValueError:
+        ids = []
+    if not ids or not all(n in all_notices for n in ids):
+        raise argparse.ArgumentTypeError(u'bad notice IDs: %s' % s)
+    return ids
+
+
+def _volatile_header(s):
+    try:
+        ResultCache(volatile_headers=[s])
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from None
+    return s
+
+
+def _timestamp(s):
+    try:
+        return parse_timestamp(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(u'bad time: %s' % s) from None
 
 
 def run_cli(args, stdout, stderr):
     input_ = inputs.formats[args.input]
-    report = reports.formats[args.output]
     n_notices = collections.Counter()
+    n_sampled = collections.Counter()       # Only in sampled exchanges.
+    n_exchanges = 0
+    silence = set(args.silence or [])
+    if args.only:
+        # Silencing everything else is enough to skip the unneeded checks.
+        silence.update(set(all_notices).difference(*args.only))
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache,
+                            default_volatile + (args.volatile_header or []))
+    sampler = worker_sampler = None
+    if args.sample_rate is not None or args.max_per_key is not None:
+        sampler = worker_sampler = Sampler(args.sample_rate or 1,
+                                           args.max_per_key,
+                                           args.sample_by or u'url')
+        if args.jobs != 1:
+            # The workers only sample by rate, and `max_per_key` is applied
+            # here, to their results, as it would be without ``--jobs``.
+            worker_sampler = Sampler(sampler.rate, by=sampler.by)
+    estimate = {}
+    stopped = {}        # Filled in when ``--fail-fast`` stops the run.
+    process = functools.partial(
+        _process_exchange, hosts=[host.lower() for host in args.host or []],
+        target_prefixes=args.target_prefix, silence=silence, cache=cache,
+        budget=args.budget, quarantine=args.quarantine,
+        sampler=worker_sampler)
+
+    def tally(severities, key):
+        # Count the notices of an exchange that has been reported,
+        # and tell if it is time to stop because of ``--fail-fast``.
+        # `key` is the `sample_key` of the exchange, which is `None`
+        # for those that are never sampled out (see `Sampler.admit`).
+        nonlocal n_exchanges
+        n_exchanges += 1
+        n_notices.update(severities)
+        if key is not None:
+            n_sampled.update(severities)
+        if args.fail_fast:
+            n_failures = _n_failures(n_notices, args.fail_on)
+            if n_failures >= (args.max_failures or 1):
+                stopped.update(exchanges=n_exchanges, failures=n_failures)
+        return bool(stopped)
+
+    def stop_box():
+        # Say in the report why the rest of the input was not checked.
+        box = complaint_box(1315, severity=args.fail_on, **stopped)
+        n_notices.update(process(box))
+        return box
+
+    def sampling_box():
+        # Say how much of the input was checked, and what it would give
+        # if it all was, in the report and (with ``--stats``) in `estimate`.
+        # Only the notices of the sampled exchanges are extrapolated.
+        # The rest would be the same without sampling.
+        estimate.update((severity.name,
+                         n_sampled[severity] / sampler.ratio +
+                         n_notices[severity] - n_sampled[severity])
+                        for severity in Severity)
+        box = complaint_box(1314, percent=u'%.3g' % (100 * sampler.ratio),
+                            errors=round(estimate[u'error']),
+                            comments=round(estimate[u'comment']))
+        n_notices.update(process(box))
+        return box
+
     def generate_exchanges():
-        for exch in input_(args.path):
-            if args.silence:
-                exch.silence(args.silence)
-            check_exchange(exch)
-            n_notices.update(complaint.severity
-                             for obj in [exch] + exch.children
-                             for complaint in obj.complaints)
-            yield exch
+        try:
+            exchanges = input_(args.path, **_input_options(input_, args))
+            for exch in timing.iterate(u'input', exchanges):
+                severities = process(exch)
+                if severities is None:
+                    continue
+                enough = tally(severities,
+                               sampler and sample_key(exch))
+                yield exch
+                # The report is done with it.
+                exch.release()
+                if enough:
+                    yield stop_box()
+                    return
+                if args.follow:
+                    # Someone may be watching the report as it grows.
+                    stdout.buffer.flush()
+        except KeyboardInterrupt:
+            if not args.follow:
+                raise
+            # Following is only ever stopped like this,
+            # so finish the report normally.
+        if sampler is not None:
+            yield sampling_box()
+
+    def write_report(buf):
+        if args.jobs == 1:
+            timing.measure(u'report', reports.formats[args.output],
+                           generate_exchanges(), buf)
+            return
+        (frame, fragment) = reports.pieces[args.output]
+        (parts, reorder) = input_(args.path, **_input_options(input_, args))
+        (prologue, epilogue) = frame()
+        buf.write(prologue)
+        # Closing `results` early kills the workers,
+        # along with whatever they are still checking.
+        with contextlib.closing(run_parts(
+                parts, reorder, args.jobs, process, fragment,
+                budget=args.budget,
+                key=sample_key if sampler else None)) as results:
+            for result in results:
+                if sampler is not None and not sampler.admit_key(result.key):
+                    continue
+                buf.write(result.fragment)
+                if tally(result.severities, result.key):
+                    buf.write(fragment(stop_box()))
+                    break
+            else:
+                if sampler is not None:
+                    buf.write(fragment(sampling_box()))
+        buf.write(epilogue)
 
+    stats.reset()
+    timing.reset()
+    timing.enabled = args.timings
     try:
         # Can't use stdout as text because it may not be UTF-8 (on Windows).
         # Our HTML reports are meant for redirection
@@ -57,20 +324,127 @@ def run_cli(args, stdout, stderr):
         # (perhaps from pieces of input data),
         # we don't want to trip over Unicode errors.
         # So we encode all text into UTF-8 and write directly as bytes.
-        report(generate_exchanges(), stdout.buffer)
+        write_report(stdout.buffer)
     except (EnvironmentError, inputs.InputError) as exc:
         if args.full_traceback:
             traceback.print_exc(file=stderr)
         stderr.write(u'httpolice: %s\n' % exc)
         return 1
+    finally:
+        timing.enabled = False
+        if args.stats:
+            _write_stats(args.stats, args.timings,
+                         sampler and {u'ratio': sampler.ratio,
+                                      u'notices': estimate})
+        if args.timings:
+            stderr.write(timing.table())
 
-    if args.fail_on is not None:
-        for severity in Severity:
-            if severity >= Severity[args.fail_on] and n_notices[severity] > 0:
-                return 1
+    if stopped:
+        stderr.write(u'httpolice: stopped because of --fail-fast '
+                     u'(exchanges reported: %d, notices of severity %s '
+                     u'or higher: %d); the rest of the input, if any, '
+                     u'was not checked\n' %
+                     (stopped[u'exchanges'], args.fail_on,
+                      stopped[u'failures']))
+    if args.fail_on is not None and _n_failures(n_notices, args.fail_on):
+        return 1
     return 0
 
 
+def _n_failures(n_notices, fail_on):
+    return sum(n for (severity, n) in n_notices.items()
+               if severity >= Severity[fail_on])
+
+
+def _process_exchange(exch, hosts, target_prefixes, silence, cache,
+                      budget=None, quarantine=None, sampler=None,
+                      give_up=False):
+    # Filter, sample, silence, and check `exch`, returning the severities
+    # of its notices, or `None` if it is skipped. With ``--jobs``,
+    # this runs in worker processes, and if checking `exch` has been
+    # killed before (see :mod:`httpolice.parallel`), it is not checked
+    # again, as if it went over the `budget`, but with `give_up`.
+    if not exchange_matches(exch, hosts, target_prefixes):
+        stats.count(u'filter.exchanges_skipped')
+        return None
+    if sampler is not None and not sampler.admit(exch):
+        return None
+    if silence:
+        exch.silence(silence)
+    if give_up:
+        stats.count(u'budget.exceeded')
+        exch.complain(1313, budget=budget)
+        finished = False
+    else:
+        finished = check_exchange(exch, cache=cache, budget=budget)
+    if not finished and quarantine and (exch.request or exch.responses):
+        _quarantine(exch, quarantine)
+    return [complaint.severity
+            for obj in [exch] + exch.children
+            for complaint in obj.complaints]
+
+
+def _quarantine(exch, directory):
+    # Files are named after their contents, so that the same exchange
+    # is only kept once, even if it took too long in several runs.
+    record = ndjson_record(exch).encode('utf-8') + b'\n'
+    name = hashlib.sha256(record).hexdigest()[:16] + u'.ndjson'
+    os.makedirs(directory, exist_ok=True)
+    with io.open(os.path.join(directory, name), 'wb') as f:
+        f.write(record)
+    stats.count(u'budget.quarantined')
+
+
+_option_flags = {u'headers_only': u'headers-only', u'reorder': u'no-reorder',
+                 u'idle_timeout': u'idle-timeout', u'parts': u'jobs',
+                 u'sample_connections': u'sample-by connection'}
+
+
+def _input_options(input_, args):
+    options = {u'headers_only': args.headers_only}
+    if args.index is not None:
+        options[u'index'] = args.index
+    if not args.reorder:
+        options[u'reorder'] = False
+    if args.lines is not None:
+        options[u'lines'] = args.lines
+    if args.follow:
+        options[u'follow'] = True
+    if args.since is not None:
+        options[u'since'] = args.since
+    if args.until is not None:
+        options[u'until'] = args.until
+    for name in [u'idle_timeout', u'checkpoint']:
+        if getattr(args, name) is not None:
+            if not args.follow:
+                raise inputs.InputError(u'--%s requires --follow' %
+                                        _option_flags.get(name, name))
+            options[name] = getattr(args, name)
+    if args.sample_by == u'connection':
+        options[u'sample_connections'] = args.sample_rate
+    if args.jobs != 1:
+        if args.follow:
+            raise inputs.InputError(u'--jobs cannot be used with --follow')
+        options[u'parts'] = True
+    supported = inspect.signature(input_).parameters
+    for name in options:
+        if name not in supported:
+            flag = _option_flags.get(name, name)
+            raise inputs.InputError(u'--%s is not supported with -i %s' %
+                                    (flag, args.input))
+    return options
+
+
+def _write_stats(path, timings, sampling=None):
+    data = {u'counters': stats.snapshot()}
+    if timings:
+        data[u'timings'] = timing.snapshot()
+    if sampling:
+        data[u'sampling'] = sampling
+    with io.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
 def excepthook(_type, exc, _traceback):     # pragma: no cover
     sys.stderr.write('httpolice: unhandled exception: %r\n' % exc)
 
@@ -1,18 +1,114 @@
-"""Decoding content and transfer codings."""
+"""Decoding content and transfer codings.
+
+Decoding is done incrementally, and stops as soon as the output grows
+beyond a certain limit (see :func:`decoding_limit`), so that a small
+"compression bomb" cannot exhaust memory. When several codings are applied
+one over another, the limit for each of them is that of the original
+encoded data, so nesting them does not allow for more.
+
+The ``iter_*`` functions take an iterable of encoded chunks
+and produce an iterable of decoded chunks.
+The ``decode_*`` functions are shortcuts for decoding a whole bytestring.
+"""
 
 import zlib
 
 import brotli
 
+from httpolice.util import deadline
+
+
+# Decoded data is never allowed to exceed this many bytes.
+MAX_DECODED_SIZE = 1024 * 1024 * 1024
+
+# Nor is it allowed to be more than this many times larger
+# than the encoded data...
+MAX_RATIO = 200
+
+# ...unless it is smaller than this many bytes anyway.
+RATIO_GRACE_SIZE = 1024 * 1024
+
+# How many bytes to decode in one step.
+CHUNK_SIZE = 64 * 1024
+
+
+class DecodedTooLongError(Exception):
+
+    def __init__(self, max_size):
+        super(DecodedTooLongError, self).__init__(
+            u'decoded data longer than %d bytes' % max_size)
+        self.max_size = max_size
+
+
+def decoding_limit(size):
+    """How many bytes may be decoded from `size` bytes of encoded data."""
+    return min(MAX_DECODED_SIZE, max(RATIO_GRACE_SIZE, size * MAX_RATIO))
+
 
-def decode_gzip(data):
+class _Limiter:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+
+    def __call__(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise DecodedTooLongError(self.limit)
+        return data
+
+
+def iter_gzip(chunks, limit=None):
     # Just ``decompress(data, 16 + zlib.MAX_WBITS)`` doesn't work.
-    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+    return _iter_zlib(zlib.decompressobj(16 + zlib.MAX_WBITS), chunks, limit,
+                      strict=False)
+
+
+def iter_deflate(chunks, limit=None):
+    return _iter_zlib(zlib.decompressobj(), chunks, limit, strict=True)
+
+
+def _iter_zlib(decompressor, chunks, limit, strict):
+    check = _Limiter(limit)
+    for chunk in chunks:
+        while chunk:
+            deadline.check()
+            yield check(decompressor.decompress(chunk, CHUNK_SIZE))
+            chunk = decompressor.unconsumed_tail
+    yield check(decompressor.flush())
+    if strict and not decompressor.eof:
+        # Same as what ``zlib.decompress`` would say.
+        raise zlib.error(u'Error -5 while decompressing data: '
+                         u'incomplete or truncated stream')
+
+
+def iter_brotli(chunks, limit=None):
+    check = _Limiter(limit)
+    decompressor = brotli.Decompressor()
+    for chunk in chunks:
+        if hasattr(decompressor, 'can_accept_more_data'):
+            out = decompressor.process(chunk, output_buffer_limit=CHUNK_SIZE)
+            while out:
+                deadline.check()
+                yield check(out)
+                out = decompressor.process(b'',
+                                           output_buffer_limit=CHUNK_SIZE)
+        else:                                       # pragma: no cover
+            # Older versions of Brotli can't limit the output,
+            # so the best we can do is feed them small pieces of input.
+            for i in range(0, len(chunk), 1024):
+                yield check(decompressor.process(chunk[i : i + 1024]))
+    if not decompressor.is_finished():
+        raise brotli.error(u'brotli: decoder failed')
+
+
+def decode_gzip(data, limit=None):
+    return b''.join(iter_gzip([data], limit))
 
 
-def decode_deflate(data):
-    return zlib.decompress(data)
+def decode_deflate(data, limit=None):
+    return b''.join(iter_deflate([data], limit))
 
 
-def decode_brotli(data):
-    return brotli.decompress(data)
+def decode_brotli(data, limit=None):
+    return b''.join(iter_brotli([data], limit))
@@ -1,6 +1,8 @@
 from httpolice import request, response
 from httpolice.blackboard import Blackboard
 from httpolice.known import st
+from httpolice.structure import Unavailable, okay
+from httpolice.util import deadline, stats, timing
 
 
 class Exchange(Blackboard):
@@ -9,6 +11,8 @@ class Exchange(Blackboard):
     # so notices can be reported directly on it.
     # See :func:`complaint_box`.
 
+    __slots__ = ('request', 'responses')
+
     self_name = u'exch'
 
     def __repr__(self):
@@ -54,8 +58,53 @@ def complaint_box(*args, **kwargs):
     return box
 
 
-def check_exchange(exch):
-    """Run all checks on the exchange `exch`, modifying it in place."""
+def check_exchange(exch, headers_only=False, cache=None, budget=None):
+    """Run all checks on the exchange `exch`, modifying it in place.
+
+    If `headers_only` is true, message bodies are not looked at,
+    like with the ``--headers-only`` option of the command-line tool:
+    non-empty bodies are treated as present but unknown,
+    so checks that depend on their contents are skipped.
+    This may give you fewer notices, but never more.
+
+    If `cache` is a :class:`~httpolice.ResultCache`, the notices of an earlier
+    exchange that differs from `exch` only in volatile headers are reused,
+    like with the ``--cache`` option of the command-line tool.
+
+    If `budget` is a number of seconds, checking stops when it runs out,
+    like with the ``--budget`` option of the command-line tool.
+    The notices found so far are kept, and notice 1313 is added.
+    Returns `False` if checking was stopped, or else `True`.
+    """
+    if budget is None:
+        timing.measure(u'check', _check_exchange, exch, headers_only, cache)
+        return True
+    try:
+        with deadline.limit(budget):
+            timing.measure(u'check', _check_exchange, exch, headers_only,
+                           cache)
+    except deadline.Exceeded:
+        stats.count(u'budget.exceeded')
+        exch.complain(1313, budget=budget)
+        return False
+    return True
+
+
+def _check_exchange(exch, headers_only, cache):
+    if headers_only:
+        for msg in exch.children:
+            if okay(msg.body) and msg.body:
+                msg.body = Unavailable()
+                # Forget anything that was already derived from the body.
+                msg.forget()
+
+    if cache is None:
+        _run_checks(exch)
+    else:
+        cache.check(exch, _run_checks)
+
+
+def _run_checks(exch):
     expect_100 = False
 
     if exch.request:
@@ -3,7 +3,8 @@
 import re
 
 from httpolice.citation import RFC
-from httpolice.codings import decode_deflate, decode_gzip
+from httpolice.codings import (DecodedTooLongError, decode_deflate,
+                               decode_gzip, decoding_limit)
 from httpolice.exchange import Exchange, complaint_box
 from httpolice.known import m, st, tc
 from httpolice.parse import ParseError, Symbol
@@ -52,42 +53,131 @@ def parse_streams(inbound, outbound, scheme=None):
         containing neither request nor responses,
         but only a notice that indicates some general problem with the streams.
     """
+    for (_, exchanges) in walk_streams(inbound, outbound, scheme):
+        for exch in exchanges:
+            yield exch
+
+
+# Parsing a pair of streams proceeds in *steps*. A step is a tuple of
+# ``(kind, inbound_offset, outbound_offset)``, where `kind` is one of:
+#
+# - ``STEP_EXCHANGE``: parse one request from `inbound_offset`,
+#   and, unless `outbound_offset` is `None`, its responses from there;
+# - ``STEP_RESPONSES``: parse responses (without a request)
+#   from `outbound_offset`;
+# - an integer notice ID, for a complaint box with that notice.
+#
+# Every step depends only on its offsets, not on the steps before it.
+# So, once we have walked the streams and recorded their steps
+# (see :func:`index_streams`), we can come back and re-parse
+# any of those steps on its own (see :func:`parse_step`).
+
+STEP_EXCHANGE = u'exchange'
+STEP_RESPONSES = u'responses'
+
+
+def index_streams(inbound, outbound):
+    """Walk one or two HTTP/1.x streams, recording the steps to parse them.
+
+    This is much faster if the streams were constructed with `skip_bodies`,
+    which does not change the steps.
+
+    :return: A list of steps that can be passed to :func:`parse_step`.
+    """
+    return [step for (step, _) in walk_streams(inbound, outbound)]
+
+
+def parse_step(inbound, outbound, step, scheme=None):
+    """Parse one step previously recorded by :func:`index_streams`.
+
+    The `inbound` and `outbound` streams are repositioned as necessary.
+
+    :return: A list of :class:`Exchange` objects.
+    """
+    (kind, inbound_offset, outbound_offset) = step
+    if inbound_offset is not None:
+        inbound.seek(inbound_offset)
+    if outbound_offset is not None:
+        outbound.seek(outbound_offset)
+    if kind == STEP_EXCHANGE:
+        return _exchange_step(inbound, outbound, scheme,
+                              outbound_offset is not None)
+    if kind == STEP_RESPONSES:
+        return _responses_step(outbound)
+    return [_box_step(kind, inbound, outbound)]
+
+
+def walk_streams(inbound, outbound, scheme=None):
+    """Parse one or two HTTP/1.x streams, one step at a time.
+
+    This is like :func:`parse_streams`, but generates pairs of
+    ``(step, exchanges)``, so that the caller can see where every step
+    ends (with ``tell`` on the streams) and stop early.
+    """
     while inbound and inbound.good:
-        (req, req_box) = _parse_request(inbound, scheme)
-        (resps, resp_box) = ([], None)
-        if req:
-            if outbound and outbound.good:
-                (resps, resp_box) = _parse_responses(outbound, req)
-                if resps:
-                    if resps[-1].status == st.switching_protocols:
-                        inbound.sane = False
-                    if req.method == m.CONNECT and resps[-1].status.successful:
-                        inbound.sane = False
-            yield Exchange(req, resps)
-        if req_box:
-            yield req_box
-        if resp_box:
-            yield resp_box
+        outbound_offset = outbound.tell() if outbound and outbound.good \
+            else None
+        step = (STEP_EXCHANGE, inbound.tell(), outbound_offset)
+        yield (step, _exchange_step(inbound, outbound, scheme,
+                                    outbound_offset is not None))
 
     if inbound and not inbound.eof:
         # Some data remains on the inbound stream, but we can't parse it.
-        yield complaint_box(1007, stream=inbound, offset=inbound.tell())
+        step = (1007, inbound.tell(), None)
+        yield (step, [_box_step(1007, inbound, outbound)])
 
     if outbound and outbound.good:
         if inbound:
             # We had some requests, but we ran out of them.
             # We'll still try to parse the remaining responses on their own.
-            yield complaint_box(1008, stream=outbound)
+            step = (1008, None, None)
+            yield (step, [_box_step(1008, inbound, outbound)])
         while outbound.good:
-            (resps, resp_box) = _parse_responses(outbound, None)
-            if resps:
-                yield Exchange(None, resps)
-            if resp_box:
-                yield resp_box
+            step = (STEP_RESPONSES, None, outbound.tell())
+            yield (step, _responses_step(outbound))
 
     if outbound and not outbound.eof:
         # Some data remains on the outbound stream, but we can't parse it.
-        yield complaint_box(1010, stream=outbound, offset=outbound.tell())
+        step = (1010, None, outbound.tell())
+        yield (step, [_box_step(1010, inbound, outbound)])
+
+
+def _exchange_step(inbound, outbound, scheme, with_responses):
+    r = []
+    (req, req_box) = _parse_request(inbound, scheme)
+    (resps, resp_box) = ([], None)
+    if req:
+        if with_responses:
+            (resps, resp_box) = _parse_responses(outbound, req)
+            if resps:
+                if resps[-1].status == st.switching_protocols:
+                    inbound.sane = False
+                if req.method == m.CONNECT and resps[-1].status.successful:
+                    inbound.sane = False
+        r.append(Exchange(req, resps))
+    if req_box:
+        r.append(req_box)
+    if resp_box:
+        r.append(resp_box)
+    return r
+
+
+def _responses_step(outbound):
+    r = []
+    (resps, resp_box) = _parse_responses(outbound, None)
+    if resps:
+        r.append(Exchange(None, resps))
+    if resp_box:
+        r.append(resp_box)
+    return r
+
+
+def _box_step(notice_id, inbound, outbound):
+    if notice_id == 1007:
+        return complaint_box(1007, stream=inbound, offset=inbound.tell())
+    if notice_id == 1008:
+        return complaint_box(1008, stream=outbound)
+    return complaint_box(1010, stream=outbound, offset=outbound.tell())
 
 
 def _parse_request(stream, scheme=None):
@@ -131,12 +221,21 @@ def _process_content_length(msg, stream):
                      max_size=MAX_BODY_SIZE)
     else:
         try:
-            msg.body = stream.read(n)
+            msg.body = _read_body(stream, n)
         except ParseError as exc:
             msg.body = Unavailable()
             msg.complain(1004, error=exc)
 
 
+def _read_body(stream, n=-1):
+    # Read `n` bytes (or all remaining data) from `stream` as a message body.
+    # If we are skipping bodies, we still have to respect their framing,
+    # but all we can say about the body is whether it was empty.
+    if stream.skip_bodies:
+        return Unavailable() if stream.skip(n) else b''
+    return stream.read(n)
+
+
 def _parse_request_body(req, stream):
     # RFC 7230 section 3.3.3.
 
@@ -148,8 +247,7 @@ def _parse_request_body(req, stream):
             req.body = Unavailable()
             req.complain(1001)
             stream.sane = False
-        while codings and okay(req.body):
-            _decode_transfer_coding(req, codings.pop())
+        _decode_transfer_codings(req, codings)
 
     elif req.headers.content_length:
         _process_content_length(req, stream)
@@ -225,15 +323,14 @@ def _parse_response_body(resp, stream):
             codings.pop()
             _parse_chunked(resp, stream)
         else:
-            resp.body = stream.read()
-        while codings and okay(resp.body):
-            _decode_transfer_coding(resp, codings.pop())
+            resp.body = _read_body(stream)
+        _decode_transfer_codings(resp, codings)
 
     elif resp.headers.content_length.is_present:
         _process_content_length(resp, stream)
 
     else:
-        resp.body = stream.read()
+        resp.body = _read_body(stream)
 
 
 def parse_header_fields(stream):
@@ -261,20 +358,25 @@ def parse_header_fields(stream):
     return entries
 
 
-def _decode_transfer_coding(msg, coding):
+def _decode_transfer_codings(msg, codings):
+    if okay(msg.body):
+        limit = decoding_limit(len(msg.body))
+    while codings and okay(msg.body):
+        _decode_transfer_coding(msg, codings.pop(), limit)
+
+
+def _decode_transfer_coding(msg, coding, limit):
     if coding == tc.chunked:
         # The outermost chunked has already been peeled off at this point.
         msg.complain(1002)
         msg.body = Unavailable(msg.body)
-    elif coding in [tc.gzip, tc.x_gzip]:
+    elif coding in [tc.gzip, tc.x_gzip, tc.deflate]:
+        decoder = decode_deflate if coding == tc.deflate else decode_gzip
         try:
-            msg.body = decode_gzip(msg.body)
-        except Exception as e:
-            msg.complain(1027, coding=coding, error=e)
+            msg.body = decoder(msg.body, limit)
+        except DecodedTooLongError as e:
+            msg.complain(1311, coding=coding, max_size=e.max_size)
             msg.body = Unavailable(msg.body)
-    elif coding == tc.deflate:
-        try:
-            msg.body = decode_deflate(msg.body)
         except Exception as e:
             msg.complain(1027, coding=coding, error=e)
             msg.body = Unavailable(msg.body)
@@ -293,8 +395,9 @@ class BodyTooLongError(Exception):
         self.max_size = max_size
 
 
-def _parse_chunk(stream, data):
-    current_size = sum(len(c) for c in data)
+def _parse_chunk(stream, data, current_size):
+    # Parse one chunk, appending its data to `data` (unless skipping bodies).
+    # Return the size of the chunk, which is 0 for the last chunk.
     with stream.parsing(chunk):
         pos = stream.tell()
         (size_s, _, _) = stream.readline().partition(u';')
@@ -304,21 +407,27 @@ def _parse_chunk(stream, data):
             except ValueError:
                 raise stream.error(pos)
         if size == 0:
-            return False
+            return 0
         if size + current_size > MAX_BODY_SIZE:
             stream.sane = False
             raise BodyTooLongError(size + current_size, MAX_BODY_SIZE)
-        data.append(stream.read(size))
+        if stream.skip_bodies:
+            stream.skip(size)
+        else:
+            data.append(stream.read(size))
         stream.readlineend()
-        return True
+        return size
 
 
 def _parse_chunked(msg, stream):
     data = []
+    total_size = 0
     place = u'chunked framing'
     try:
-        while _parse_chunk(stream, data):
-            pass
+        size = _parse_chunk(stream, data, total_size)
+        while size:
+            total_size += size
+            size = _parse_chunk(stream, data, total_size)
         trailer = parse_header_fields(stream)
         with stream.parsing(chunked_body):
             stream.readlineend()
@@ -330,7 +439,10 @@ def _parse_chunked(msg, stream):
         msg.body = Unavailable()
     else:
         stream.dump_complaints(msg.complain, place=place)
-        msg.body = b''.join(data)
+        if stream.skip_bodies:
+            msg.body = Unavailable() if total_size else b''
+        else:
+            msg.body = b''.join(data)
         msg.trailer_entries = trailer
         if trailer:
             msg.rebuild_headers()           # Rebuild the `HeadersView` cache
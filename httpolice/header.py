@@ -22,13 +22,25 @@ from httpolice.known import HeaderRule, h
 from httpolice.parse import parse
 from httpolice.structure import MultiDict, Parametrized, Unavailable, okay
 from httpolice.syntax.rfc7230 import quoted_string, token
+from httpolice.util import timing
 from httpolice.util.data import duplicates
 
 
+#: The IDs of all notices that can be reported when parsing headers,
+#: here and in the grammar (:mod:`httpolice.syntax`).
+PARSE_NOTICES = frozenset([
+    1000, 1013, 1014, 1015, 1017, 1026, 1107, 1108, 1119, 1133, 1148, 1151,
+    1154, 1155, 1156, 1157, 1158, 1196, 1222, 1223, 1225, 1226, 1253, 1254,
+    1256, 1257, 1282, 1296, 1297, 1299, 1300, 1307, 1308, 1309,
+])
+
+
 class HeadersView:
 
     """Wraps all headers of a single message, exposing them as attributes."""
 
+    __slots__ = ('_message', '_cache')
+
     special_cases = {}
 
     @classmethod
@@ -68,6 +80,15 @@ class HeadersView:
 
         return self._cache[key]
 
+    def release(self):
+        """Forget the views that can be made again without any difference."""
+        # That is, the views of absent headers (which report nothing
+        # when parsed) and of headers that are not parsed yet.
+        # pylint: disable=protected-access
+        present = set(self.names)
+        self._cache = {name: view for (name, view) in self._cache.items()
+                       if name in present and view._entries is not None}
+
     @property
     def names(self):
         seen = set()
@@ -113,14 +134,33 @@ class HeaderView:
 
     """
 
+    # There is a view for every header that the checks look at,
+    # in every message, so they had better be small.
+    # The special cases (such as :class:`CacheControlView`)
+    # override `name` with a class attribute.
+    __slots__ = ('message', '_name', '_entries', '_value')
+
     def __init__(self, message, name):
         self.message = message
-        self.name = name
+        self._name = name
         self._entries = self._value = None
 
+    @property
+    def name(self):
+        return self._name
+
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.name)
 
+    def detached(self):
+        """A parsed copy of this view that no longer refers to the message."""
+        # pylint: disable=protected-access
+        value = self.value
+        r = self.__class__(None, self.name)
+        r._entries = self._entries
+        r._value = value
+        return r
+
     def _process_parsed(self, entry, parsed):
         # pylint: disable=unused-argument
         return parsed
@@ -271,6 +311,8 @@ class UnknownHeaderView(HeaderView):
 
     """Wraps a generic header that we know nothing about."""
 
+    __slots__ = ()
+
     def _parse(self):
         # RFC 7230 section 3.2.2 permits combining field-values with a comma
         # even if we don't really know what the header is.
@@ -283,8 +325,10 @@ class SingleHeaderView(HeaderView):
 
     """Wraps a header that can only appear once in a message."""
 
+    __slots__ = ()
+
     def _parse(self):
-        entries, values = self._pre_parse()
+        entries, values = timing.measure(u'headers', self._pre_parse)
         if entries:
             if len(entries) > 1:
                 self.message.complain(1013, header=self, entries=entries)
@@ -299,8 +343,10 @@ class MultiHeaderView(HeaderView):
 
     """Wraps a header that can appear multiple times in a message."""
 
+    __slots__ = ()
+
     def _parse(self):
-        entries, values = self._pre_parse()
+        entries, values = timing.measure(u'headers', self._pre_parse)
         # Some headers, such as ``Vary``, permit both a comma-separated list
         # (which can be spread over multiple entries) as well as a singular
         # value (which cannot be combined with any other).
@@ -332,6 +378,8 @@ class ArgumentsView(HeaderView):           # pylint: disable=abstract-method
     pairs, and the argument needs to be parsed depending on the name.
     """
 
+    __slots__ = ()
+
     knowledge = None
 
     def _process_parsed(self, entry, parsed):
@@ -359,6 +407,8 @@ class DirectivesView(ArgumentsView):        # pylint: disable=abstract-method
 
     """For a header whose value is a list of ``directive[=argument]`` pairs."""
 
+    __slots__ = ()
+
     def __getattr__(self, name):
         return self[getattr(self.knowledge.accessor, name)]
 
@@ -372,6 +422,8 @@ class DirectivesView(ArgumentsView):        # pylint: disable=abstract-method
 @HeadersView.special_case
 class CacheControlView(DirectivesView, MultiHeaderView):
 
+    __slots__ = ()
+
     name = h.cache_control
     knowledge = known.cache_directive
 
@@ -395,6 +447,8 @@ class CacheControlView(DirectivesView, MultiHeaderView):
 @HeadersView.special_case
 class StrictTransportSecurityView(DirectivesView, SingleHeaderView):
 
+    __slots__ = ()
+
     name = h.strict_transport_security
     knowledge = known.hsts_directive
 
@@ -402,6 +456,8 @@ class StrictTransportSecurityView(DirectivesView, SingleHeaderView):
 @HeadersView.special_case
 class AltSvcView(ArgumentsView, MultiHeaderView):
 
+    __slots__ = ()
+
     name = h.alt_svc
     knowledge = known.alt_svc_param
 
@@ -420,6 +476,8 @@ class AltSvcView(ArgumentsView, MultiHeaderView):
 @HeadersView.special_case
 class PreferView(DirectivesView, MultiHeaderView):
 
+    __slots__ = ()
+
     name = h.prefer
     knowledge = known.preference
 
@@ -445,6 +503,8 @@ class PreferView(DirectivesView, MultiHeaderView):
 @HeadersView.special_case
 class PreferenceAppliedView(DirectivesView, MultiHeaderView):
 
+    __slots__ = ()
+
     name = h.preference_applied
     knowledge = known.preference
 
@@ -452,6 +512,8 @@ class PreferenceAppliedView(DirectivesView, MultiHeaderView):
 @HeadersView.special_case
 class ForwardedView(ArgumentsView, MultiHeaderView):
 
+    __slots__ = ()
+
     name = h.forwarded
     knowledge = known.forwarded_param
 
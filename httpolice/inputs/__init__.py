@@ -3,6 +3,39 @@
 Every input format is implemented as a function with the following interface:
 
 - it accepts a list of paths (to files or directories, depends on the format);
+  for formats that take files, a path may be ``-`` for standard input
+  (:data:`httpolice.inputs.packed.STDIN`) or a named pipe,
+  which are read without seeking;
+- it accepts a `headers_only` keyword argument: if true, message bodies
+  are skipped, and only their framing is checked;
+- stream-based formats also accept an `index` keyword argument:
+  the path to a file where the framing of the input is remembered
+  (see :func:`httpolice.framing1.index_streams`), so that it can be reused
+  on later runs; the ``har`` format accepts it too, but only with `parts`,
+  to remember where the entries begin;
+- formats that read many connections (stream-based and ``pcap``)
+  also accept a `reorder` keyword argument:
+  if false, exchanges from different connections are not interleaved
+  by time, but simply returned one connection after another;
+- the ``tcpflow`` and ``tcpick`` formats also accept a `follow` keyword
+  argument: if true, the directories are watched for new data until
+  interrupted, with connections finished after `idle_timeout` seconds
+  without growth, and progress kept in the `checkpoint` file (if any);
+- the ``tcpflow``, ``tcpick``, ``pcap``, and ``har`` formats also accept
+  `since` and `until` keyword arguments: naive UTC datetimes (or `None`)
+  outside of which connections or entries are skipped
+  (see :mod:`httpolice.inputs.filters`);
+- the ``tcpflow``, ``tcpick``, and ``pcap`` formats also accept
+  a `sample_connections` keyword argument: if not `None`, only this
+  fraction of connections is read (see :mod:`httpolice.sampling`);
+- the ``ndjson`` format also accepts a `lines` keyword argument:
+  a pair of 1-based line numbers ``(first, last)`` (either may be `None`)
+  to read only these lines of every file;
+- it accepts a `parts` keyword argument: if true, instead of exchanges,
+  it returns a pair ``(parts, reorder)``, where `parts` is a list of
+  :class:`~httpolice.inputs.common.Part` that can be read independently
+  (as by :func:`httpolice.parallel.run_parts`), and `reorder` tells
+  whether their exchanges should be interleaved by time;
 - it returns an iterable of :class:`~httpolice.Exchange`;
 - it may raise :exc:`InputError` on fatal errors;
 - it may pass through :exc:`EnvironmentError` on errors like invalid paths;
@@ -11,6 +44,8 @@ Every input format is implemented as a function with the following interface:
 
 from httpolice.inputs.common import InputError
 from httpolice.inputs.har import har_input
+from httpolice.inputs.ndjson import ndjson_input
+from httpolice.inputs.pcap import pcap_input
 from httpolice.inputs.streams import (
     combined_input,
     req_stream_input,
@@ -29,4 +64,6 @@ formats = {
     u'tcpflow': tcpflow_input,
     u'combined': combined_input,
     u'har': har_input,
+    u'ndjson': ndjson_input,
+    u'pcap': pcap_input,
 }
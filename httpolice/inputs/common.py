@@ -1,3 +1,17 @@
+from collections import namedtuple
+
+
 class InputError(Exception):
 
     pass
+
+
+# With ``--jobs``, an input is split into *parts* that are parsed
+# independently of each other (see :mod:`httpolice.parallel`).
+# A part's exchanges are produced by calling ``func(*args)``,
+# where `func` is a module-level function (so that it can be sent
+# to a worker process). `time_hint` is as in the `sequences`
+# of `httpolice.inputs.streams._rearrange_by_time`. If `local` is true,
+# the part can only be parsed in the main process (for example,
+# because it reads standard input).
+Part = namedtuple('Part', ['func', 'args', 'time_hint', 'local'])
@@ -0,0 +1,184 @@
+"""Opening many input files without running out of file descriptors.
+
+A capture directory may have tens of thousands of connections that are
+"in progress" at the same time, because the stream-based inputs
+interleave them by time. Rather than keep all of their files open,
+we open them through a :class:`FilePool`, which closes the least recently
+used files when there are too many, and transparently reopens them
+(at the same position) when they are needed again.
+Files that can't be reopened like that, such as pipes, are kept open.
+"""
+
+from collections import OrderedDict
+import io
+import os
+
+from httpolice.inputs.packed import open_input
+from httpolice.util import stats
+
+try:
+    import resource
+except ImportError:                         # pragma: no cover
+    resource = None                         # Not available on Windows.
+
+
+def scan_directory(path):
+    """Generate :func:`os.scandir` entries for the directory at `path`.
+
+    On Python 3.4, which has no :func:`os.scandir`, this falls back to
+    :func:`os.listdir`, and every ``stat()`` is a separate system call.
+    """
+    if not hasattr(os, 'scandir'):          # pragma: no cover
+        for name in os.listdir(path):
+            yield _ListedEntry(path, name)
+        return
+    entries = os.scandir(path)
+    try:
+        yield from entries
+    finally:
+        # Can't use ``with`` because this is only a context manager
+        # since Python 3.6.
+        if hasattr(entries, 'close'):
+            entries.close()
+
+
+class _ListedEntry:                         # pragma: no cover
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+# Never keep more than this many files open at the same time,
+# nor more than half of what the OS allows for this process.
+MAX_OPEN_FILES = 256
+
+
+def _default_max_open():
+    limit = MAX_OPEN_FILES
+    if resource is not None:
+        (soft, _) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            limit = min(limit, max(soft // 2, 1))
+    return limit
+
+
+class FilePool:
+
+    def __init__(self, max_open=None):
+        self.max_open = max_open or _default_max_open()
+        self._open = OrderedDict()      # `PooledFile` -> `None`, LRU first.
+
+    def open(self, path):
+        """Return a :class:`PooledFile` for reading `path` in binary mode.
+
+        Compressed files and archive members are supported
+        as in :func:`~httpolice.inputs.packed.open_input`.
+
+        The file is opened right away, so that errors like a wrong path
+        surface here.
+        """
+        f = PooledFile(self, path)
+        f.peek(0)
+        return f
+
+    def touch(self, f):
+        """Note that `f` is about to be used, making room for it if needed."""
+        if f in self._open:
+            self._open.move_to_end(f)
+            return
+        while len(self._open) >= self.max_open:
+            (victim, _) = self._open.popitem(last=False)
+            victim.suspend()
+        self._open[f] = None
+
+    def forget(self, f):
+        self._open.pop(f, None)
+
+
+class PooledFile:
+
+    """A read-only binary file that may be closed behind the scenes.
+
+    Supports only the operations needed by :class:`httpolice.stream.Stream`.
+    """
+
+    def __init__(self, pool, path):
+        self.pool = pool
+        self.path = path
+        self.closed = False
+        self._file = None
+        self._pos = 0
+        self._was_open = False
+        self._pinned = False            # Never to be suspended.
+
+    def _get(self):
+        if self._pinned:
+            return self._file
+        if self._file is None:
+            if self.closed:
+                raise ValueError(u'I/O operation on closed file')
+            self.pool.touch(self)
+            try:
+                self._file = open_input(self.path)
+            except EnvironmentError:
+                self.pool.forget(self)
+                raise
+            if self._was_open:
+                stats.count(u'files.reopened')
+                self._file.seek(self._pos)
+            else:
+                stats.count(u'files.opened')
+                if not self._file.seekable():
+                    self._pinned = True
+                    self.pool.forget(self)
+            self._was_open = True
+        else:
+            self.pool.touch(self)
+        return self._file
+
+    def suspend(self):
+        """Close the underlying file, remembering the position."""
+        if self._file is not None and not self._pinned:
+            self._pos = self._file.tell()
+            self._file.close()
+            self._file = None
+
+    def tell(self):
+        if self._file is None:
+            return self._pos
+        return self._file.tell()
+
+    def seekable(self):
+        return self._get().seekable()
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        return self._get().seek(pos, whence)
+
+    def peek(self, n=1):
+        return self._get().peek(n)
+
+    def read(self, n=-1):
+        return self._get().read(n)
+
+    def readline(self, limit=-1):
+        return self._get().readline(limit)
+
+    def close(self):
+        if self._pinned:
+            self._file.close()
+            self._file = None
+            self._pinned = False
+        self.suspend()
+        self.pool.forget(self)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _exc_traceback):
+        self.close()
+        return False
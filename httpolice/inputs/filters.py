@@ -0,0 +1,106 @@
+"""Narrowing down the input to the exchanges of interest.
+
+Time filters (``--since`` and ``--until``) are pushed down into
+those input formats that know when their connections or entries happened,
+so that whatever falls outside the window is skipped before it is even
+parsed. Host and target filters (``--host`` and ``--target-prefix``)
+apply to parsed exchanges, but before they are checked.
+What is skipped at every stage is counted in :mod:`httpolice.util.stats`.
+"""
+
+from datetime import datetime, timedelta
+import re
+from urllib.parse import urlsplit
+
+from httpolice.structure import okay
+
+
+_TIMESTAMP = re.compile(
+    r'^(\d{4}-\d\d-\d\d)'                          # Date.
+    r'(?:[T ](\d\d:\d\d(?::\d\d)?)(?:[.,](\d+))?)?'   # Time and fraction.
+    r'(Z|[+-]\d\d(?::?\d\d)?)?$',                    # UTC offset.
+    re.IGNORECASE)
+
+
+def parse_timestamp(s):
+    """Parse an ISO 8601 timestamp into a naive UTC `datetime`.
+
+    A timestamp without a UTC offset is taken to be in UTC already.
+    Raises `ValueError` if `s` is not such a timestamp.
+
+    >>> parse_timestamp(u'2016-07-28T13:06:13.012+03:00')
+    datetime.datetime(2016, 7, 28, 10, 6, 13, 12000)
+    >>> parse_timestamp(u'2016-07-28T10:06:13Z')
+    datetime.datetime(2016, 7, 28, 10, 6, 13)
+    >>> parse_timestamp(u'2016-07-28 10:06-0130')
+    datetime.datetime(2016, 7, 28, 11, 36)
+    >>> parse_timestamp(u'2016-07-28')
+    datetime.datetime(2016, 7, 28, 0, 0)
+    """
+    # Not `datetime.fromisoformat`, which is missing before Python 3.7
+    # and doesn't take a ``Z`` before Python 3.11.
+    match = _TIMESTAMP.match(s)
+    if match is None:
+        raise ValueError(u'not an ISO 8601 timestamp: %r' % s)
+    (date, time, fraction, offset) = match.groups()
+    time = time or u'00:00'
+    r = datetime.strptime(date + u'T' + time,
+                          u'%Y-%m-%dT%H:%M:%S' if len(time) > 5
+                          else u'%Y-%m-%dT%H:%M')
+    if fraction:
+        r = r.replace(microsecond=int(fraction[:6].ljust(6, u'0')))
+    if offset and offset.upper() != u'Z':
+        digits = offset[1:].replace(u':', u'')
+        delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+        r = r - delta if offset[0] == u'+' else r + delta
+    return r
+
+
+def in_window(since, until, start, end=None):
+    """Can something from `start` to `end` fall between `since` and `until`?
+
+    Any of these may be `None`, meaning no limit (for `since` and `until`)
+    or unknown (for `start` and `end`). If `end` is `None`, it is `start`.
+
+    >>> in_window(datetime(2019, 1, 1), None, datetime(2018, 1, 1))
+    False
+    >>> in_window(datetime(2019, 1, 1), None,
+    ...           datetime(2018, 1, 1), datetime(2019, 6, 1))
+    True
+    >>> in_window(None, datetime(2019, 1, 1), None, datetime(2019, 6, 1))
+    True
+    """
+    if end is None:
+        end = start
+    if since is not None and end is not None and end < since:
+        return False
+    if until is not None and start is not None and start > until:
+        return False
+    return True
+
+
+def exchange_matches(exch, hosts=None, target_prefixes=None):
+    """Does `exch` match the ``--host`` and ``--target-prefix`` filters?
+
+    An exchange without a request (such as a complaint box) always matches,
+    because there is nothing to tell where it belongs.
+    """
+    req = exch.request
+    if req is None:
+        return True
+    if not hosts and not target_prefixes:
+        return True
+    uri = req.effective_uri
+    parts = urlsplit(uri) if okay(uri) else None
+    if hosts:
+        host = parts.hostname if parts else None
+        if host is None or host not in hosts:
+            return False
+    if target_prefixes:
+        if parts:
+            path = parts.path + (u'?' + parts.query if parts.query else u'')
+        else:
+            path = req.target
+        if not any(path.startswith(prefix) for prefix in target_prefixes):
+            return False
+    return True
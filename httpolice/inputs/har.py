@@ -1,49 +1,302 @@
 import base64
+import codecs
+from collections import OrderedDict
 import io
 import json
+import os
+import tempfile
 from urllib.parse import urlparse
 
+from httpolice.blackboard import Lazy
 from httpolice.exchange import Exchange
 from httpolice.helpers import pop_pseudo_headers
-from httpolice.inputs.common import InputError
+from httpolice.inputs.common import InputError, Part
+from httpolice.inputs.filters import in_window, parse_timestamp
+from httpolice.inputs.jsonstream import JSONScanError, JSONScanner
+from httpolice.inputs.packed import (
+    can_reopen,
+    display_name,
+    is_compressed,
+    open_input,
+)
 from httpolice.known import h, m, st
 from httpolice.request import Request
 from httpolice.response import Response
 from httpolice.structure import FieldName, StatusCode, Unavailable
+from httpolice.util import stats
 from httpolice.util.text import decode_path
 
 
+# Derived properties of messages (such as ``decoded_body``) get their slots
+# from :class:`httpolice.blackboard.Blackboard`, which confuses pylint.
+# pylint: disable=assigning-non-slot
+
+
 FIDDLER = [u'Fiddler']
 CHROME = [u'WebInspector']
 FIREFOX = [u'Firefox']
 EDGE = [u'F12 Developer Tools']
 
 
-def har_input(paths):
+def har_input(paths, headers_only=False, since=None, until=None,
+              index=None, parts=False):
+    if parts:
+        return (_parts(paths, headers_only, since, until, index), False)
+    if index is not None:
+        raise InputError(u'--index requires --jobs with -i har')
+    return _exchanges(paths, headers_only, since, until)
+
+
+def _exchanges(paths, headers_only=False, since=None, until=None):
     for path in paths:
-        # According to the spec, HAR files are UTF-8 with an optional BOM.
         path = decode_path(path)
-        with io.open(path, 'rt', encoding='utf-8-sig') as f:
-            try:
+        name = display_name(path)
+        try:
+            with open_input(path) as f:
+                for (creator, entry) in _read_entries(name, f):
+                    if not _entry_in_window(entry, since, until):
+                        stats.count(u'filter.entries_skipped')
+                        continue
+                    yield _process_entry(entry, creator, name, headers_only)
+        except (TypeError, KeyError) as exc:
+            raise InputError('%s: cannot understand HAR file: %r' %
+                             (name, exc)) from exc
+
+
+def _read_entries(path, f, offsets_only=False):
+    # HAR files can be huge, so rather than load the whole file,
+    # we walk through it and decode one entry at a time.
+    # This yields pairs of (creator name, entry data),
+    # or (creator name, offset of the entry in the file) if `offsets_only`.
+    # `f` need not be seekable (it may be a pipe).
+
+    def walk_entries(scanner):
+        for _ in scanner.iter_array():
+            if offsets_only:
+                scanner.peek()
+                offset = scanner.tell()
+                scanner.skip_value()
+                yield (creator, offset)
+            else:
+                yield (creator, scanner.load())
+
+    # According to the spec, HAR files are UTF-8 with an optional BOM.
+    offset = 0
+    if f.peek(3)[:3] == codecs.BOM_UTF8:
+        offset = len(f.read(3))
+    scanner = JSONScanner(f, offset=offset)
+    seen_entries = False
+    later = None        # Where to find the entries once we know the creator.
+    spool = None
+    try:
+        if scanner.peek() != b'{':
+            raise TypeError(u'top-level value is %r' % scanner.load())
+        creator = None
+        seen_log = False
+        for key in scanner.iter_object():
+            if key != u'log':
+                scanner.skip_value()
+                continue
+            seen_log = True
+            if scanner.peek() != b'{':
+                raise TypeError(u'log is %r' % scanner.load())
+            for log_key in scanner.iter_object():
+                if log_key == u'creator':
+                    creator = scanner.load()['name']
+                elif log_key == u'entries':
+                    if scanner.peek() != b'[':
+                        raise TypeError(u'entries is %r' % scanner.load())
+                    seen_entries = True
+                    if creator is not None:
+                        for pair in walk_entries(scanner):
+                            yield pair
+                    elif f.seekable():
+                        # Have to come back here once we know the creator.
+                        later = (scanner, scanner.tell())
+                        scanner.skip_value()
+                    else:
+                        # Can't come back, so save the entries for later.
+                        spool = tempfile.TemporaryFile()
+                        scanner.copy_value(spool)
+                        later = (JSONScanner(spool), 0)
+                else:
+                    scanner.skip_value()
+        if scanner.peek() != b'':
+            raise JSONScanError(u'extra data at byte %d' % scanner.tell())
+        if not seen_log:
+            raise KeyError(u'log')
+        if creator is None:
+            raise KeyError(u'creator')
+        if not seen_entries:
+            raise KeyError(u'entries')
+        if later is not None:
+            (scanner, entries_offset) = later
+            scanner.seek(entries_offset)
+            for pair in walk_entries(scanner):
+                yield pair
+    except ValueError as exc:       # Includes `UnicodeDecodeError`.
+        raise InputError('%s: bad HAR file: %s' % (path, exc)) from exc
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+# With ``httpolice --jobs``, the entries of a HAR file are read and checked
+# in worker processes (see :mod:`httpolice.parallel`). To hand them out,
+# we need to know where every entry begins, so we scan the file once.
+# With ``httpolice --index``, this is also remembered in the given file.
+
+# How many entries to give a worker at a time.
+BATCH_SIZE = 64
+
+
+class _EntryIndex:
+
+    """Where the entries of HAR files begin (``--index`` with ``--jobs``).
+
+    Offsets are stored along with the sizes and modification times
+    of the files, so that changed files can be re-scanned.
+    If `path` is `None`, nothing is loaded or saved.
+    """
+
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        # Absolute path -> ``[stats, creator, offsets]``.
+        self.files = OrderedDict()
+        self._changed = False
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with io.open(self.path, 'rt', encoding='utf-8') as f:
                 data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as exc:
+            raise InputError(u'%s: bad index file: %s' % (self.path, exc)) \
+                from exc
+        if not isinstance(data, dict) or u'httpolice_har_index' not in data:
+            raise InputError(u'%s: not an HTTPolice index file for HAR'
+                             % self.path)
+        if data[u'httpolice_har_index'] != self.version:
+            return              # Will be rebuilt.
+        for item in data[u'files']:
+            self.files[item[u'path']] = \
+                [item[u'stats'], item[u'creator'], item[u'offsets']]
+
+    def save(self):
+        if self.path is None or not self._changed:
+            return
+        data = {
+            u'httpolice_har_index': self.version,
+            u'files': [
+                {u'path': path, u'stats': file_stats,
+                 u'creator': creator, u'offsets': offsets}
+                for (path, (file_stats, creator, offsets))
+                in self.files.items()
+            ],
+        }
+        tmp_path = self.path + u'.tmp'
+        with io.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self._changed = False
+
+    def entries(self, path):
+        """Return ``(creator, offsets)`` for the HAR file at `path`."""
+        key = os.path.abspath(path)
+        stat_result = os.stat(path)
+        file_stats = [stat_result.st_size, stat_result.st_mtime_ns]
+        item = self.files.get(key)
+        if item is None or item[0] != file_stats:
+            creator = None
+            offsets = []
+            with io.open(path, 'rb') as f:
+                for (creator, offset) in _read_entries(path, f,
+                                                       offsets_only=True):
+                    offsets.append(offset)
+            item = self.files[key] = [file_stats, creator, offsets]
+            self._changed = True
+        return (item[1], item[2])
+
+
+def _entry_in_window(data, since, until):
+    if since is None and until is None:
+        return True
+    try:
+        started = parse_timestamp(data['startedDateTime'])
+    except (TypeError, KeyError, ValueError):
+        started = None          # Can't tell, so keep it.
+    return in_window(since, until, started)
+
+
+def _read_batch(path, offsets):
+    # The entries in `offsets` follow each other in the file,
+    # so we only need to seek to the first one.
+    with io.open(path, 'rb') as f:
+        scanner = JSONScanner(f)
+        scanner.seek(offsets[0])
+        for i in range(len(offsets)):
+            try:
+                if i > 0:
+                    scanner.expect(b',')
+                entry = scanner.load()
             except ValueError as exc:
-                raise InputError('%s: bad HAR file: %s' % (path, exc)) from exc
+                raise InputError('%s: bad HAR file: %s' % (path, exc)) \
+                    from exc
+            yield entry
+
+
+def _parts(paths, headers_only, since, until, index=None):
+    # For ``httpolice --jobs``: batches of entries from every HAR file
+    # that can be read out of order, or else the whole file.
+    index = _EntryIndex(index)
+    r = []
+    for path in paths:
+        path = decode_path(path)
+        if can_reopen(path) and not is_compressed(path):
             try:
-                creator = data['log']['creator']['name']
-                for entry in data['log']['entries']:
-                    yield _process_entry(entry, creator, path)
+                (creator, offsets) = index.entries(path)
             except (TypeError, KeyError) as exc:
                 raise InputError('%s: cannot understand HAR file: %r' %
                                  (path, exc)) from exc
+            for i in range(0, len(offsets), BATCH_SIZE):
+                r.append(Part(_batch_exchanges,
+                              (path, creator, offsets[i : i + BATCH_SIZE],
+                               headers_only, since, until),
+                              None, local=False))
+        else:
+            # Pipes can't be read out of order at all,
+            # and compressed files can't be read out of order efficiently.
+            r.append(Part(_exchanges, ([path], headers_only, since, until),
+                          None, local=not can_reopen(path)))
+    index.save()
+    return r
+
 
+def _batch_exchanges(path, creator, offsets, headers_only, since, until):
+    try:
+        for entry in _read_batch(path, offsets):
+            if not _entry_in_window(entry, since, until):
+                stats.count(u'filter.entries_skipped')
+                continue
+            yield _process_entry(entry, creator, path, headers_only)
+    except (TypeError, KeyError) as exc:
+        raise InputError('%s: cannot understand HAR file: %r' %
+                         (path, exc)) from exc
 
-def _process_entry(data, creator, path):
-    req = _process_request(data['request'], creator, path)
-    resp = _process_response(data['response'], req, creator, path)
+
+def _process_entry(data, creator, path, headers_only=False):
+    req = _process_request(data['request'], creator, path, headers_only)
+    resp = _process_response(data['response'], req, creator, path,
+                             headers_only)
     return Exchange(req, [resp] if resp is not None else [])
 
 
-def _process_request(data, creator, path):
+def _process_request(data, creator, path, headers_only=False):
     version, header_entries = _process_message(data, creator)
     method = data['method']
     parsed = urlparse(data['url'])
@@ -89,20 +342,22 @@ def _process_request(data, creator, path):
 
     req = Request(scheme, method, target, version, header_entries, body,
                   remark=u'from %s' % path)
-    if text is not None:
+    if text is not None and not headers_only:
         req.unicode_body = text
     req.is_to_proxy = None                      # See above.
     return req
 
 
-def _process_response(data, req, creator, path):
+def _process_response(data, req, creator, path, headers_only=False):
     if data['status'] == 0:          # Indicates error in Chrome.
         return None
     version, header_entries = _process_message(data, creator)
     status = StatusCode(data['status'])
     reason = data['statusText']
 
-    if creator in FIDDLER and req.method == m.CONNECT and status.successful:
+    fiddler_connect = (creator in FIDDLER and req.method == m.CONNECT and
+                       status.successful)
+    if fiddler_connect:
         # Fiddler's HAR export adds extra debug headers to CONNECT responses
         # after the tunnel is closed.
         header_entries = [(name, value)
@@ -127,22 +382,30 @@ def _process_response(data, req, creator, path):
     resp = Response(version, status, reason, header_entries, body=body,
                     remark=u'from %s' % path)
 
-    if data['content'].get('text') and status != st.not_modified:
+    # When `headers_only`, we don't even look at the body,
+    # except to work around the Fiddler quirk below.
+    if data['content'].get('text') and status != st.not_modified and \
+            (fiddler_connect or not headers_only):
         if data['content'].get('encoding', u'').lower() == u'base64':
-            try:
-                decoded_body = base64.b64decode(data['content']['text'])
-            except ValueError:
-                pass
-            else:
-                if creator in FIDDLER and req.method == m.CONNECT and \
-                        status.successful and b'Fiddler' in decoded_body:
-                    # Fiddler's HAR export adds a body with debug information
-                    # to CONNECT responses.
-                    resp.body = b''
+            text = data['content']['text']
+            if fiddler_connect:
+                try:
+                    decoded_body = base64.b64decode(text)
+                except ValueError:
+                    pass
                 else:
-                    resp.decoded_body = decoded_body
+                    if b'Fiddler' in decoded_body:
+                        # Fiddler's HAR export adds a body with debug
+                        # information to CONNECT responses.
+                        resp.body = b''
+                    elif not headers_only:
+                        resp.decoded_body = decoded_body
+            else:
+                # HAR files are often mostly base64, so only decode it
+                # when (and if) the checks need it.
+                resp.decoded_body = Lazy(base64.b64decode, text)
 
-        elif 'encoding' not in data['content']:
+        elif 'encoding' not in data['content'] and not headers_only:
             resp.unicode_body = data['content']['text']
 
     return resp
@@ -0,0 +1,237 @@
+"""Walking through huge JSON documents without loading them whole.
+
+:class:`JSONScanner` reads a JSON document from a binary file in chunks,
+letting the caller descend into objects and arrays
+and either load or skip every value along the way.
+So the memory used is bounded by the largest value that is actually loaded.
+
+Skipped values are only checked for balanced brackets,
+not for full JSON validity.
+
+>>> import io
+>>> scanner = JSONScanner(io.BytesIO(b'{"a": [1, {"b": "c]"}], "d": 2}'),
+...                       chunk_size=4)
+>>> for key in scanner.iter_object():
+...     if key == u'a':
+...         for _ in scanner.iter_array():
+...             print(scanner.load())
+...     else:
+...         scanner.skip_value()
+1
+{'b': 'c]'}
+"""
+
+import json
+import re
+
+
+CHUNK_SIZE = 1024 * 1024
+
+_NON_WHITESPACE = re.compile(br'[^ \t\n\r]')
+# Everything up to the next bracket, including any complete strings.
+_NON_STRUCTURE = re.compile(br'(?:[^][{}"]+|"[^"\\]*(?:\\.[^"\\]*)*")*',
+                            re.DOTALL)
+_STRING_BODY = re.compile(br'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_PRIMITIVE_END = re.compile(br'[,:}\] \t\n\r]')
+
+
+class JSONScanError(ValueError):
+
+    pass
+
+
+class JSONScanner:
+
+    def __init__(self, file_, chunk_size=CHUNK_SIZE, offset=0):
+        # `offset` is the current position in `file_`, which need not
+        # be seekable (it may be a pipe), unless :meth:`seek` is called.
+        self.file = file_
+        self.chunk_size = chunk_size
+        # A `bytearray`, so that appending a chunk and dropping
+        # the data we don't need anymore doesn't copy the whole buffer,
+        # which would make it quadratic to read a big value in small chunks.
+        self._buf = bytearray()
+        self._pos = 0           # Current position in `_buf`.
+        self._offset = offset   # Position of `_buf` in the file.
+        self._mark = None       # Position in `_buf` that must be kept.
+        self._sink = None       # Where to copy data from `_sink_pos` on.
+        self._sink_pos = None
+
+    def tell(self):
+        return self._offset + self._pos
+
+    def seek(self, offset):
+        self.file.seek(offset)
+        self._buf = bytearray()
+        self._pos = 0
+        self._offset = offset
+        self._mark = None
+
+    def _more(self):
+        # Read another chunk into the buffer, dropping what we don't need.
+        # Return false at the end of file.
+        data = self.file.read(self.chunk_size)
+        if not data:
+            return False
+        if self._sink is not None:
+            self._sink.write(self._buf[self._sink_pos:])
+            self._sink_pos = len(self._buf)
+        keep = self._pos if self._mark is None else self._mark
+        del self._buf[:keep]
+        self._buf += data
+        self._offset += keep
+        self._pos -= keep
+        if self._mark is not None:
+            self._mark -= keep
+        if self._sink is not None:
+            self._sink_pos -= keep
+        return True
+
+    def _error(self, message):
+        return JSONScanError(u'%s at byte %d' % (message, self.tell()))
+
+    def peek(self):
+        """Skip whitespace and return the next byte, or ``b''`` at the end."""
+        while True:
+            match = _NON_WHITESPACE.search(self._buf, self._pos)
+            if match is not None:
+                self._pos = match.start()
+                return bytes(self._buf[self._pos : self._pos + 1])
+            self._pos = len(self._buf)
+            if not self._more():
+                return b''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self._error(u'expected %s' % char.decode('ascii'))
+        self._pos += 1
+
+    def read_value(self):
+        """Return the raw bytes of the next value."""
+        self.peek()
+        self._mark = self._pos
+        try:
+            self._scan()
+            return bytes(self._buf[self._mark : self._pos])
+        finally:
+            self._mark = None
+
+    def load(self):
+        """Decode and return the next value."""
+        return json.loads(self.read_value().decode('utf-8'))
+
+    def skip_value(self):
+        self._scan()
+
+    def copy_value(self, out):
+        """Write the raw bytes of the next value to the binary file `out`.
+
+        Unlike :meth:`read_value`, this doesn't keep the whole value
+        in memory.
+        """
+        self.peek()
+        self._sink = out
+        self._sink_pos = self._pos
+        try:
+            self._scan()
+            out.write(self._buf[self._sink_pos : self._pos])
+        finally:
+            self._sink = self._sink_pos = None
+
+    def iter_object(self):
+        """Go through the members of the next value, which must be an object.
+
+        Yield every key. The caller must then load or skip the value.
+        """
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != b'"':
+                raise self._error(u'expected a key')
+            key = self.load()
+            self.expect(b':')
+            yield key
+            if self._end_item(b'}'):
+                return
+
+    def iter_array(self):
+        """Go through the elements of the next value, which must be an array.
+
+        Yield `None` for every element. The caller must load or skip it.
+        """
+        self.expect(b'[')
+        if self.peek() == b']':
+            self._pos += 1
+            return
+        while True:
+            yield None
+            if self._end_item(b']'):
+                return
+
+    def _end_item(self, closing):
+        # Return true if this was the last item.
+        char = self.peek()
+        if char not in [b',', closing]:
+            raise self._error(u'expected , or %s' % closing.decode('ascii'))
+        self._pos += 1
+        return char == closing
+
+    def _scan(self):
+        char = self.peek()
+        if char == b'':
+            raise self._error(u'unexpected end of data')
+        if char == b'"':
+            self._pos += 1
+            self._scan_string()
+        elif char in [b'{', b'[']:
+            self._scan_container()
+        else:
+            self._scan_primitive()
+
+    def _scan_string(self):
+        # Just past the opening quote.
+        while True:
+            self._pos = _STRING_BODY.match(self._buf, self._pos).end()
+            if self._buf[self._pos : self._pos + 1] == b'"':
+                self._pos += 1
+                return
+            # The end of the buffer, possibly right after a backslash,
+            # so we need more data to see what follows.
+            if not self._more():
+                raise self._error(u'unterminated string')
+
+    def _scan_container(self):
+        depth = 0
+        while True:
+            self._pos = _NON_STRUCTURE.match(self._buf, self._pos).end()
+            char = bytes(self._buf[self._pos : self._pos + 1])
+            if char == b'':
+                if not self._more():
+                    raise self._error(u'unexpected end of data')
+                continue
+            self._pos += 1
+            if char == b'"':
+                # A string that continues beyond the buffer.
+                self._scan_string()
+            elif char in [b'{', b'[']:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _scan_primitive(self):
+        # Such as a number or ``true``. We don't check what it is exactly.
+        start = self.tell()
+        while True:
+            match = _PRIMITIVE_END.search(self._buf, self._pos)
+            if match is not None:
+                self._pos = match.start()
+                break
+            self._pos = len(self._buf)
+            if not self._more():
+                break
+        if self.tell() == start:
+            raise self._error(u'expected a value')
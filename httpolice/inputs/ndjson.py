@@ -0,0 +1,233 @@
+"""Reading exchanges from newline-delimited JSON (NDJSON).
+
+Every line of the input is one self-contained JSON object
+describing one exchange, so the input can be read line by line,
+in constant memory, no matter how big it is. This is meant for logs
+that are written by gateways and proxies as they go.
+The format of the records is described in the user manual.
+"""
+
+import base64
+import json
+
+from httpolice.exchange import Exchange
+from httpolice.helpers import pop_pseudo_headers
+from httpolice.inputs.common import InputError, Part
+from httpolice.inputs.packed import (can_reopen, display_name, is_compressed,
+                                     open_input)
+from httpolice.known import m
+from httpolice.request import Request
+from httpolice.response import Response
+from httpolice.structure import FieldName, Unavailable, http2, okay
+from httpolice.util import stats
+from httpolice.util.text import decode_path
+
+
+def ndjson_input(paths, headers_only=False, lines=None, parts=False):
+    # `lines` is a pair of 1-based line numbers (first, last), inclusive,
+    # either of which may be `None` for no limit. It applies to every file,
+    # so that one input can be split among several runs of HTTPolice.
+    if parts:
+        return (_parts(paths, headers_only, lines), False)
+    return _exchanges(paths, headers_only, lines)
+
+
+def _exchanges(paths, headers_only=False, lines=None, offset=0, start=1):
+    # `offset` is where in every file to begin reading,
+    # and `start` is the number of the line found there.
+    (first, last) = lines or (None, None)
+    for path in paths:
+        path = decode_path(path)
+        with open_input(path) as f:
+            if offset:
+                f.seek(offset)
+            for (line_no, line) in enumerate(f, start):
+                if first is not None and line_no < first:
+                    continue
+                if last is not None and line_no > last:
+                    break
+                if not line.strip():
+                    continue
+                where = u'%s, line %d' % (display_name(path), line_no)
+                try:
+                    exch = _process_record(json.loads(line.decode('utf-8')),
+                                           where, headers_only)
+                except (TypeError, KeyError) as exc:
+                    raise InputError(u'%s: cannot understand NDJSON record: '
+                                     u'%r' % (where, exc)) from exc
+                except ValueError as exc:   # Includes `UnicodeDecodeError`.
+                    raise InputError(u'%s: bad NDJSON record: %s' %
+                                     (where, exc)) from exc
+                yield exch
+
+
+# With ``httpolice --jobs``, every file that can be read out of order
+# is split into parts of this many lines.
+BATCH_SIZE = 256
+
+
+def _parts(paths, headers_only, lines):
+    (first, last) = lines or (None, None)
+    r = []
+    for path in paths:
+        path = decode_path(path)
+        if not can_reopen(path) or is_compressed(path):
+            r.append(Part(_exchanges, ([path], headers_only, lines), None,
+                          local=not can_reopen(path)))
+            continue
+        # Find where every part begins, without decoding anything.
+        with open_input(path) as f:
+            offset = 0
+            for (line_no, line) in enumerate(f, 1):
+                if last is not None and line_no > last:
+                    break
+                if (first is None or line_no >= first) and \
+                        (line_no - (first or 1)) % BATCH_SIZE == 0:
+                    part_last = line_no + BATCH_SIZE - 1
+                    if last is not None:
+                        part_last = min(part_last, last)
+                    r.append(Part(_exchanges,
+                                  ([path], headers_only, (line_no, part_last),
+                                   offset, line_no),
+                                  None, local=False))
+                offset += len(line)
+    return r
+
+
+def _process_record(data, where, headers_only):
+    if not isinstance(data, dict):
+        raise TypeError(u'record is %r' % data)
+    remark = u'from %s' % where
+    req = None
+    if data.get('request') is not None:
+        req = _process_request(data['request'], remark, headers_only)
+    resps = []
+    if data.get('response') is not None:
+        resps.append(_process_response(data['response'], remark,
+                                       headers_only))
+    for resp_data in data.get('responses') or []:
+        resps.append(_process_response(resp_data, remark, headers_only))
+    return Exchange(req, resps)
+
+
+def _process_request(data, remark, headers_only):
+    (header_entries, pseudo) = _process_headers(data.get('headers', []))
+    version = data.get('version')
+    if version is None and pseudo:
+        version = http2
+    method = data['method'] if 'method' in data else pseudo[u':method']
+    scheme = data.get('scheme', pseudo.get(u':scheme'))
+    target = data.get('target')
+    if target is None:
+        # Reconstruct the target from HTTP/2 pseudo-headers
+        # (RFC 7540 Section 8.1.2.3).
+        authority = pseudo.get(u':authority')
+        if method == m.CONNECT:
+            target = pseudo[u':authority']
+        elif authority is not None and scheme is not None:
+            target = u'%s://%s%s' % (scheme, authority,
+                                     pseudo.get(u':path', u''))
+        else:
+            target = pseudo[u':path']
+    return Request(scheme, method, target, version, header_entries,
+                   _process_body(data, headers_only),
+                   trailer_entries=_process_trailers(data), remark=remark)
+
+
+def _process_response(data, remark, headers_only):
+    (header_entries, pseudo) = _process_headers(data.get('headers', []))
+    version = data.get('version')
+    if version is None and pseudo:
+        version = http2
+    status = data.get('status')
+    if status is None:
+        status = int(pseudo[u':status'])
+    if not isinstance(status, int):
+        raise TypeError(u'status is %r' % status)
+    return Response(version, status, data.get('reason'), header_entries,
+                    _process_body(data, headers_only),
+                    trailer_entries=_process_trailers(data), remark=remark)
+
+
+def _process_headers(entries):
+    header_entries = _process_fields(entries)
+    return (header_entries, pop_pseudo_headers(header_entries))
+
+
+def _process_trailers(data):
+    if data.get('trailers') is None:
+        return None
+    return _process_fields(data['trailers'])
+
+
+def _process_fields(entries):
+    r = []
+    for (name, value) in entries:
+        if not isinstance(name, str) or not isinstance(value, str):
+            raise TypeError(u'header is %r' % [name, value])
+        r.append((FieldName(name), value))
+    return r
+
+
+def _process_body(data, headers_only):
+    text = data.get('body')
+    if text is None:
+        return None                     # Unknown.
+    if not isinstance(text, str):
+        raise TypeError(u'body is %r' % text)
+    if headers_only:
+        return Unavailable() if text else b''
+    encoding = data.get('body_encoding')
+    if encoding is None:
+        return text.encode('utf-8')
+    if encoding == u'base64':
+        try:
+            return base64.b64decode(text, validate=True)
+        except ValueError:
+            pass
+    # There is a body, but we can't tell what it is, which is no reason
+    # to stop reading the log. The checks that need it will be skipped.
+    stats.count(u'ndjson.bad_bodies')
+    return Unavailable()
+
+
+def ndjson_record(exch):
+    """Describe `exch` as an NDJSON record (a line without the line break).
+
+    Reading it back gives an exchange that is checked the same way,
+    except for the notices found while reading the original input
+    (such as about framing), and for bodies that are present but unknown,
+    which become just unknown.
+    """
+    record = {}
+    if exch.request is not None:
+        record[u'request'] = dict(_message_record(exch.request),
+                                  method=exch.request.method,
+                                  target=exch.request.target,
+                                  scheme=exch.request.scheme)
+    resps = [dict(_message_record(resp), status=resp.status,
+                  reason=resp.reason)
+             for resp in exch.responses]
+    if len(resps) == 1:
+        record[u'response'] = resps[0]
+    elif resps:
+        record[u'responses'] = resps
+    return json.dumps(record, sort_keys=True)
+
+
+def _message_record(msg):
+    r = {u'version': msg.version,
+         u'headers': _fields_record(msg.header_entries)}
+    if msg.trailer_entries is not None:
+        r[u'trailers'] = _fields_record(msg.trailer_entries)
+    if okay(msg.body):
+        r[u'body'] = base64.b64encode(msg.body).decode('ascii')
+        r[u'body_encoding'] = u'base64'
+    return r
+
+
+def _fields_record(entries):
+    # Header values are bytes, which :class:`HeaderEntry` makes
+    # from strings by encoding them back like this.
+    return [[entry.name, entry.value.decode('iso-8859-1')]
+            for entry in entries]
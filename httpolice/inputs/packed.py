@@ -0,0 +1,491 @@
+"""Reading compressed files and archives without unpacking them to disk.
+
+Any input file may be compressed with gzip, bzip2, xz, or (if the
+`zstandard`__ module is installed) Zstandard: :func:`open_input`
+recognizes this by the first bytes of the file and decompresses it
+on the fly.
+
+__ https://pypi.org/project/zstandard/
+
+Inputs that take directories (``tcpflow`` and ``tcpick``) also accept
+zip archives and tar archives (uncompressed or gzip-compressed)
+in their place. :func:`scan_archive` lists the members of an archive
+as :class:`ArchiveMember` paths, which can be opened with :func:`open_input`
+like any other path.
+
+All of these files are seekable, because the stream-based inputs
+need that (for instance, to reuse the framing with ``--index``).
+But seeking backwards in compressed data means decompressing it again
+from the start. To make that cheaper, for gzip we remember the state of
+the decompressor every :data:`CHECKPOINT_INTERVAL` bytes of output,
+restart from the nearest such checkpoint, and keep a few recently used
+blocks decompressed (see :class:`GzipIndex`). This is what makes
+gzip-compressed tar archives usable: every member is a slice of the
+decompressed archive, found through an index that is shared by all
+members. Other compressions don't allow this, and so are not supported
+for tar archives.
+"""
+
+import bisect
+import bz2
+import collections
+from datetime import datetime
+import io
+import lzma
+import os
+import stat
+import sys
+import tarfile
+import zipfile
+import zlib
+
+from httpolice.inputs.common import InputError
+
+try:
+    import zstandard
+except ImportError:                         # pragma: no cover
+    zstandard = None
+
+
+# How much compressed data to feed the decompressor at a time.
+CHUNK_SIZE = 64 * 1024
+
+# How often to remember the state of the decompressor (for gzip only),
+# in bytes of decompressed data. Every checkpoint takes about 40 KB.
+CHECKPOINT_INTERVAL = 1024 * 1024
+
+# How many blocks between checkpoints to keep decompressed (for gzip only).
+CACHED_BLOCKS = 8
+
+_MAGIC = [
+    (b'\x1f\x8b', u'gzip'),
+    (b'BZh', u'bzip2'),
+    (b'\xfd7zXZ\x00', u'xz'),
+    (b'\x28\xb5\x2f\xfd', u'zstd'),
+]
+
+
+def _sniff_compression(f):
+    head = f.peek(6)[:6]
+    for (magic, compression) in _MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _new_decompressor(path, compression):
+    if compression == u'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == u'bzip2':
+        return bz2.BZ2Decompressor()
+    if compression == u'xz':
+        return lzma.LZMADecompressor()
+    if zstandard is None:                   # pragma: no cover
+        raise InputError(u'%s: the zstandard module is needed '
+                         u'to read Zstandard-compressed files' % path)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# The path that means standard input, for the inputs that support it.
+STDIN = u'-'
+
+
+def display_name(path):
+    """How to refer to `path` in notices and remarks."""
+    return u'<stdin>' if path == STDIN else path
+
+
+def can_reopen(path):
+    """Whether `path` can be opened again and read from any position.
+
+    This is not the case with :data:`STDIN` or named pipes.
+    """
+    if isinstance(path, ArchiveMember):
+        return True
+    if path == STDIN:
+        return False
+    return stat.S_ISREG(os.stat(path).st_mode)
+
+
+def open_input(path):
+    """Open `path` for reading in binary mode, decompressing it if needed.
+
+    `path` may also be an :class:`ArchiveMember`, or :data:`STDIN`.
+    Standard input may not be seekable (when it's a pipe);
+    closing the returned file does not close it.
+    """
+    if isinstance(path, ArchiveMember):
+        return path.archive.open_member(path)
+    if path == STDIN:
+        f = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+    else:
+        f = io.open(path, 'rb')
+    compression = _sniff_compression(f)
+    if compression is None:
+        return f
+    if compression == u'gzip' and f.seekable():
+        return io.BufferedReader(GzipRaw(f, path))
+    return io.BufferedReader(DecompressedRaw(f, path, compression))
+
+
+def is_compressed(path):
+    if isinstance(path, ArchiveMember):
+        return True
+    with io.open(path, 'rb') as f:
+        return _sniff_compression(f) is not None
+
+
+class _VirtualRaw(io.RawIOBase):
+
+    # A read-only binary file whose position is only remembered on seeking.
+    # The actual work is done by ``readinto`` in subclasses.
+
+    def __init__(self, file_):
+        super(_VirtualRaw, self).__init__()
+        self.file = file_
+        self._pos = 0           # Where the next read should begin.
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._get_size()
+        if pos < 0:
+            raise ValueError(u'negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def _get_size(self):
+        raise NotImplementedError
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super(_VirtualRaw, self).close()
+
+
+class DecompressedRaw(_VirtualRaw):
+
+    """The decompressed contents of the binary file `file_`.
+
+    Positions are in terms of decompressed data.
+    Seeking backwards means decompressing again from the start
+    (so `file_` only needs to be seekable for that).
+    """
+
+    def __init__(self, file_, name, compression):
+        super(DecompressedRaw, self).__init__(file_)
+        self.name = name
+        self.compression = compression
+        self._size = None
+        self._out_pos = 0
+        self._decompressor = _new_decompressor(name, compression)
+        self._out = b''         # Decompressed data from `_out_pos` on.
+
+    def _restart(self):
+        self.file.seek(0)
+        self._decompressor = _new_decompressor(self.name, self.compression)
+        self._out_pos = 0
+        self._out = b''
+
+    def _advance(self):
+        # Decompress the next chunk into `_out`. Return false at the end.
+        data = self.file.read(CHUNK_SIZE)
+        if not data:
+            return False
+        (self._decompressor, out) = _decompress(
+            self._decompressor, data, self.name, self.compression)
+        self._out_pos += len(self._out)
+        self._out = out
+        return True
+
+    def _get_size(self):
+        if self._size is None:
+            while self._advance():
+                pass
+            self._size = self._out_pos + len(self._out)
+        return self._size
+
+    def readinto(self, b):
+        if self._pos < self._out_pos:
+            self._restart()
+        while self._pos >= self._out_pos + len(self._out):
+            if not self._advance():
+                return 0
+        start = self._pos - self._out_pos
+        n = min(len(b), len(self._out) - start)
+        b[:n] = self._out[start : start + n]
+        self._pos += n
+        return n
+
+
+def _decompress(decompressor, data, name, compression):
+    out = decompressor.decompress(data)
+    while decompressor.eof and decompressor.unused_data:
+        # Several compressed streams concatenated, as with ``cat``.
+        rest = decompressor.unused_data
+        decompressor = _new_decompressor(name, compression)
+        out += decompressor.decompress(rest)
+    return (decompressor, out)
+
+
+class GzipIndex:
+
+    """Random access to the decompressed contents of a gzip file.
+
+    The data is divided into blocks of about :data:`CHECKPOINT_INTERVAL`
+    bytes, and each block starts at a checkpoint ``(in_pos, out_pos,
+    decompressor)`` from which it can be decompressed again.
+    Checkpoints are made as the file is read for the first time.
+    The last :data:`CACHED_BLOCKS` blocks used are kept decompressed.
+
+    One index can be shared by many readers of the same file,
+    each with its own file object.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.checkpoints = [(0, 0, None)]
+        self._out_positions = [0]       # For bisecting.
+        self._size = None
+        self._blocks = collections.OrderedDict()
+
+    def block_at(self, file_, pos):
+        """Return ``(out_pos, data)`` for the block that contains `pos`,
+        or :const:`None` if `pos` is past the end.
+        """
+        i = bisect.bisect_right(self._out_positions, pos) - 1
+        while True:
+            out_pos = self._out_positions[i]
+            data = self._get_block(file_, i)
+            if pos < out_pos + len(data):
+                return (out_pos, data)
+            if i + 1 == len(self.checkpoints):
+                return None
+            i += 1
+
+    def get_size(self, file_):
+        while self._size is None:
+            self._get_block(file_, len(self.checkpoints) - 1)
+        return self._size
+
+    def _get_block(self, file_, i):
+        if i in self._blocks:
+            self._blocks.move_to_end(i)
+            return self._blocks[i]
+        data = self._decompress_block(file_, i)
+        self._blocks[i] = data
+        while len(self._blocks) > CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+        return data
+
+    def _decompress_block(self, file_, i):
+        (in_pos, out_pos, decompressor) = self.checkpoints[i]
+        if decompressor is None:
+            decompressor = _new_decompressor(self.name, u'gzip')
+        else:
+            decompressor = decompressor.copy()
+        if i + 1 < len(self.checkpoints):
+            # Stop exactly where the next block begins.
+            end_in_pos = self.checkpoints[i + 1][0]
+        else:
+            end_in_pos = None
+        file_.seek(in_pos)
+        chunks = []
+        size = 0
+        while True:
+            if end_in_pos is None:
+                if size >= CHECKPOINT_INTERVAL:
+                    self.checkpoints.append((in_pos, out_pos + size,
+                                             decompressor.copy()))
+                    self._out_positions.append(out_pos + size)
+                    break
+                data = file_.read(CHUNK_SIZE)
+            else:
+                if in_pos >= end_in_pos:
+                    break
+                data = file_.read(min(CHUNK_SIZE, end_in_pos - in_pos))
+            if not data:
+                self._size = out_pos + size
+                break
+            in_pos += len(data)
+            (decompressor, out) = _decompress(decompressor, data,
+                                              self.name, u'gzip')
+            chunks.append(out)
+            size += len(out)
+        return b''.join(chunks)
+
+
+class GzipRaw(_VirtualRaw):
+
+    """The decompressed contents of the gzip-compressed binary file `file_`,
+    with random access through `index` (a :class:`GzipIndex`,
+    possibly shared with other readers of the same file).
+    """
+
+    def __init__(self, file_, name, index=None):
+        super(GzipRaw, self).__init__(file_)
+        self.index = GzipIndex(name) if index is None else index
+
+    def _get_size(self):
+        return self.index.get_size(self.file)
+
+    def readinto(self, b):
+        found = self.index.block_at(self.file, self._pos)
+        if found is None:
+            return 0
+        (out_pos, data) = found
+        start = self._pos - out_pos
+        n = min(len(b), len(data) - start)
+        b[:n] = data[start : start + n]
+        self._pos += n
+        return n
+
+
+class SliceRaw(_VirtualRaw):
+
+    """`size` bytes of the seekable binary file `file_`, from `start`."""
+
+    def __init__(self, file_, start, size):
+        super(SliceRaw, self).__init__(file_)
+        self.start = start
+        self.size = size
+
+    def _get_size(self):
+        return self.size
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        self.file.seek(self.start + self._pos)
+        data = self.file.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class ArchiveMember(str):
+
+    """The path to a file inside an archive.
+
+    This is a string that looks like ``path/to/archive.tar/name/in/archive``,
+    so it can be shown and used as a key like any other path,
+    but it also knows how to find the file.
+    """
+
+    def __new__(cls, archive, name, size, mtime_ns, info, modified=None):
+        # `mtime_ns` is only good for telling whether the member has changed.
+        # `modified` is when it was last modified, as a naive UTC `datetime`,
+        # or `None` if that is not known (zip archives store local time).
+        self = str.__new__(cls, os.path.join(archive.path, name))
+        self.archive = archive
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.info = info
+        self.modified = modified
+        return self
+
+    def __reduce__(self):
+        # To send a member to another process (as with ``--jobs``),
+        # send only enough to find it again there.
+        return (_find_member, (self.archive.path, self.name))
+
+
+# Archives already scanned in this process by :func:`_find_member`.
+_scanned = {}
+
+
+def _find_member(archive_path, name):
+    if archive_path not in _scanned:
+        _scanned[archive_path] = {member.name: member
+                                  for member in scan_archive(archive_path)}
+    return _scanned[archive_path][name]
+
+
+def is_archive(path):
+    return os.path.isfile(path) and \
+        (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def scan_archive(path):
+    """Return a list of :class:`ArchiveMember` for the regular files in the
+    zip or tar archive at `path`.
+    """
+    if zipfile.is_zipfile(path):
+        return _ZipArchive(path).members
+    return _TarArchive(path).members
+
+
+class _ZipArchive:
+
+    def __init__(self, path):
+        self.path = path
+        # All members are read through this one object,
+        # which takes care of sharing the underlying file among them.
+        self.zip = zipfile.ZipFile(path)
+        self.members = [
+            ArchiveMember(self, info.filename, info.file_size,
+                          _zip_mtime_ns(info), info)
+            for info in self.zip.infolist()
+            if not info.filename.endswith('/')     # Not a directory.
+        ]
+
+    def open_member(self, member):
+        return self.zip.open(member.info)
+
+
+def _zip_mtime_ns(info):
+    # Zip stores local time without a time zone, but we only need
+    # to compare it with itself.
+    (year, month, day, hour, minute, second) = info.date_time
+    return ((((((year * 12 + month) * 31 + day) * 24 + hour) * 60 + minute)
+             * 60 + second) * 10 ** 9)
+
+
+class _TarArchive:
+
+    def __init__(self, path):
+        self.path = path
+        self.gzip_index = GzipIndex(path)
+        with io.open(path, 'rb') as f:
+            self.compression = _sniff_compression(f)
+        if self.compression not in [None, u'gzip']:
+            raise InputError(u'%s: tar archives compressed with %s '
+                             u'are not supported, only uncompressed '
+                             u'or gzip-compressed' % (path, self.compression))
+        self.members = []
+        with self._open() as f:
+            try:
+                with tarfile.open(fileobj=f, mode='r:') as tar:
+                    for info in tar:
+                        # Sparse files are not stored as one piece.
+                        if info.isreg() and not info.issparse():
+                            self.members.append(ArchiveMember(
+                                self, info.name, info.size,
+                                int(info.mtime) * 10 ** 9, info,
+                                datetime.utcfromtimestamp(info.mtime)))
+            except tarfile.TarError as exc:
+                raise InputError(u'%s: bad tar archive: %s' % (path, exc)) \
+                    from exc
+
+    def _open(self):
+        f = io.open(self.path, 'rb')
+        if self.compression is None:
+            return f
+        return io.BufferedReader(GzipRaw(f, self.path, self.gzip_index))
+
+    def open_member(self, member):
+        return io.BufferedReader(SliceRaw(self._open(),
+                                          member.info.offset_data,
+                                          member.size))
@@ -0,0 +1,548 @@
+"""Reading HTTP/1.x traffic directly from packet captures.
+
+Both the classic pcap format and pcapng are supported, without any external
+libraries. TCP connections are reassembled in memory and then parsed just
+like with the ``tcpflow`` input format.
+
+Connections are parsed as soon as they are finished, in the order they
+started, so memory does not grow with the size of the capture,
+only with the number of connections that overlap in time.
+
+This is deliberately simple. IP fragments are ignored, and so are packets
+with link types other than those listed in :data:`_LINK_HEADERS`.
+When a connection has a hole in it (for example, because the capture tool
+dropped some packets), we only parse the data before the hole.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+import heapq
+import io
+import ipaddress
+import itertools
+import operator
+import struct
+
+from httpolice.exchange import complaint_box
+from httpolice.framing1 import parse_streams
+from httpolice.inputs.common import InputError, Part
+from httpolice.inputs.filters import in_window
+from httpolice.inputs.packed import open_input
+from httpolice.inputs.streams import (_join_sequences, _sniff_direction,
+                                      _sniff_line)
+from httpolice.sampling import sampled
+from httpolice.stream import Stream
+from httpolice.util import stats, timing
+from httpolice.util.text import decode_path
+
+
+# No direction of a TCP connection may have more than this many bytes.
+# Anything beyond that is treated as a hole.
+MAX_STREAM_SIZE = 256 * 1024 * 1024
+
+# How many bytes of out-of-order segments we are willing to hold
+# for one direction of a TCP connection, waiting for the missing segment.
+# If that segment doesn't come in time, we give up and declare a hole.
+MAX_PENDING_SIZE = 1024 * 1024
+
+
+# A connection is finished when it has been closed (with FIN from both
+# sides, or with RST) and then no more of its packets have been seen
+# for this many packets (such as retransmissions), or when none of its
+# packets have been seen for `IDLE_PACKETS` packets.
+LINGER_PACKETS = 1000
+IDLE_PACKETS = 100000
+
+# Finished connections wait for those that started earlier,
+# but if more than this many are waiting, they go out of order
+# (only with ``httpolice --no-reorder``, where the order is not by time
+# anyway; otherwise they keep waiting, so that the report is in order).
+MAX_WAITING = 10000
+
+
+def pcap_input(paths, headers_only=False, reorder=True, since=None,
+               until=None, sample_connections=None, parts=False):
+    # With `parts`, the packets are still read and reassembled here,
+    # but every connection is parsed separately.
+    per_file = [_sequences(path, headers_only, since, until,
+                           sample_connections, reorder, parts)
+                for path in paths]
+    if reorder:
+        # Connections from every file come in the order they started,
+        # so merging the files keeps their time hints from ever decreasing,
+        # and then they can be joined (or sent to worker processes)
+        # without reading the whole capture in advance.
+        sequences = heapq.merge(*per_file,
+                                key=operator.itemgetter(2 if parts else 1))
+    else:
+        sequences = itertools.chain.from_iterable(per_file)
+    if parts:
+        return (sequences, reorder)
+    return _join_sequences(sequences, reorder, sorted_hints=True)
+
+
+def _sequences(path, headers_only, since, until, sample, in_order, parts):
+    path = decode_path(path)
+    with open_input(path) as f:
+        for conn in _reassemble(path, _read_packets(path, f), in_order):
+            if not in_window(since, until, _utc(conn.time),
+                             _utc(conn.end_time)):
+                stats.count(u'filter.connections_skipped')
+                continue
+            if sample is not None and \
+                    not sampled(_connection_name(conn), sample):
+                stats.count(u'sample.connections_skipped')
+                continue
+            if parts:
+                yield Part(_parse_connection, (path, conn, headers_only),
+                           _utc(conn.time), local=False)
+            else:
+                yield (_parse_connection(path, conn, headers_only),
+                       _utc(conn.time))
+
+
+def _connection_name(conn):
+    # The same on every run, for sampling.
+    return u'%s %r' % (u' '.join(sorted(_format_endpoint(source)
+                                        for source in conn.halves)),
+                       conn.time)
+
+
+def _utc(timestamp):
+    return None if timestamp is None else datetime.utcfromtimestamp(timestamp)
+
+
+def _parse_connection(path, conn, headers_only):
+    for half in conn.halves.values():
+        if half.hole is not None:
+            yield complaint_box(1312, stream=_half_name(path, half),
+                                offset=half.hole)
+
+    (half1, half2) = ([half for half in conn.halves.values() if half.data] +
+                      [None, None])[:2]
+    if half1 is None:
+        return
+    direction = _sniff_direction(half1, half2, sniff=_sniff_half)
+    if direction is None:
+        # Probably not HTTP/1.x at all, such as TLS.
+        yield complaint_box(1279, path1=_half_name(path, half1),
+                            path2=_half_name(path, half2) if half2
+                            else u'(none)')
+        return
+
+    (inbound, outbound) = [
+        Stream(io.BufferedReader(io.BytesIO(half.data)),
+               name=_half_name(path, half), skip_bodies=headers_only)
+        if half else None
+        for half in direction
+    ]
+    for exch in timing.iterate(u'framing', parse_streams(inbound, outbound,
+                                                         scheme=u'http')):
+        yield exch
+
+
+def _sniff_half(half):
+    return _sniff_line(half.data[: half.data.find(b'\n') + 1] or half.data)
+
+
+def _half_name(path, half):
+    return u'%s (%s -> %s)' % (path, _format_endpoint(half.source),
+                               _format_endpoint(half.destination))
+
+
+def _format_endpoint(endpoint):
+    (address, port) = endpoint
+    address = ipaddress.ip_address(address)
+    if address.version == 6:
+        return u'[%s]:%d' % (address, port)
+    return u'%s:%d' % (address, port)
+
+
+###############################################################################
+# Reading capture files.
+
+# A packet is ``(timestamp, link_type, data)``, where `timestamp` is
+# a POSIX time as a `float` or `None` if unknown.
+
+def _read_packets(path, f):
+    magic = f.read(4)
+    if magic == b'\x0A\x0D\x0D\x0A':
+        return _read_pcapng(path, f)
+    for byte_order in '<>':
+        (number,) = struct.unpack(byte_order + 'I', magic.ljust(4, b'\0'))
+        if number == 0xA1B2C3D4:
+            return _read_pcap(path, f, byte_order, 1e-6)
+        if number == 0xA1B23C4D:
+            return _read_pcap(path, f, byte_order, 1e-9)
+    raise InputError(u'%s: not a pcap or pcapng file' % path)
+
+
+def _read_pcap(path, f, byte_order, resolution):
+    header = f.read(20)
+    if len(header) < 20:
+        raise InputError(u'%s: truncated pcap header' % path)
+    (_, _, _, _, _, link_type) = struct.unpack(byte_order + 'HHiIII', header)
+    link_type &= 0xFFFF         # The upper bits are for other purposes.
+    while True:
+        record = f.read(16)
+        if len(record) < 16:
+            # A capture that was cut short (by killing tcpdump, perhaps)
+            # is still useful, so we don't complain.
+            break
+        (seconds, fraction, captured_length, _) = \
+            struct.unpack(byte_order + 'IIII', record)
+        data = f.read(captured_length)
+        if len(data) < captured_length:
+            break
+        yield (seconds + fraction * resolution, link_type, data)
+
+
+_PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+_PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+_PCAPNG_PACKET = 0x00000002                 # Obsolete, but still readable.
+_PCAPNG_SIMPLE_PACKET = 0x00000003
+_PCAPNG_ENHANCED_PACKET = 0x00000006
+
+_PCAPNG_IF_TSRESOL = 9
+
+
+def _read_pcapng(path, f):
+    byte_order = '<'
+    # For every interface in the current section: ``(link_type, resolution)``.
+    interfaces = []
+    block_type = _PCAPNG_SECTION_HEADER         # Already read its magic.
+    while True:
+        raw_length = f.read(4)
+        if block_type == _PCAPNG_SECTION_HEADER:
+            # Block length comes before the byte-order magic,
+            # so we can only decode it afterwards.
+            bom = f.read(4)
+            if bom == b'\x4D\x3C\x2B\x1A':
+                byte_order = '<'
+            elif bom == b'\x1A\x2B\x3C\x4D':
+                byte_order = '>'
+            else:
+                raise InputError(u'%s: bad pcapng section header' % path)
+            interfaces = []
+        else:
+            bom = b''
+        if len(raw_length) < 4:
+            break               # Truncated file.
+        (length,) = struct.unpack(byte_order + 'I', raw_length)
+        body_length = length - 12
+        if body_length < len(bom):
+            raise InputError(u'%s: bad pcapng block length' % path)
+        body = bom + f.read(body_length - len(bom))
+        if len(body) < body_length or len(f.read(4)) < 4:
+            break
+
+        if block_type == _PCAPNG_INTERFACE_DESCRIPTION:
+            (link_type,) = struct.unpack(byte_order + 'H', body[:2])
+            interfaces.append(
+                (link_type, _pcapng_resolution(byte_order, body[8:])))
+
+        elif block_type in [_PCAPNG_ENHANCED_PACKET, _PCAPNG_PACKET]:
+            if block_type == _PCAPNG_ENHANCED_PACKET:
+                (interface_id, high, low, captured_length, _) = \
+                    struct.unpack(byte_order + 'IIIII', body[:20])
+            else:
+                (interface_id, _, high, low, captured_length, _) = \
+                    struct.unpack(byte_order + 'HHIIII', body[:20])
+            if interface_id >= len(interfaces):
+                raise InputError(u'%s: packet from unknown interface %d' %
+                                 (path, interface_id))
+            (link_type, resolution) = interfaces[interface_id]
+            yield ((high << 32 | low) * resolution, link_type,
+                   body[20 : 20 + captured_length])
+
+        elif block_type == _PCAPNG_SIMPLE_PACKET:
+            if not interfaces:
+                raise InputError(u'%s: packet from unknown interface 0' % path)
+            (original_length,) = struct.unpack(byte_order + 'I', body[:4])
+            yield (None, interfaces[0][0], body[4 : 4 + original_length])
+
+        raw_type = f.read(4)
+        if len(raw_type) < 4:
+            break
+        (block_type,) = struct.unpack(byte_order + 'I', raw_type)
+
+
+def _pcapng_resolution(byte_order, options):
+    resolution = 1e-6
+    while len(options) >= 4:
+        (code, length) = struct.unpack(byte_order + 'HH', options[:4])
+        if code == 0:           # opt_endofopt
+            break
+        if code == _PCAPNG_IF_TSRESOL and length >= 1:
+            value = ord(options[4:5])
+            if value & 0x80:
+                resolution = 2.0 ** -(value & 0x7F)
+            else:
+                resolution = 10.0 ** -value
+        options = options[4 + (length + 3) // 4 * 4:]
+    return resolution
+
+
+###############################################################################
+# Decoding packets.
+
+# For every supported link type: how to find the IP packet inside a frame.
+# Every function returns the IP packet or `None` if this is something else.
+
+def _strip_ethernet(frame):
+    (ether_type,) = struct.unpack('!H', frame[12:14])
+    frame = frame[14:]
+    while ether_type in [0x8100, 0x88A8]:       # VLAN tags.
+        (ether_type,) = struct.unpack('!H', frame[2:4])
+        frame = frame[4:]
+    return frame if ether_type in [0x0800, 0x86DD] else None
+
+
+_LINK_HEADERS = {
+    0: lambda frame: frame[4:],                 # BSD loopback.
+    1: _strip_ethernet,
+    12: lambda frame: frame,                    # Raw IP (on some systems).
+    101: lambda frame: frame,                   # Raw IP.
+    113: lambda frame: frame[16:],              # Linux "cooked" capture.
+    228: lambda frame: frame,                   # Raw IPv4.
+    229: lambda frame: frame,                   # Raw IPv6.
+    276: lambda frame: frame[20:],              # Linux "cooked" v2.
+}
+
+_IPV6_EXTENSION_HEADERS = [0, 43, 60]     # Hop-by-hop, routing, destination.
+_IPV6_FRAGMENT_HEADER = 44
+_TCP = 6
+
+_FIN = 0x01
+_SYN = 0x02
+_RST = 0x04
+_ACK = 0x10
+
+
+def _decode_tcp(path, link_type, frame):
+    """Extract a TCP segment from a link-layer `frame`.
+
+    Return ``(source, destination, seq, flags, payload, complete)``,
+    where `source` and `destination` are ``(address, port)`` pairs
+    (with addresses as packed bytes), and `complete` is false
+    if the captured packet was cut short, or `None` if there is no segment.
+    """
+    if link_type not in _LINK_HEADERS:
+        raise InputError(u'%s: unsupported link type %d' % (path, link_type))
+    try:
+        packet = _LINK_HEADERS[link_type](frame)
+    except struct.error:            # Frame too short.
+        return None
+    if not packet:
+        return None
+
+    version = ord(packet[:1]) >> 4
+    if version == 4 and len(packet) >= 20:
+        header_length = (ord(packet[:1]) & 0x0F) * 4
+        (total_length, fragment) = struct.unpack('!H2xH', packet[2:8])
+        if packet[9] != _TCP or fragment & 0x3FFF:
+            return None
+        (source, destination) = (packet[12:16], packet[16:20])
+        # With TCP segmentation offload, the capture may see the packet
+        # before its length has been filled in, so (like Wireshark)
+        # we take zero to mean "all of it".
+        end = total_length or len(packet)
+        segment = packet[header_length:end]
+    elif version == 6 and len(packet) >= 40:
+        (payload_length, next_header) = struct.unpack('!HB', packet[4:7])
+        (source, destination) = (packet[8:24], packet[24:40])
+        end = 40 + payload_length if payload_length else len(packet)
+        pos = 40
+        while next_header in _IPV6_EXTENSION_HEADERS and len(packet) > pos + 1:
+            next_header = packet[pos]
+            pos += (packet[pos + 1] + 1) * 8
+        if next_header != _TCP:
+            return None
+        segment = packet[pos:end]
+    else:
+        return None
+
+    if len(segment) < 20:
+        return None
+    (source_port, destination_port, seq, offset, flags) = \
+        struct.unpack('!HHI4xBB', segment[:14])
+    return ((source, source_port), (destination, destination_port),
+            seq, flags, segment[(offset >> 4) * 4:], len(packet) >= end)
+
+
+###############################################################################
+# Reassembling TCP connections.
+
+def _seq_diff(a, b):
+    # TCP sequence numbers wrap around.
+    diff = (a - b) & 0xFFFFFFFF
+    return diff - 0x100000000 if diff >= 0x80000000 else diff
+
+
+class _Half:
+
+    """One direction of a TCP connection."""
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.data = bytearray()
+        self.next_seq = None
+        self.pending = {}               # Out-of-order segments by seq.
+        self.pending_size = 0
+        # If not `None`, the offset in `data` where a hole begins.
+        # Nothing is added after that.
+        self.hole = None
+
+    def add(self, seq, flags, payload, complete):
+        if self.hole is not None:
+            return
+        if flags & _SYN:
+            seq = (seq + 1) & 0xFFFFFFFF
+            self.next_seq = seq
+        if not complete:
+            self.hole = len(self.data)
+            return
+        if not payload:
+            return
+        if self.next_seq is None:
+            # Picked up the connection in the middle.
+            self.next_seq = seq
+        if len(payload) > len(self.pending.get(seq, b'')):
+            self.pending_size += len(payload) - len(self.pending.get(seq, b''))
+            self.pending[seq] = payload
+        self._drain()
+        if self.pending_size > MAX_PENDING_SIZE:
+            self.finish()
+
+    def _drain(self):
+        progress = True
+        while progress:
+            progress = False
+            for seq in list(self.pending):
+                offset = _seq_diff(seq, self.next_seq)
+                if offset > 0:
+                    continue
+                payload = self.pending.pop(seq)
+                self.pending_size -= len(payload)
+                # Retransmitted data may overlap with what we already have.
+                payload = payload[-offset:]
+                self.data += payload
+                self.next_seq = (self.next_seq + len(payload)) & 0xFFFFFFFF
+                progress = True
+        if len(self.data) > MAX_STREAM_SIZE:
+            del self.data[MAX_STREAM_SIZE:]
+            self.hole = MAX_STREAM_SIZE
+
+    def finish(self):
+        # Any segments that are still pending come after a hole.
+        if self.pending:
+            self.hole = len(self.data)
+            self.pending = {}
+            self.pending_size = 0
+
+
+class _Connection:
+
+    def __init__(self, key, time, packet_no):
+        self.key = key
+        self.time = time
+        self.end_time = time
+        self.last_packet_no = packet_no
+        self.halves = {}                # `_Half` by source.
+        self.closed = False             # Seen any FIN or RST.
+        self.fin_sources = set()
+        self.reset = False
+        self.finished = False
+
+    def add(self, packet_no, time, source, destination, seq, flags, payload,
+            complete):
+        if self.time is None:
+            self.time = time
+        if time is not None:
+            self.end_time = time
+        self.last_packet_no = packet_no
+        if source not in self.halves:
+            self.halves[source] = _Half(source, destination)
+        self.halves[source].add(seq, flags, payload, complete)
+        if flags & (_FIN | _RST):
+            self.closed = True
+        if flags & _FIN:
+            self.fin_sources.add(source)
+        if flags & _RST:
+            self.reset = True
+
+    @property
+    def has_data(self):
+        return any(half.data or half.hole is not None
+                   for half in self.halves.values())
+
+    def is_over(self, packet_no):
+        idle = packet_no - self.last_packet_no
+        if self.reset or len(self.fin_sources) >= 2:
+            return idle >= LINGER_PACKETS
+        return idle >= IDLE_PACKETS
+
+    def finish(self):
+        self.finished = True
+        for half in self.halves.values():
+            half.finish()
+
+
+def _reassemble(path, packets, in_order=False):
+    """Reassemble TCP connections from `packets`.
+
+    Generate :class:`_Connection` that have any data, in the order
+    they started, as soon as they (and those before them) are finished.
+    Unless `in_order` is true, they may go out of order
+    when too many are waiting (see `MAX_WAITING`).
+    """
+    active = {}                         # Unfinished connections by key.
+    waiting = OrderedDict()             # Connections not yet generated.
+    for (packet_no, (time, link_type, frame)) in enumerate(packets):
+        if packet_no % LINGER_PACKETS == 0:
+            for conn in list(active.values()):
+                if conn.is_over(packet_no):
+                    del active[conn.key]
+                    conn.finish()
+            yield from _release(waiting, in_order)
+
+        segment = _decode_tcp(path, link_type, frame)
+        if segment is None:
+            continue
+        (source, destination, seq, flags, payload, complete) = segment
+        key = frozenset([source, destination])
+        conn = active.get(key)
+        if conn is not None and flags & _SYN and not flags & _ACK and \
+                (conn.closed or conn.has_data):
+            # The same ports have been reused for a new connection.
+            conn.finish()
+            conn = None
+        if conn is None:
+            conn = active[key] = _Connection(key, time, packet_no)
+            waiting[conn] = None
+        conn.add(packet_no, time, source, destination, seq, flags, payload,
+                 complete)
+
+    for conn in active.values():
+        conn.finish()
+    yield from _release(waiting, in_order)
+
+
+def _release(waiting, in_order):
+    # Generate the connections from the front of `waiting`
+    # that are finished, and also (unless `in_order`) the rest
+    # of the finished ones if too many of them are waiting.
+    for conn in list(waiting):
+        if not conn.finished:
+            break
+        del waiting[conn]
+        if conn.has_data:
+            yield conn
+    if not in_order and \
+            sum(1 for conn in waiting if conn.finished) > MAX_WAITING:
+        stats.count(u'pcap.out_of_order')
+        for conn in [conn for conn in waiting if conn.finished]:
+            del waiting[conn]
+            if conn.has_data:
+                yield conn
@@ -1,64 +1,142 @@
 from collections import OrderedDict, namedtuple
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timedelta
+import heapq
 import io
 import itertools
+import json
 import os
 import re
+from time import monotonic, sleep, time as wall_clock
 
 from httpolice.exchange import complaint_box
-from httpolice.framing1 import parse_streams
-from httpolice.inputs.common import InputError
+from httpolice.framing1 import (
+    index_streams,
+    parse_step,
+    parse_streams,
+    walk_streams,
+)
+from httpolice.inputs.common import InputError, Part
+from httpolice.inputs.files import FilePool, scan_directory
+from httpolice.inputs.filters import in_window
+from httpolice.inputs.packed import (
+    ArchiveMember,
+    can_reopen,
+    display_name,
+    is_archive,
+    open_input,
+    scan_archive,
+)
+from httpolice.sampling import sampled
 from httpolice.stream import Stream
+from httpolice.util import stats, timing
 from httpolice.util.text import decode_path
 
 
-def streams_input(paths):
+def streams_input(paths, headers_only=False, index=None, reorder=True,
+                  parts=False):
     if len(paths) % 2 != 0:
         raise InputError(u'even number of input streams required')
     pairs = [(paths[i], paths[i + 1], None) for i in range(0, len(paths), 2)]
-    return _path_pairs_input(pairs, sniff_direction=False)
+    return _path_pairs_input(pairs, sniff_direction=False,
+                             headers_only=headers_only, index=_Index(index),
+                             reorder=reorder, parts=parts)
 
 
-def req_stream_input(paths):
+def req_stream_input(paths, headers_only=False, index=None, reorder=True,
+                     parts=False):
     return _path_pairs_input(((path, None, None) for path in paths),
-                             sniff_direction=False)
+                             sniff_direction=False, headers_only=headers_only,
+                             index=_Index(index), reorder=reorder, parts=parts)
 
 
-def resp_stream_input(paths):
+def resp_stream_input(paths, headers_only=False, index=None, reorder=True,
+                      parts=False):
     return _path_pairs_input(((None, path, None) for path in paths),
-                             sniff_direction=False)
-
-
-def tcpick_input(dir_paths):
+                             sniff_direction=False, headers_only=headers_only,
+                             index=_Index(index), reorder=reorder, parts=parts)
+
+
+# In follow mode (``--follow``), we keep polling the capture directories
+# every `POLL_INTERVAL` seconds, parsing connections as their files grow.
+# A connection is finished when its files haven't grown for `idle_timeout`
+# seconds (`IDLE_TIMEOUT` by default).
+POLL_INTERVAL = 1
+IDLE_TIMEOUT = 60
+
+
+def tcpick_input(dir_paths, headers_only=False, index=None, reorder=True,
+                 follow=False, idle_timeout=IDLE_TIMEOUT, checkpoint=None,
+                 since=None, until=None, sample_connections=None,
+                 parts=False):
+    if follow:
+        _check_follow_options(since, until, sample_connections)
+        return _follow_input(dir_paths, _parse_tcpick_name,
+                             _tcpick_stream_info, headers_only, index,
+                             idle_timeout, checkpoint)
+    index = _Index(index)
     path_pairs = []
 
     for dir_path in dir_paths:
         # Extract `_StreamInfo` from tcpick filenames so they can be
-        # recombined into pairs. This relies on the counter produced by
-        # tcpick's ``-F2`` option.
+        # recombined into pairs.
         dir_path = decode_path(dir_path)
-        streams_info = []
-        for name in os.listdir(dir_path):
-            path = os.path.join(dir_path, name)
-            match = re.match(
-                r'^tcpick_(\d+)_([^_]+)_([^_]+)_[^.]+.(serv|clnt)\.dat$', name)
-            if not match:
-                raise InputError(u'wrong tcpick filename %s '
-                                 u'(did you use the -F2 option?)' % name)
-            (counter, src, dest, direction) = match.groups()
-            counter = int(counter)
-            if direction == 'serv':
-                (src, dest) = (dest, src)
-            streams_info.append(_StreamInfo(path, source=src, destination=dest,
-                                            connection_hint=counter,
-                                            time_hint=None, sort_hint=counter))
+        streams_info = [
+            _tcpick_stream_info(path, fields)
+            for (path, fields) in index.scan_directory(dir_path,
+                                                       _parse_tcpick_name)
+        ]
         path_pairs.extend(_recombine_streams(streams_info))
 
     return _path_pairs_input(path_pairs, sniff_direction=True,
-                             complain_on_one_sided=True)
-
-
-def tcpflow_input(dir_paths):
+                             complain_on_one_sided=True,
+                             headers_only=headers_only, index=index,
+                             reorder=reorder, since=since, until=until,
+                             sample=sample_connections, parts=parts)
+
+
+def _check_follow_options(since, until, sample_connections):
+    if since is not None or until is not None:
+        raise InputError(u'--since and --until cannot be used '
+                         u'with --follow')
+    if sample_connections is not None:
+        raise InputError(u'--sample-by connection cannot be used '
+                         u'with --follow')
+
+
+def _tcpick_stream_info(path, fields):
+    # This relies on the counter produced by tcpick's ``-F2`` option.
+    (counter, src, dest, direction) = fields
+    counter = int(counter)
+    if direction == 'serv':
+        (src, dest) = (dest, src)
+    return _StreamInfo(path, source=src, destination=dest,
+                       connection_hint=counter, time_hint=None,
+                       sort_hint=counter)
+
+
+_TCPICK_NAME = re.compile(
+    r'^tcpick_(\d+)_([^_]+)_([^_]+)_[^.]+.(serv|clnt)\.dat$')
+
+
+def _parse_tcpick_name(name):
+    match = _TCPICK_NAME.match(name)
+    if not match:
+        raise InputError(u'wrong tcpick filename %s '
+                         u'(did you use the -F2 option?)' % name)
+    return list(match.groups())
+
+
+def tcpflow_input(dir_paths, headers_only=False, index=None, reorder=True,
+                  follow=False, idle_timeout=IDLE_TIMEOUT, checkpoint=None,
+                  since=None, until=None, sample_connections=None,
+                  parts=False):
+    if follow:
+        _check_follow_options(since, until, sample_connections)
+        return _follow_input(dir_paths, _parse_tcpflow_name,
+                             _tcpflow_stream_info, headers_only, index,
+                             idle_timeout, checkpoint)
+    index = _Index(index)
     path_pairs = []
 
     for dir_path in dir_paths:
@@ -70,28 +148,44 @@ def tcpflow_input(dir_paths):
         dir_path = decode_path(dir_path)
         streams_info = []
         seen = {}
-        for name in os.listdir(dir_path):
-            if name in ['report.xml', 'alerts.txt']:
-                continue
-            path = os.path.join(dir_path, name)
-            match = re.match(r'^(\d+)-([^-]+-\d+)-([^-]+-\d+)-\d+$', name)
-            if not match:
-                raise InputError(u'wrong tcpflow filename %s '
-                                 u'(did you use the right -T option?)' % name)
-            (timestamp, src, dest) = match.groups()
-            timestamp = int(timestamp)
-            if (src, dest) in seen:
+        for (path, fields) in index.scan_directory(dir_path,
+                                                   _parse_tcpflow_name):
+            stream_info = _tcpflow_stream_info(path, fields)
+            key = (stream_info.source, stream_info.destination)
+            if key in seen:
                 raise InputError(u'duplicate source+destination address+port: '
-                                 u'%s vs. %s' % (path, seen[(src, dest)]))
-            seen[(src, dest)] = path
-            streams_info.append(_StreamInfo(
-                path, source=src, destination=dest, connection_hint=None,
-                time_hint=datetime.utcfromtimestamp(timestamp),
-                sort_hint=timestamp))
+                                 u'%s vs. %s' % (path, seen[key]))
+            seen[key] = path
+            streams_info.append(stream_info)
         path_pairs.extend(_recombine_streams(streams_info))
 
     return _path_pairs_input(path_pairs, sniff_direction=True,
-                             complain_on_one_sided=True)
+                             complain_on_one_sided=True,
+                             headers_only=headers_only, index=index,
+                             reorder=reorder, since=since, until=until,
+                             sample=sample_connections, parts=parts)
+
+
+def _tcpflow_stream_info(path, fields):
+    (timestamp, src, dest) = fields
+    timestamp = int(timestamp)
+    return _StreamInfo(path, source=src, destination=dest,
+                       connection_hint=None,
+                       time_hint=datetime.utcfromtimestamp(timestamp),
+                       sort_hint=timestamp)
+
+
+_TCPFLOW_NAME = re.compile(r'^(\d+)-([^-]+-\d+)-([^-]+-\d+)-\d+$')
+
+
+def _parse_tcpflow_name(name):
+    if name in ['report.xml', 'alerts.txt']:
+        return None
+    match = _TCPFLOW_NAME.match(name)
+    if not match:
+        raise InputError(u'wrong tcpflow filename %s '
+                         u'(did you use the right -T option?)' % name)
+    return list(match.groups())
 
 
 # A `_StreamInfo` instance contains information about one TCP stream --
@@ -158,15 +252,31 @@ def _recombine_streams(streams_info):
 
 
 def _path_pairs_input(path_pairs, sniff_direction=False,
-                      complain_on_one_sided=False):
-    sequences = []
+                      complain_on_one_sided=False, headers_only=False,
+                      index=None, reorder=True, since=None, until=None,
+                      sample=None, parts=False):
+    # `sample` is the rate at which connections are sampled,
+    # by the names of their files (see :func:`httpolice.sampling.sampled`).
+    index = index or _Index(None)
+    connections = []
 
     # We have pairs of input files, each corresponding to one TCP connection,
     # and possibly having a time hint indicating when the connection started.
     for (path1, path2, time_hint) in path_pairs:
         path1 = decode_path(path1) if path1 else path1
         path2 = decode_path(path2) if path2 else path2
-        sequence = []           # Exchanges from this connection.
+        if (since is not None or until is not None) and \
+                not in_window(since, until, time_hint,
+                              _last_modified([path1, path2])):
+            # Skip the whole connection without even opening its files.
+            stats.count(u'filter.connections_skipped')
+            continue
+        if sample is not None and not sampled(
+                u' '.join(os.path.basename(path) if path else u''
+                          for path in [path1, path2]), sample):
+            stats.count(u'sample.connections_skipped')
+            continue
+        boxes = []
 
         # Some of the pairs may be one-sided, i.e. consisting of
         # only the inbound stream or only the outbound stream.
@@ -174,7 +284,7 @@ def _path_pairs_input(path_pairs, sniff_direction=False,
         # this is expected, but in other cases we need to complain.
         # We still want to try and process the one stream though.
         if complain_on_one_sided and (path1 is None or path2 is None):
-            sequence.append(complaint_box(1278, path=path1 or path2))
+            boxes.append((1278, {u'path': path1 or path2}))
 
         (inbound_path, outbound_path) = (path1, path2)
 
@@ -182,55 +292,516 @@ def _path_pairs_input(path_pairs, sniff_direction=False,
         # the pairs may not yet be disambiguated as to which side is
         # the inbound (client->server) stream and which is the outbound.
         if sniff_direction:
-            direction = _sniff_direction(path1, path2)
+            direction = _sniff_direction(path1, path2, sniff=index.sniff)
             if direction is None:
                 # If sniffing fails, this is a non-HTTP/1.x connection
                 # that was accidentally captured by tcpflow or something.
                 # We don't even try to parse that.
-                sequence.append(complaint_box(1279,
-                                              path1=path1 or u'(none)',
-                                              path2=path2 or u'(none)'))
+                boxes.append((1279, {u'path1': path1 or u'(none)',
+                                     u'path2': path2 or u'(none)'}))
                 (inbound_path, outbound_path) = (None, None)
             else:
                 (inbound_path, outbound_path) = direction
 
-        if inbound_path or outbound_path:
-            # Finally we can parse the streams as HTTP/1.x,
-            # appending them to the complaint boxes we may have produced above.
-            sequence = itertools.chain(sequence,
-                                       _parse_paths(inbound_path,
-                                                    outbound_path))
-
-        sequences.append((iter(sequence), time_hint))
-
-    return _rearrange_by_time(sequences)
-
+        connections.append((boxes, inbound_path, outbound_path, time_hint))
+
+    steps = {}
+    if index.path is not None:
+        steps = index.update_framing([(inbound_path, outbound_path)
+                                      for (_, inbound_path, outbound_path, _)
+                                      in connections])
+    index.save()
+
+    if parts:
+        return ([Part(_connection_exchanges,
+                      (boxes, inbound_path, outbound_path, headers_only,
+                       steps.get((inbound_path, outbound_path))),
+                      time_hint,
+                      local=not all(can_reopen(path)
+                                    for path in [inbound_path, outbound_path]
+                                    if path))
+                 for (boxes, inbound_path, outbound_path, time_hint)
+                 in connections],
+                reorder)
+
+    # Many of these connections may be in progress at the same time,
+    # but we don't want to have all their files open at the same time.
+    pool = FilePool()
+    sequences = [
+        (_connection_exchanges(boxes, inbound_path, outbound_path,
+                               headers_only,
+                               steps.get((inbound_path, outbound_path)),
+                               pool=pool),
+         time_hint)
+        for (boxes, inbound_path, outbound_path, time_hint) in connections
+    ]
+    return _join_sequences(sequences, reorder)
+
+
+def _connection_exchanges(boxes, inbound_path, outbound_path,
+                          headers_only=False, steps=None, pool=None):
+    # `boxes` is a list of ``(notice_id, context)`` for complaint boxes
+    # that come before the exchanges parsed from the streams.
+    for (notice_id, context) in boxes:
+        yield complaint_box(notice_id, **context)
+    if inbound_path or outbound_path:
+        for exch in _parse_paths(inbound_path, outbound_path,
+                                 headers_only=headers_only, steps=steps,
+                                 pool=pool):
+            yield exch
 
-def _parse_paths(inbound_path, outbound_path, scheme=u'http'):
-    inbound_file = inbound = outbound_file = outbound = None
 
-    try:
+@contextmanager
+def _open_streams(inbound_path, outbound_path, skip_bodies=False, pool=None):
+    open_ = pool.open if pool else open_input
+    with ExitStack() as stack:
+        (inbound, outbound) = (None, None)
         if inbound_path:
-            inbound_file = io.open(inbound_path, 'rb')
-            inbound = Stream(inbound_file, name=decode_path(inbound_path))
+            inbound = Stream(stack.enter_context(open_(inbound_path)),
+                             name=display_name(decode_path(inbound_path)),
+                             skip_bodies=skip_bodies)
         if outbound_path:
-            outbound_file = io.open(outbound_path, 'rb')
-            outbound = Stream(outbound_file, name=decode_path(outbound_path))
-        for exch in parse_streams(inbound, outbound, scheme):
+            outbound = Stream(stack.enter_context(open_(outbound_path)),
+                              name=display_name(decode_path(outbound_path)),
+                              skip_bodies=skip_bodies)
+        yield (inbound, outbound)
+
+
+def _parse_paths(inbound_path, outbound_path, scheme=u'http',
+                 headers_only=False, steps=None, pool=None):
+    with _open_streams(inbound_path, outbound_path, skip_bodies=headers_only,
+                       pool=pool) as (inbound, outbound):
+        if steps is None:
+            exchanges = parse_streams(inbound, outbound, scheme)
+        else:
+            exchanges = (exch
+                         for step in steps
+                         for exch in parse_step(inbound, outbound, step,
+                                                scheme))
+        for exch in timing.iterate(u'framing', exchanges):
             yield exch
 
-    finally:
-        if inbound_file is not None:
-            inbound_file.close()
-        if outbound_file is not None:
-            outbound_file.close()
 
-
-def _rearrange_by_time(sequences):
+def _follow_input(dir_paths, parse_name, make_stream_info, headers_only,
+                  index, idle_timeout, checkpoint):
+    if index is not None:
+        raise InputError(u'--index cannot be used with --follow')
+    follower = _Follower([decode_path(p) for p in dir_paths], parse_name,
+                         make_stream_info, headers_only, idle_timeout,
+                         checkpoint)
+    try:
+        while True:             # Until interrupted.
+            for exch in follower.poll():
+                yield exch
+            follower.save()
+            sleep(POLL_INTERVAL)
+    finally:
+        follower.save()
+
+
+class _Follower:
+
+    """The state of following capture directories as they grow.
+
+    Every connection is parsed step by step (see
+    :func:`httpolice.framing1.walk_streams`), and a step is only taken
+    if both streams have more data after it, because otherwise it may
+    be cut short by data that hasn't been written yet. The rest is
+    parsed once the connection is finished.
+
+    If `checkpoint` is not `None`, it is the path to a file where
+    the progress is saved after every poll, so that a later run
+    can resume without reporting the same exchanges again.
+
+    Finished files are remembered only until they fall behind
+    the `horizon`: a time such that every file modified before it
+    has already been dealt with (finished, or not ours at all).
+    So the memory and the checkpoint don't grow with the whole capture,
+    only with what has been finished in the last `idle_timeout` or so.
+    """
+
+    version = 1
+
+    def __init__(self, dir_paths, parse_name, make_stream_info,
+                 headers_only=False, idle_timeout=IDLE_TIMEOUT,
+                 checkpoint=None):
+        self.dir_paths = dir_paths
+        self.parse_name = parse_name
+        self.make_stream_info = make_stream_info
+        self.headers_only = headers_only
+        self.idle_timeout = idle_timeout
+        self.checkpoint = checkpoint
+        self.sizes = {}             # Path -> ``(size, time it last grew)``.
+        self.pending = OrderedDict()    # Path -> `_StreamInfo`, not paired.
+        self.connections = []       # Of `_FollowedConnection`.
+        self.done = set()           # Absolute paths of finished files.
+        self.horizon = None         # Wall clock time, like file mtimes.
+        # ``(inbound, outbound)`` with absolute paths -> offsets,
+        # for connections in progress when the checkpoint was saved.
+        self.resume = {}
+        # Absolute paths of connections that were started (with their
+        # complaint boxes reported) when the checkpoint was saved.
+        self.started = set()
+        self._changed = False
+        if checkpoint is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with io.open(self.checkpoint, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as exc:
+            raise InputError(u'%s: bad checkpoint file: %s' %
+                             (self.checkpoint, exc)) from exc
+        if not isinstance(data, dict) or \
+                data.get(u'httpolice_follow') != self.version:
+            raise InputError(u'%s: not an HTTPolice checkpoint file' %
+                             self.checkpoint)
+        self.done = set(data[u'done'])
+        self.horizon = data.get(u'horizon')
+        self.started = set(tuple(paths) for paths in data.get(u'started', []))
+        for conn in data[u'connections']:
+            self.resume[(conn[u'inbound'], conn[u'outbound'])] = \
+                tuple(conn[u'offsets'])
+
+    def save(self):
+        if self.checkpoint is None or not self._changed:
+            return
+        data = {
+            u'httpolice_follow': self.version,
+            u'done': sorted(self.done),
+            u'horizon': self.horizon,
+            u'started': [[_index_key(path) for path in conn.paths]
+                         for conn in self.connections if conn.started],
+            u'connections': [
+                {u'inbound': _index_key(conn.inbound_path),
+                 u'outbound': _index_key(conn.outbound_path),
+                 u'offsets': list(conn.offsets)}
+                for conn in self.connections
+                if conn.sniffed and conn.offsets != (0, 0)
+            ],
+        }
+        tmp_path = self.checkpoint + u'.tmp'
+        with io.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.checkpoint)
+        self._changed = False
+
+    def poll(self):
+        """Look for new data and generate the exchanges that are complete."""
+        now = monotonic()
+        self._scan(now)
+        self._pair(now)
+        for conn in list(self.connections):
+            finished = self._idle(conn.paths, now)
+            if conn.sizes != [self.sizes[path][0] for path in conn.paths] \
+                    or finished:
+                conn.sizes = [self.sizes[path][0] for path in conn.paths]
+                for exch in conn.advance(finished, self.headers_only,
+                                         self.resume):
+                    self._changed = True
+                    yield exch
+            if finished:
+                self.connections.remove(conn)
+                for path in conn.paths:
+                    del self.sizes[path]
+                    self.done.add(_index_key(path))
+                self._changed = True
+
+    def _scan(self, now):
+        # Any file that appears after this must have been modified
+        # after `horizon` (allowing for coarse mtimes and clock skew).
+        horizon = wall_clock() - self.idle_timeout
+        done = set()
+        for dir_path in self.dir_paths:
+            for entry in scan_directory(dir_path):
+                file_stats = entry.stat()
+                if entry.path not in self.sizes:
+                    if self.horizon is not None and \
+                            file_stats.st_mtime < self.horizon:
+                        continue
+                    key = _index_key(entry.path)
+                    if key in self.done:
+                        done.add(key)
+                        continue
+                    fields = self.parse_name(entry.name)
+                    if fields is None:
+                        continue
+                    self.pending[entry.path] = \
+                        self.make_stream_info(entry.path, fields)
+                    self.sizes[entry.path] = (None, now)
+                # Files we are still working on must stay ahead of it.
+                horizon = min(horizon, file_stats.st_mtime)
+                if self.sizes[entry.path][0] != file_stats.st_size:
+                    self.sizes[entry.path] = (file_stats.st_size, now)
+        # Forget the files that have been removed or left behind.
+        if done != self.done:
+            self.done = done
+            self._changed = True
+        if self.horizon is None or horizon > self.horizon:
+            self.horizon = horizon
+
+    def _pair(self, now):
+        for (path1, path2, _) in _recombine_streams(self.pending.values()):
+            if path2 is None and not self._idle([path1], now):
+                continue        # The other side may yet appear.
+            paths = [path for path in [path1, path2] if path is not None]
+            for path in paths:
+                del self.pending[path]
+            key = tuple(_index_key(path) for path in paths)
+            started = key in self.started
+            self.started.discard(key)
+            self.connections.append(_FollowedConnection(paths, started))
+
+    def _idle(self, paths, now):
+        return all(now - self.sizes[path][1] >= self.idle_timeout
+                   for path in paths)
+
+
+class _FollowedConnection:
+
+    def __init__(self, paths, started=False):
+        self.paths = paths
+        self.sizes = None           # As of the last `advance`.
+        self.sniffed = False
+        self.inbound_path = self.outbound_path = None
+        self.offsets = (0, 0)       # Where the next step begins.
+        self.started = started      # Complaint boxes already reported.
+
+    def advance(self, finished, headers_only, resume):
+        """Generate the exchanges that are complete by now.
+
+        If `finished`, the rest of the connection is parsed.
+        """
+        if not self.started:
+            self.started = True
+            if len(self.paths) == 1:
+                yield complaint_box(1278, path=self.paths[0])
+        if not self.sniffed:
+            direction = _sniff_direction(*(self.paths + [None])[:2])
+            if direction is None:
+                if finished:
+                    yield complaint_box(1279, path1=self.paths[0],
+                                        path2=(self.paths + [u'(none)'])[1])
+                return
+            self.sniffed = True
+            (self.inbound_path, self.outbound_path) = direction
+            self.offsets = resume.pop((_index_key(self.inbound_path),
+                                       _index_key(self.outbound_path)),
+                                      (0, 0))
+        with _open_streams(self.inbound_path, self.outbound_path,
+                           skip_bodies=headers_only) as (inbound, outbound):
+            streams = [stream for stream in [inbound, outbound] if stream]
+            if inbound:
+                inbound.seek(self.offsets[0])
+            if outbound:
+                outbound.seek(self.offsets[1])
+            for (_, exchanges) in walk_streams(inbound, outbound, u'http'):
+                if not finished and \
+                        not all(stream.good for stream in streams):
+                    return      # We'll redo this step with more data.
+                self.offsets = (inbound.tell() if inbound else 0,
+                                outbound.tell() if outbound else 0)
+                for exch in exchanges:
+                    yield exch
+
+
+class _Index:
+
+    """What we remember about the input between runs (``--index``).
+
+    This includes the steps for parsing each connection
+    (see :func:`httpolice.framing1.index_streams`) and, for capture
+    directories, what we have learned from the names and first lines
+    of their files. All of it is stored along with the sizes and
+    modification times of the files, so that changed files can be re-indexed.
+
+    If `path` is `None`, nothing is loaded or saved, but the information
+    about directories is still collected during this run.
+    """
+
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        # ``(inbound, outbound)`` -> ``(stats, steps)``, with absolute paths.
+        self.connections = OrderedDict()
+        # Absolute directory path -> file name ->
+        # ``[size, mtime_ns, fields, sniffed]``, where `fields` is
+        # what we parsed from the name, and `sniffed` is what `_sniff_file`
+        # returned (with `False` standing for `None`) or `None` if unknown.
+        self.directories = OrderedDict()
+        # The same entries, by paths as seen in this run.
+        self._files = {}
+        self._changed = False
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with io.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as exc:
+            raise InputError(u'%s: bad index file: %s' % (self.path, exc)) \
+                from exc
+        if not isinstance(data, dict) or u'httpolice_index' not in data:
+            raise InputError(u'%s: not an HTTPolice index file' % self.path)
+        if data[u'httpolice_index'] != self.version:
+            return              # Will be rebuilt.
+        for conn in data[u'connections']:
+            self.connections[(conn[u'inbound'], conn[u'outbound'])] = \
+                (conn[u'stats'], [tuple(step) for step in conn[u'steps']])
+        for directory in data[u'directories']:
+            self.directories[directory[u'path']] = directory[u'files']
+
+    def save(self):
+        if self.path is None or not self._changed:
+            return
+        data = {
+            u'httpolice_index': self.version,
+            u'connections': [
+                {u'inbound': inbound, u'outbound': outbound,
+                 u'stats': file_stats, u'steps': steps}
+                for ((inbound, outbound), (file_stats, steps))
+                in self.connections.items()
+            ],
+            u'directories': [
+                {u'path': path, u'files': files}
+                for (path, files) in self.directories.items()
+            ],
+        }
+        tmp_path = self.path + u'.tmp'
+        with io.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self._changed = False
+
+    def scan_directory(self, dir_path, parse_name):
+        """Yield ``(path, fields)`` for files in `dir_path`.
+
+        `fields` are what `parse_name` returns for the file's name
+        (files for which it returns `None` are skipped). Names of files
+        that haven't changed since the last run are not parsed again.
+        """
+        key = os.path.abspath(dir_path)
+        known = self.directories.get(key, {})
+        current = OrderedDict()
+        for (name, path, file_stats) in self._list_directory(dir_path):
+            item = known.get(name)
+            if item is None or item[:2] != file_stats:
+                item = file_stats + [parse_name(os.path.basename(name)), None]
+                self._changed = True
+            current[name] = item
+            if item[2] is not None:
+                self._files[path] = item
+                yield (path, item[2])
+        if len(current) != len(known):
+            self._changed = True
+        self.directories[key] = current
+
+    def _list_directory(self, dir_path):
+        # Generate ``(name, path, stats)`` for files in `dir_path`,
+        # which may also be an archive (see :mod:`httpolice.inputs.packed`).
+        if is_archive(dir_path):
+            for member in scan_archive(dir_path):
+                yield (member.name, member, _file_stats(member))
+            return
+        for entry in scan_directory(dir_path):
+            if self.path is None:
+                # Nothing will be saved, so don't waste time on stats.
+                file_stats = [None, None]
+            else:
+                st = entry.stat()
+                file_stats = [st.st_size, st.st_mtime_ns]
+            yield (entry.name, entry.path, file_stats)
+
+    def sniff(self, path):
+        """Like `_sniff_file`, but remembered. Only for scanned files."""
+        item = self._files[path]
+        if item[3] is None:
+            item[3] = _sniff_file(path) or False
+            self._changed = True
+        return item[3] or None
+
+    def update_framing(self, path_pairs):
+        """Refresh the framing for `path_pairs`.
+
+        Return a dictionary mapping every pair in `path_pairs` to its steps.
+        """
+        r = {}
+        for (inbound_path, outbound_path) in path_pairs:
+            if not (inbound_path or outbound_path):
+                continue
+            for path in [inbound_path, outbound_path]:
+                if path and not can_reopen(path):
+                    raise InputError(u'%s: cannot index standard input '
+                                     u'or a pipe' % display_name(path))
+            key = (_index_key(inbound_path), _index_key(outbound_path))
+            file_stats = [_file_stats(inbound_path),
+                          _file_stats(outbound_path)]
+            (known_stats, steps) = self.connections.get(key, (None, None))
+            if known_stats != file_stats:
+                with _open_streams(inbound_path, outbound_path,
+                                   skip_bodies=True) as (inbound, outbound):
+                    steps = index_streams(inbound, outbound)
+                self.connections[key] = (file_stats, steps)
+                self._changed = True
+            r[(inbound_path, outbound_path)] = steps
+        return r
+
+
+def _index_key(path):
+    return os.path.abspath(path) if path else None
+
+
+def _file_stats(path):
+    if not path:
+        return None
+    if isinstance(path, ArchiveMember):
+        return [path.size, path.mtime_ns]
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _last_modified(paths):
+    # When the last of `paths` was written to, as a naive UTC `datetime`,
+    # or `None` if unknown. This is roughly when the connection ended.
+    times = []
+    for path in paths:
+        if isinstance(path, ArchiveMember):
+            if path.modified is None:
+                return None
+            times.append(path.modified)
+        elif path:
+            times.append(datetime.utcfromtimestamp(os.stat(path).st_mtime))
+    return max(times)
+
+
+def _join_sequences(sequences, reorder=True, time_of=None,
+                    sorted_hints=False):
+    # `sequences` is a list of ``(sequence, time_hint)`` pairs
+    # (see `_rearrange_by_time`). Unless `reorder` is false,
+    # interleave them by time; otherwise, just chain them in their order.
+    if reorder:
+        return _rearrange_by_time(sequences, time_of, sorted_hints)
+    return itertools.chain.from_iterable(seq for (seq, _) in sequences)
+
+
+def _rearrange_by_time(sequences, time_of=None, sorted_hints=False):
     # `sequences` is a list of ``(sequence, time_hint)`` pairs.
     # Every `sequence` is an iterator of exchanges from one connection.
     # `time_hint` may be `None` or a naive UTC `datetime` indicating
     # approximately when that connection probably started.
+    # Instead of exchanges, the sequences may contain anything else
+    # that `time_of` can tell the time of (like `_exchange_time` does).
+    # If `sorted_hints` is true, `sequences` may also be an iterator
+    # whose time hints never decrease (except for `None`), and then
+    # sequences are only taken from it when they may be needed.
+    time_of = time_of or _exchange_time
 
     # What we want to do now is interleave exchanges from different sequences
     # in such a way that exchanges that happened close to each other in time
@@ -252,54 +823,67 @@ def _rearrange_by_time(sequences):
     # that it's likely to provide the next exchange.
 
     # For every sequence, we keep track of the current position in time
-    # and the current exchange.
-    position = [(time_hint, None) for (_, time_hint) in sequences]
+    # and the current exchange (or `None` if we haven't started it yet),
+    # in a heap of ``(time, i, exchange)`` ordered by time.
+    # The index `i` breaks ties in favor of earlier sequences
+    # (and keeps exchanges themselves from being compared).
+    heap = []
+    taken = {}                  # Sequences in the heap, by index.
+    incoming = enumerate(sequences)
+    upcoming = next(incoming, None)
 
     while True:
-        # Find the sequence with the earliest current position.
-        min_i = min_time = None
-        for i, x in enumerate(position):
-            if x is None:
-                # The sequence at this `i` has been exhausted already.
+        # Take in more sequences: all of them at once, unless the hints are
+        # sorted, in which case only those that may go before the next one
+        # in the heap (so that the rest are not even read yet).
+        while upcoming is not None and \
+                (not sorted_hints or not heap or upcoming[1][1] is None or
+                 upcoming[1][1] <= heap[0][0]):
+            (i, (sequence, time_hint)) = upcoming
+            upcoming = next(incoming, None)
+            if time_hint is not None:
+                taken[i] = sequence
+                heapq.heappush(heap, (time_hint, i, None))
                 continue
-            (time, _) = x
-            if time is None:
-                # If a sequence has no time hint, the only way to establish
-                # its time of beginning is by looking at the first exchange
-                # that has a Date header. So we want to force that now.
-                min_i = i
-                break
-            if min_time is None or time < min_time:
-                min_time = time
-                min_i = i
-        if min_i is None:
-            # We have exhausted all sequences.
+            # If a sequence has no time hint, the only way to establish
+            # its time of beginning is by looking at the first exchange
+            # that has a Date header. So we want to force that now.
+            # Any exchanges before that can only go first.
+            for exchange in sequence:
+                time = time_of(exchange, None)
+                if time is not None:
+                    taken[i] = sequence
+                    heapq.heappush(heap, (time, i, exchange))
+                    break
+                yield exchange
+
+        if not heap:
             break
-        i = min_i
-
-        (time, exchange) = position[i]
+        (time, i, exchange) = heapq.heappop(heap)
+        sequence = taken[i]
         if exchange is None:
             # Start iterating over this sequence.
-            exchange = next(sequences[i][0], None)
-            new_time = _exchange_time(exchange, time)
-            if time is None or new_time > time:
+            exchange = next(sequence, None)
+            if exchange is None:
+                del taken[i]
+                continue
+            new_time = time_of(exchange, time)
+            if new_time > time:
                 # So this sequence actually starts at a later time than
-                # suggested by its `time_hint` (or the hint is absent),
-                # which means that the `min_i` we found above may be wrong.
-                # We need to retry.
-                position[i] = (new_time, exchange)
+                # suggested by its `time_hint`, which means that
+                # some other sequence may be next. We need to retry.
+                heapq.heappush(heap, (new_time, i, exchange))
                 continue
 
         # OK, this is the next exchange in time order.
         yield exchange
 
         # Proceed to the next one from this sequence.
-        exchange = next(sequences[i][0], None)
+        exchange = next(sequence, None)
         if exchange is None:
-            # We're done with this sequence.
-            position[i] = None
+            del taken[i]
         else:
-            position[i] = (_exchange_time(exchange, time), exchange)
+            heapq.heappush(heap, (time_of(exchange, time), i, exchange))
 
 
 def _exchange_time(exchange, hint):
@@ -317,38 +901,63 @@ def _exchange_time(exchange, hint):
     return hint
 
 
-def _sniff_direction(path1, path2):                 # pragma: no cover
-    if path1 and _sniff_outbound(path1):
+def _sniff_direction(path1, path2, sniff=None):    # pragma: no cover
+    # `path1` and `path2` may actually be anything else (or `None`),
+    # as long as `sniff` can tell what kind of stream they are.
+    sniff = sniff or _sniff_file
+    kind1 = sniff(path1) if path1 else None
+    kind2 = sniff(path2) if path2 else None
+    if kind1 == u'outbound':
         return (path2, path1)
-    if path2 and _sniff_outbound(path2):
+    if kind2 == u'outbound':
         return (path1, path2)
-    if path1 and _sniff_inbound(path1):
+    if kind1 == u'inbound':
         return (path1, path2)
-    if path2 and _sniff_inbound(path2):
+    if kind2 == u'inbound':
         return (path2, path1)
     return None
 
 
-def _sniff_outbound(path):
-    with io.open(path, 'rb') as f:
-        line = f.readline()
-    return re.match(br'HTTP/1\.[0-9] [0-9]{3} ', line) is not None
+# We only need the first line, but it can be long.
+_SNIFF_LENGTH = 16 * 1024
+
+
+def _sniff_file(path):
+    stats.count(u'files.sniffed')
+    with open_input(path) as f:
+        return _sniff_line(f.readline(_SNIFF_LENGTH))
+
+
+_STATUS_LINE = re.compile(br'HTTP/1\.[0-9] [0-9]{3} ')
+_REQUEST_LINE = re.compile(br'[^ ]+ [^ ]+ HTTP/1\.[0-9]$')
+
+
+def _sniff_line(line):
+    if _STATUS_LINE.match(line):
+        return u'outbound'
+    if _REQUEST_LINE.match(line.rstrip()):
+        return u'inbound'
+    return None
 
 
-def _sniff_inbound(path):
-    with io.open(path, 'rb') as f:
-        line = f.readline()
-    return re.match(br'[^ ]+ [^ ]+ HTTP/1\.[0-9]$', line.rstrip()) is not None
+def combined_input(paths, headers_only=False, parts=False):
+    if parts:
+        return ([Part(_combined_exchanges, ([path], headers_only), None,
+                      local=not can_reopen(decode_path(path)))
+                 for path in paths],
+                False)
+    return _combined_exchanges(paths, headers_only)
 
 
-def combined_input(paths):
+def _combined_exchanges(paths, headers_only=False):
     for path in paths:
-        (inbound, outbound, scheme, _) = parse_combined(path)
-        for exch in parse_streams(inbound, outbound, scheme):
+        (inbound, outbound, scheme, _) = parse_combined(path, headers_only)
+        for exch in timing.iterate(u'framing',
+                                   parse_streams(inbound, outbound, scheme)):
             yield exch
 
 
-def parse_combined(path):
+def parse_combined(path, headers_only=False):
     path = decode_path(path)
     if path.endswith(u'.https'):
         scheme = u'https'
@@ -357,8 +966,9 @@ def parse_combined(path):
     else:
         scheme = u'http'
 
-    with io.open(path, 'rb') as f:
+    with open_input(path) as f:
         data = f.read()
+    path = display_name(path)
     parts1 = data.split(b'======== BEGIN INBOUND STREAM ========\r\n', 1)
     if len(parts1) != 2:
         raise InputError(u'%s: bad combined file: no inbound marker' % path)
@@ -373,8 +983,8 @@ def parse_combined(path):
     (inbound_data, outbound_data) = parts2
 
     inbound = Stream(io.BufferedReader(io.BytesIO(inbound_data)),
-                     name=path + u' (inbound)')
+                     name=path + u' (inbound)', skip_bodies=headers_only)
     outbound = Stream(io.BufferedReader(io.BytesIO(outbound_data)),
-                      name=path + u' (outbound)')
+                      name=path + u' (outbound)', skip_bodies=headers_only)
 
     return (inbound, outbound, scheme, preamble)
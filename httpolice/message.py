@@ -12,8 +12,10 @@ import defusedxml.ElementTree
 
 from httpolice import known
 from httpolice.blackboard import Blackboard, derived_property
-from httpolice.codings import decode_brotli, decode_deflate, decode_gzip
-from httpolice.header import HeadersView
+from httpolice.checks import check, run_checks, step
+from httpolice.codings import (DecodedTooLongError, decode_brotli,
+                               decode_deflate, decode_gzip, decoding_limit)
+from httpolice.header import PARSE_NOTICES, HeadersView
 from httpolice.known import cc, h, media, st, tc, upgrade, warn
 from httpolice.parse import parse
 from httpolice.structure import (FieldName, HeaderEntry, HTTPVersion,
@@ -39,6 +41,9 @@ class Message(Blackboard):
 
     """An HTTP message (request or response)."""
 
+    __slots__ = ('version', 'header_entries', 'body', 'trailer_entries',
+                 'headers', 'annotations', 'remark')
+
     self_name = u'msg'
 
     def __init__(self, version, header_entries, body, trailer_entries=None,
@@ -65,6 +70,25 @@ class Message(Blackboard):
         return [(entry, self.annotations.get((True, i), [entry.value]))
                 for i, entry in enumerate(self.trailer_entries)]
 
+    #: The names of the payload body and of the properties derived from it
+    #: that are dropped by :meth:`release`.
+    payload_names = (u'body', u'decoded_body', u'unicode_body', u'json_data',
+                     u'xml_data', u'multipart_data', u'url_encoded_data')
+
+    def release(self, keep=()):
+        unknown = set(keep).difference(self.payload_names)
+        if unknown:
+            raise ValueError(u'not a payload: %s' % u', '.join(sorted(unknown)))
+        known_values = dict(self.memoized, body=self.body)
+        for name in self.payload_names:
+            # Derived properties that are not known yet are left alone:
+            # if they are needed after all, they are derived
+            # from whatever is left.
+            if name not in keep and _takes_memory(known_values.get(name)):
+                setattr(self, name, Unavailable())
+        super(Message, self).release(keep)
+        self.headers.release()
+
     def rebuild_headers(self):
         self.headers = HeadersView(self)
 
@@ -73,6 +97,8 @@ class Message(Blackboard):
         """The payload body with Content-Encoding removed."""
         r = self.body
         codings = self.headers.content_encoding.value[:]
+        if okay(r):
+            limit = decoding_limit(len(r))
         while codings and okay(r) and r:
             coding = codings.pop()
             decoder = {cc.gzip: decode_gzip,
@@ -81,7 +107,10 @@ class Message(Blackboard):
                        cc.br: decode_brotli}.get(coding)
             if decoder is not None:
                 try:
-                    r = decoder(r)
+                    r = decoder(r, limit)
+                except DecodedTooLongError as e:
+                    self.complain(1311, coding=coding, max_size=e.max_size)
+                    r = Unavailable(r)
                 except Exception as e:
                     self.complain(1037, coding=coding, error=e)
                     r = Unavailable(r)
@@ -252,27 +281,66 @@ class Message(Blackboard):
         raise NotImplementedError()
 
 
+def _takes_memory(value):
+    # Is there anything to drop in `value`, a payload?
+    if isinstance(value, Unavailable):
+        return value.inner is not None
+    if isinstance(value, (bytes, str)):
+        return bool(value)
+    return value is not None
+
+
+#: The IDs of all notices that can be reported
+#: when decoding and parsing the payload body.
+BODY_NOTICES = frozenset([1036, 1037, 1038, 1039, 1040, 1139, 1140, 1275,
+                          1281, 1311])
+
+
 def check_message(msg):
     """Run all checks that apply to any message (both request and response)."""
-    complain = msg.complain
-    version = msg.version
-    headers = msg.headers
+    run_checks(u'message', msg)
 
-    x_prefixed = []
-    for hdr in headers:
-        # Check the header name syntax.
-        parse(hdr.name, rfc7230.field_name, complain, 1293, header=hdr,
+    if getattr(msg, 'status', None) == st.early_hints:
+        # 103 (Early Hints) responses are weird in that the headers they carry
+        # do not apply to themselves (RFC 8297 Section 2) but only to the final
+        # response (and then only speculatively). For such responses, we limit
+        # ourselves to checks that do not rely on having a complete and
+        # self-consistent message header block.
+        return
+
+    run_checks(u'message.complete', msg)
+
+
+@check(u'message', 1293)
+def _check_field_names(msg):
+    for hdr in msg.headers:
+        parse(hdr.name, rfc7230.field_name, msg.complain, 1293, header=hdr,
               place=u'field name')
-        # Force parsing every header present in the message
-        # according to its syntax rules.
+
+
+@check(u'message', *PARSE_NOTICES)
+def _parse_headers(msg):
+    # Force parsing every header present in the message
+    # according to its syntax rules.
+    for hdr in msg.headers:
         _ = hdr.value
+        step(PARSE_NOTICES, msg)
+
+
+@check(u'message', 1197, 1277)
+def _check_header_names(msg):
+    x_prefixed = []
+    for hdr in msg.headers:
         if known.header.is_deprecated(hdr.name):
-            complain(1197, header=hdr)
+            msg.complain(1197, header=hdr)
         if hdr.name.startswith(u'X-') and hdr.name not in known.header:
             x_prefixed.append(hdr)
     if x_prefixed:
-        complain(1277, headers=x_prefixed)
+        msg.complain(1277, headers=x_prefixed)
+
 
+@check(u'message', *BODY_NOTICES)
+def _parse_body(msg):
     # Force checking the payload according to various rules.
     _ = msg.decoded_body
     _ = msg.unicode_body
@@ -281,7 +349,13 @@ def check_message(msg):
     _ = msg.multipart_data
     _ = msg.url_encoded_data
 
-    if version == http11 and headers.trailer.is_present and \
+
+@check(u'message', 1020, 1030, 1054)
+def _check_framing(msg):
+    complain = msg.complain
+    headers = msg.headers
+
+    if msg.version == http11 and headers.trailer.is_present and \
             tc.chunked not in headers.transfer_encoding:
         # HTTP/2 supports trailers but has no notion of "chunked".
         complain(1054)
@@ -294,9 +368,18 @@ def check_message(msg):
             headers.content_length.is_present:
         complain(1020)
 
-    for opt in headers.connection:
+
+@check(u'message', 1034)
+def _check_connection(msg):
+    for opt in msg.headers.connection:
         if known.header.is_bad_for_connection(FieldName(opt)):
-            complain(1034, header=headers[FieldName(opt)])
+            msg.complain(1034, header=msg.headers[FieldName(opt)])
+
+
+@check(u'message', 1035, 1042, 1280)
+def _check_content_type(msg):
+    complain = msg.complain
+    headers = msg.headers
 
     if headers.content_type.is_okay:
         if known.media_type.is_deprecated(headers.content_type.item):
@@ -308,45 +391,60 @@ def check_message(msg):
             u'charset' in headers.content_type.param:
         complain(1280, header=headers.content_type)
 
-    if headers.date > datetime.utcnow() + timedelta(seconds=10):
-        complain(1109)
 
-    for warning in headers.warning:
+@check(u'message', 1109)
+def _check_date(msg):
+    if msg.headers.date > datetime.utcnow() + timedelta(seconds=10):
+        msg.complain(1109)
+
+
+@check(u'message', 1163, 1164)
+def _check_warning(msg):
+    for warning in msg.headers.warning:
         if warning.code < 100 or warning.code > 299:
-            complain(1163, code=warning.code)
-        if okay(warning.date) and headers.date != warning.date:
-            complain(1164, code=warning.code)
+            msg.complain(1163, code=warning.code)
+        if okay(warning.date) and msg.headers.date != warning.date:
+            msg.complain(1164, code=warning.code)
+        step([1163, 1164], msg)
+
 
-    for pragma in headers.pragma:
+@check(u'message', 1160)
+def _check_pragma(msg):
+    for pragma in msg.headers.pragma:
         if pragma != u'no-cache':
-            complain(1160, pragma=pragma.item)
+            msg.complain(1160, pragma=pragma.item)
+
 
-    for protocol in headers.upgrade:
+@check(u'message', 1228, 1233)
+def _check_upgrade(msg):
+    for protocol in msg.headers.upgrade:
         if protocol.item == u'h2':
-            complain(1228)
+            msg.complain(1228)
         if protocol.item == upgrade.h2c and msg.is_tls:
-            complain(1233)
+            msg.complain(1233)
 
-    if getattr(msg, 'status', None) == st.early_hints:
-        # 103 (Early Hints) responses are weird in that the headers they carry
-        # do not apply to themselves (RFC 8297 Section 2) but only to the final
-        # response (and then only speculatively). For such responses, we limit
-        # ourselves to checks that do not rely on having a complete and
-        # self-consistent message header block.
-        return
 
-    if headers.upgrade.is_present and u'upgrade' not in headers.connection:
-        complain(1050)
+@check(u'message.complete', 1050)
+def _check_upgrade_connection(msg):
+    if msg.headers.upgrade.is_present and \
+            u'upgrade' not in msg.headers.connection:
+        msg.complain(1050)
+
 
+@check(u'message.complete', 1189, 1190, 1191, 1192)
+def _check_transformation(msg):
     if msg.transformed_by_proxy:
-        if warn.transformation_applied not in headers.warning:
-            complain(1191)
-        if headers.cache_control.no_transform:
-            complain(1192)
+        if warn.transformation_applied not in msg.headers.warning:
+            msg.complain(1191)
+        if msg.headers.cache_control.no_transform:
+            msg.complain(1192)
+
 
-    if version == http2:
-        for hdr in headers:
+@check(u'message.complete', 1244, 1245)
+def _check_http2(msg):
+    if msg.version == http2:
+        for hdr in msg.headers:
             if hdr.name in [h.connection, h.transfer_encoding, h.keep_alive]:
-                complain(1244, header=hdr)
+                msg.complain(1244, header=hdr)
             elif hdr.name == h.upgrade:
-                complain(1245)
+                msg.complain(1245)
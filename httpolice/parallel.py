@@ -0,0 +1,313 @@
+"""Checking exchanges in several processes at once (``httpolice --jobs``).
+
+Exchanges cannot be sent between processes: they refer to unpicklable things
+like parsing rules and open files, and so do their notices. Instead,
+the input is split into parts (see :class:`httpolice.inputs.common.Part`),
+and a worker process does everything for one part: it parses the part,
+checks its exchanges, and renders them into pieces of the report.
+Only these pieces, with the severities of their notices, are sent back
+to the main process, which puts them together in the right order.
+
+With ``httpolice --budget``, workers also tell the main process which
+exchange they are working on. If one of them takes much longer than
+the budget (because it is stuck somewhere that :mod:`httpolice.util.deadline`
+cannot stop it), the worker is killed, and its part is started again,
+giving up on that exchange. If the worker gets stuck there again
+(because it is stuck reading the input), the part is cut short there.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from httpolice.exchange import Exchange
+from httpolice.inputs.common import InputError
+from httpolice.inputs.streams import _exchange_time, _join_sequences
+from httpolice.util import stats, timing
+
+
+# What comes back for one exchange: `fragment` is the exchange rendered
+# as bytes, `severities` is a list of the severities of its notices,
+# `time` is when it happened, if known (for ordering),
+# and `key` is what the `key` function of `run_parts` says about it.
+Result = collections.namedtuple('Result',
+                                ['fragment', 'severities', 'time', 'key'])
+
+
+def run_parts(parts, reorder, jobs, process, render, budget=None,
+              key=None):
+    """Process `parts` of the input in `jobs` worker processes.
+
+    `process` is called with every exchange and returns `None`
+    if it is to be skipped, or else the severities of its notices
+    (after checking it). If a worker had to be killed while on an exchange,
+    `process` is then called with it and ``give_up=True``, and must not
+    check it again. `render` is called with every exchange
+    that is not skipped and returns its piece of the report.
+    Both must be module-level functions (or partials of them),
+    so that they can be sent to the workers.
+
+    If `jobs` is 0, there is one worker per CPU.
+
+    If `budget` is a number of seconds, a worker that spends
+    more than :func:`hard_limit` on one exchange is killed.
+
+    If `key` is not `None`, it is called with every exchange not skipped,
+    in the worker, and what it returns goes into the :class:`Result`.
+    It must be a module-level function, too.
+
+    Generates a :class:`Result` for every exchange not skipped, in the same
+    order as the exchanges would come from the input without parts.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    progress = None if budget is None else multiprocessing.Queue()
+    with multiprocessing.Pool(jobs, _init_worker, (progress,)) as pool:
+        scheduler = _Scheduler(pool, parts, process, render, 2 * jobs,
+                               by_time=reorder, budget=budget,
+                               progress=progress, key=key)
+        yield from _join_sequences(scheduler.sequences(), reorder,
+                                   time_of=_result_time,
+                                   sorted_hints=scheduler.order is None)
+        if not scheduler.abandoned:
+            # Let the workers exit on their own, instead of being killed
+            # by `Pool.terminate` (which is what happens on errors).
+            # But the pool would wait forever for the results
+            # of killed workers.
+            pool.close()
+            pool.join()
+
+
+def hard_limit(budget):
+    """How long a worker may spend on one exchange with this `budget`.
+
+    Normally, checking stops on its own when the budget runs out,
+    so this leaves some time for that, and for rendering.
+    """
+    return 2 * budget + 1
+
+
+# How often the main process looks at the progress of the workers
+# while waiting for them, in seconds.
+POLL_INTERVAL = 0.1
+
+
+class _Scheduler:
+
+    """Sends parts to the workers a few at a time, as they are needed.
+
+    Keeping only `window` parts in flight (besides those being consumed)
+    means memory stays bounded if the results are consumed slowly.
+    Parts are sent ahead in the order they will probably be needed:
+    the order of the input, or, if `by_time`, the order of their time hints,
+    which is roughly how `_rearrange_by_time` starts them.
+
+    `parts` may also be an iterator (like from `httpolice.inputs.pcap`),
+    in which case it must already be in the order of time hints,
+    and parts are only taken from it as they are needed.
+    """
+
+    def __init__(self, pool, parts, process, render, window, by_time,
+                 budget=None, progress=None, key=None):
+        self.pool = pool
+        self.process = process
+        self.render = render
+        self.key = key
+        self.window = window
+        self.budget = budget
+        self.progress = progress
+        if isinstance(parts, list):
+            self.order = list(range(len(parts)))
+            if by_time:
+                # Parts without a time hint are started first.
+                self.order.sort(key=lambda i: (parts[i].time_hint is not None,
+                                               parts[i].time_hint or 0))
+        else:
+            self.order = None
+        self.next = 0               # Position in `order` (or `parts`).
+        self.source = enumerate(parts)
+        self.n_taken = 0
+        self.taken = {}             # Parts taken but not yet started.
+        self.pending = {}           # Index -> `multiprocessing.AsyncResult`.
+        self.sent = set()
+        self.started = {}           # Index -> part, until it is collected.
+        self.skip = {}              # Index -> exchanges to give up on.
+        self.stop = {}              # Index -> exchange to stop at.
+        self.busy = {}              # Worker PID -> (index, exchange, since).
+        self.abandoned = False
+
+    def sequences(self):
+        """Generate ``(sequence, time_hint)`` for every part, in order."""
+        i = 0
+        while self._take(i):
+            part = self.taken[i]
+            yield (self._sequence(i, part), part.time_hint)
+            i += 1
+
+    def _take(self, i):
+        # Make sure that part `i` has been taken, if there is such a part.
+        while self.n_taken <= i:
+            item = next(self.source, None)
+            if item is None:
+                return False
+            self.taken[item[0]] = item[1]
+            self.n_taken += 1
+        return True
+
+    def _sequence(self, i, part):
+        del self.taken[i]
+        if part.local:
+            yield from _results(part, self.process, self.render,
+                                key=self.key)
+            return
+        self._send(i, part)
+        self._fill()
+        yield from _collect(self._wait(i))
+
+    def _send(self, i, part):
+        if i not in self.sent:
+            self.sent.add(i)
+            self.started[i] = part
+            self._apply(i)
+
+    def _apply(self, i):
+        self.pending[i] = self.pool.apply_async(
+            _run_part, (self.started[i], self.process, self.render,
+                        timing.enabled, i, self.skip.get(i, frozenset()),
+                        self.stop.get(i), self.key))
+
+    def _wait(self, i):
+        # Wait for the output of part `i`, which may be restarted meanwhile.
+        while True:
+            try:
+                output = self.pending[i].get(
+                    None if self.budget is None else POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                self._watch()
+            else:
+                del self.pending[i]
+                del self.started[i]
+                return output
+
+    def _watch(self):
+        now = time.monotonic()
+        while True:
+            try:
+                (pid, i, k) = self.progress.get_nowait()
+            except queue.Empty:
+                break
+            if k is None:
+                self.busy.pop(pid, None)
+            else:
+                self.busy[pid] = (i, k, now)
+        for (pid, (i, k, since)) in list(self.busy.items()):
+            if now - since > hard_limit(self.budget):
+                del self.busy[pid]
+                self._kill(pid, i, k)
+
+    def _kill(self, pid, i, k):
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        stats.count(u'budget.killed')
+        self.abandoned = True
+        skip = self.skip.get(i, frozenset())
+        if k in skip:
+            self.stop[i] = k
+        else:
+            self.skip[i] = skip | {k}
+        self._apply(i)
+
+    def _fill(self):
+        # The part being collected is still `pending`, hence ``<=``.
+        while len(self.pending) <= self.window:
+            if self.order is None:
+                i = self.next
+            elif self.next < len(self.order):
+                i = self.order[self.next]
+            else:
+                break
+            if not self._take(i):
+                break
+            self.next += 1
+            # Parts that are not `taken` anymore have already been started.
+            if i in self.taken and not self.taken[i].local:
+                self._send(i, self.taken[i])
+
+
+def _collect(output):
+    (results, counters, timings, error) = output
+    for (name, n) in counters.items():
+        stats.count(name, n)
+    timing.merge(timings)
+    yield from results
+    if error is not None:
+        raise error
+
+
+# In a worker process with a budget, where to tell the main process
+# about ``(pid, part index, exchange index)``, the last being `None`
+# when the worker is done with the part.
+_progress = None
+
+
+def _init_worker(progress):
+    global _progress                # pylint: disable=global-statement
+    _progress = progress
+
+
+def _run_part(part, process, render, timed, i=None, skip=frozenset(),
+              stop=None, key=None):
+    # Runs in a worker process. Whatever has been processed before an error
+    # is returned along with it, so that it still makes it into the report,
+    # like it would without ``--jobs``.
+    stats.reset()
+    timing.reset()
+    timing.enabled = timed
+    results = []
+    error = None
+    try:
+        for result in _results(part, process, render, i, skip, stop, key):
+            results.append(result)
+    except (EnvironmentError, InputError) as exc:
+        error = exc
+    finally:
+        _report(i, None)
+    return (results, stats.snapshot(), timing.snapshot(), error)
+
+
+def _results(part, process, render, i=None, skip=frozenset(), stop=None,
+             key=None):
+    # Exchange number `k` of the part is not checked if it is in `skip`,
+    # and if it is `stop`, the part ends there (with an empty exchange
+    # to carry the notice about it).
+    exchanges = timing.iterate(u'input', part.func(*part.args))
+    for k in itertools.count():
+        _report(i, k)
+        if k == stop:
+            exch = Exchange(None, [])
+            severities = process(exch, give_up=True)
+        else:
+            exch = next(exchanges, None)
+            if exch is None:
+                break
+            if k in skip:
+                severities = process(exch, give_up=True)
+            else:
+                severities = process(exch)
+        if severities is not None:
+            yield Result(timing.measure(u'report', render, exch), severities,
+                         _exchange_time(exch, None),
+                         None if key is None else key(exch))
+        if k == stop:
+            break
+
+
+def _report(i, k):
+    if _progress is not None:
+        _progress.put((os.getpid(), i, k))
+
+
+def _result_time(result, hint):
+    return hint if result.time is None else result.time
@@ -44,6 +44,7 @@ import operator
 from bitstring import BitArray, Bits
 
 from httpolice.structure import Unavailable
+from httpolice.util import deadline
 from httpolice.util.text import format_chars
 
 
@@ -110,6 +111,9 @@ def parse(data, symbol, complain=None, fail_notice_id=None,
         except ParseError as e:
             if fail_notice_id is None:
                 raise
+            # The error is kept in the memo and in notices on messages,
+            # but its traceback would also keep the whole parsing chart.
+            e.__traceback__ = None
             complaint = (fail_notice_id, {'error': e})
             parse_result = (Unavailable(data), [complaint], [])
         else:
@@ -733,6 +737,7 @@ def _inner_parse(data, target_symbol, annotate_classes):
 
     # Outer loop: over `data`.
     for i in range(length + 1):
+        deadline.check()
         token = data[i : i + 1]
 
         # Initialize the items inventory for the next `i`,
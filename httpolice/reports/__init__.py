@@ -1,8 +1,19 @@
-from httpolice.reports.html import html_report
-from httpolice.reports.text import text_report
+from httpolice.reports.html import html_fragment, html_frame, html_report
+from httpolice.reports.text import text_fragment, text_frame, text_report
 
 
 formats = {
     u'text': text_report,
     u'html': html_report,
 }
+
+
+# A report can also be put together from pieces rendered separately
+# (such as in worker processes with ``--jobs``): the prologue, then
+# the rendered exchanges in order, then the epilogue. For every format,
+# this maps to a pair of functions: one returns ``(prologue, epilogue)``
+# as bytes, and the other renders one checked exchange as bytes.
+pieces = {
+    u'text': (text_frame, text_fragment),
+    u'html': (html_frame, html_fragment),
+}
@@ -35,6 +35,15 @@ def html_report(exchanges, buf):
         It must be opened in binary mode (not text).
 
     """
+    (prologue, epilogue) = html_frame()
+    buf.write(prologue)
+    for div in _generate_exchange_divs(exchanges):
+        buf.write(div.render().encode('utf-8'))
+    buf.write(epilogue)
+
+
+def html_frame():
+    """Return what comes before and after the exchanges in an HTML report."""
     # We don't want to hold the entire report in memory before printing it,
     # because that would mean unbounded memory growth with more input.
     # But Dominate obviously doesn't have a streaming mode, so we do this
@@ -56,11 +65,13 @@ def html_report(exchanges, buf):
         text_node(separator)
 
     (prologue, epilogue) = document.render().split(separator)
+    return (prologue.encode('utf-8'), epilogue.encode('utf-8'))
 
-    buf.write(prologue.encode('utf-8'))
-    for div in _generate_exchange_divs(exchanges):
-        buf.write(div.render().encode('utf-8'))
-    buf.write(epilogue.encode('utf-8'))
+
+def html_fragment(exch):
+    """Render one exchange as it appears in an HTML report, as bytes."""
+    return b''.join(div.render().encode('utf-8')
+                    for div in _generate_exchange_divs([exch]))
 
 
 class Placeholder:
@@ -116,6 +127,10 @@ def _common_meta(document):
 
 def _generate_exchange_divs(exchanges):
     for exch in exchanges:
+        # References only need to be unique within an exchange, and numbering
+        # them afresh keeps an exchange's HTML the same no matter where
+        # (or in which process) it is rendered.
+        _seen_ids.clear()
         div = H.div(_class=u'exchange')
         with div:
             if exch.request:
@@ -1,5 +1,6 @@
 import codecs
 from functools import singledispatch
+import io
 
 from httpolice import notice
 from httpolice.reports.common import (expand_piece, find_reason_phrase,
@@ -34,6 +35,18 @@ def text_report(exchanges, buf):
                 _write_complaint_line(complaint, f2)
 
 
+def text_frame():
+    """Return what comes before and after the exchanges in a text report."""
+    return (b'', b'')
+
+
+def text_fragment(exch):
+    """Render one exchange as it appears in a text report, as bytes."""
+    buf = io.BytesIO()
+    text_report([exch], buf)
+    return buf.getvalue()
+
+
 def _exchange_marker(exchange):
     if exchange.request:
         marker = u'------------ request: %s %s' % (
@@ -6,6 +6,7 @@ from urllib.parse import parse_qs, urlparse
 
 from httpolice import known, message
 from httpolice.blackboard import derived_property
+from httpolice.checks import check, run_checks
 from httpolice.known import auth, cache, cc, h, m, prefer, tc, upgrade
 from httpolice.parse import mark, parse
 from httpolice.structure import (EntityTag, Method, MultiDict, Parametrized,
@@ -25,6 +26,8 @@ connect_target = mark(authority_form)
 
 class Request(message.Message):
 
+    __slots__ = ('scheme', 'method', 'target')
+
     def __init__(self, scheme, method, target, version, header_entries,
                  body, trailer_entries=None, remark=None):
         """
@@ -200,58 +203,81 @@ class Request(message.Message):
 
 def check_request(req):
     """Apply all checks to the request `req`."""
-    complain = req.complain
-    method = req.method
-    version = req.version
-    headers = req.headers
-    body = req.body
-
     req.silence(notice_id
-                for (notice_id, in_resp) in headers.httpolice_silence
+                for (notice_id, in_resp) in req.headers.httpolice_silence
                 if not in_resp)
-
     message.check_message(req)
+    run_checks(u'request', req)
+
 
+@check(u'request', 1045, 1292, 1295)
+def _check_method_and_target(req):
     # Check the syntax of request method and target.
-    parse(method, rfc7230.method, complain, 1292, place=u'request method')
+    parse(req.method, rfc7230.method, req.complain, 1292,
+          place=u'request method')
     _ = req.target_form
 
+    method = req.method
     if method != method.upper() and method.upper() in known.method:
-        complain(1295, uppercase=Method(method.upper()))
+        req.complain(1295, uppercase=Method(method.upper()))
+
+
+@check(u'request', 1021, 1022, 1041)
+def _check_body_headers(req):
+    complain = req.complain
+    method = req.method
+    headers = req.headers
 
-    if body and headers.content_type.is_absent:
+    if req.body and headers.content_type.is_absent:
         complain(1041)
 
-    if (version in [http10, http11] and known.method.defines_body(method) and
+    if (req.version in [http10, http11] and
+            known.method.defines_body(method) and
             headers.content_length.is_absent and
             headers.transfer_encoding.is_absent):
         complain(1021)
 
-    if known.method.defines_body(method) is False and (body == b'') and \
+    if known.method.defines_body(method) is False and (req.body == b'') and \
             headers.content_length.is_present:
         complain(1022)
 
+
+@check(u'request', 1028, 1029, 1244)
+def _check_te(req):
+    headers = req.headers
     if tc.chunked in headers.te:
-        complain(1028)
+        req.complain(1028)
+    if req.version == http2 and headers.te and headers.te != [u'trailers']:
+        req.complain(1244, header=headers.te)
+    if req.version == http11 and headers.te and \
+            u'TE' not in headers.connection:
+        req.complain(1029)
+
 
-    if version == http2 and headers.te and headers.te != [u'trailers']:
-        complain(1244, header=headers.te)
-    if version == http11 and headers.te and u'TE' not in headers.connection:
-        complain(1029)
+@check(u'request', 1031, 1032)
+def _check_host(req):
+    if req.version == http11 and req.headers.host.is_absent:
+        req.complain(1031)
+    if req.headers.host.is_present and req.header_entries[0].name != h.host:
+        req.complain(1032)
 
-    if version == http11 and headers.host.is_absent:
-        complain(1031)
-    if headers.host.is_present and req.header_entries[0].name != h.host:
-        complain(1032)
 
-    for hdr in headers:
+@check(u'request', 1053, 1063)
+def _check_header_placement(req):
+    for hdr in req.headers:
         if known.header.is_for_request(hdr.name) is False:
-            complain(1063, header=hdr)
+            req.complain(1063, header=hdr)
         elif known.header.is_representation_metadata(hdr.name) and \
                 req.has_body is False:
-            complain(1053, header=hdr)
+            req.complain(1053, header=hdr)
+
+
+@check(u'request', 1056, 1057, 1059, 1061, 1062)
+def _check_body_with_method(req):
+    complain = req.complain
+    method = req.method
 
-    if body:
+    if req.body:
         if method == m.GET:
             complain(1056)
         elif method == m.HEAD:
@@ -261,32 +287,54 @@ def check_request(req):
         elif method == m.CONNECT:
             complain(1061)
 
-    if method == m.OPTIONS and body and headers.content_type.is_absent:
+    if method == m.OPTIONS and req.body and \
+            req.headers.content_type.is_absent:
         complain(1062)
 
-    if headers.expect == u'100-continue' and req.has_body is False:
-        complain(1066)
 
-    if headers.max_forwards.is_present and method not in [m.OPTIONS, m.TRACE]:
-        complain(1067)
+@check(u'request', 1066, 1067)
+def _check_expect_and_max_forwards(req):
+    if req.headers.expect == u'100-continue' and req.has_body is False:
+        req.complain(1066)
+
+    if req.headers.max_forwards.is_present and \
+            req.method not in [m.OPTIONS, m.TRACE]:
+        req.complain(1067)
+
 
-    if headers.referer.is_okay:
+@check(u'request', 1068)
+def _check_referer(req):
+    if req.headers.referer.is_okay:
         if req.is_tls is False:
-            parsed = urlparse(headers.referer.value)
+            parsed = urlparse(req.headers.referer.value)
             if parsed.scheme == u'https':
-                complain(1068)
+                req.complain(1068)
 
+
+@check(u'request', 1070, 1093)
+def _check_user_agent(req):
+    headers = req.headers
     if headers.user_agent.is_absent:
-        complain(1070)
+        req.complain(1070)
     elif headers.user_agent.is_okay:
         products = [p for p in headers.user_agent if isinstance(p, Versioned)]
         if products and all(known.product.is_library(p.item)
                             for p in products):
-            complain(1093, library=products[0])
+            req.complain(1093, library=products[0])
+
 
-    for x in headers.accept_encoding:
+@check(u'request', 1116)
+def _check_accept_encoding(req):
+    for x in req.headers.accept_encoding:
         if x.item in [cc.x_gzip, cc.x_compress] and x.param is not None:
-            complain(1116, coding=x.item)
+            req.complain(1116, coding=x.item)
+
+
+@check(u'request', 1120, 1122, 1130, 1131)
+def _check_preconditions(req):
+    complain = req.complain
+    method = req.method
+    headers = req.headers
 
     if headers.if_match != u'*' and any(tag.weak for tag in headers.if_match):
         complain(1120)
@@ -305,14 +353,25 @@ def check_request(req):
         if headers.if_modified_since.is_present:
             complain(1122)
 
-    if headers.range.is_present and method != m.GET:
-        complain(1132)
+
+@check(u'request', 1132, 1134, 1135)
+def _check_range(req):
+    headers = req.headers
+
+    if headers.range.is_present and req.method != m.GET:
+        req.complain(1132)
 
     if headers.if_range.is_present and headers.range.is_absent:
-        complain(1134)
+        req.complain(1134)
 
     if isinstance(headers.if_range.value, EntityTag) and headers.if_range.weak:
-        complain(1135)
+        req.complain(1135)
+
+
+@check(u'request', 1152, 1159, 1161, 1165, 1171, 1193)
+def _check_caching(req):
+    complain = req.complain
+    headers = req.headers
 
     for direct in headers.cache_control:
         if known.cache_directive.is_for_request(direct.item) is False:
@@ -327,7 +386,7 @@ def check_request(req):
         if 100 <= warning.code <= 199:
             complain(1165, code=warning.code)
 
-    if known.method.is_cacheable(method) is False:
+    if known.method.is_cacheable(req.method) is False:
         for direct in headers.cache_control:
             if direct.item in [cache.max_age, cache.max_stale, cache.min_fresh,
                                cache.no_cache, cache.no_store,
@@ -341,7 +400,10 @@ def check_request(req):
         if headers.cache_control[direct1] and headers.cache_control[direct2]:
             complain(1193, directive1=direct1, directive2=direct2)
 
-    for hdr in [headers.authorization, headers.proxy_authorization]:
+
+@check(u'request', 1209, 1210, 1211, 1212, 1261, 1262, 1274)
+def _check_authorization(req):
+    for hdr in [req.headers.authorization, req.headers.proxy_authorization]:
         if hdr.is_okay:
             scheme, credentials = hdr.value
             if scheme == auth.basic:
@@ -349,51 +411,72 @@ def check_request(req):
             elif scheme == auth.bearer:
                 _check_bearer_auth(req, hdr, credentials)
             elif not credentials:
-                complain(1274, header=hdr)
+                req.complain(1274, header=hdr)
+
+
+@check(u'request', 1213)
+def _check_patch(req):
+    if req.method == m.PATCH and req.headers.content_type.is_okay:
+        if known.media_type.is_patch(req.headers.content_type.item) is False:
+            req.complain(1213)
 
-    if method == m.PATCH and headers.content_type.is_okay:
-        if known.media_type.is_patch(headers.content_type.item) is False:
-            complain(1213)
+
+@check(u'request', 1230, 1231, 1233, 1234)
+def _check_http2_upgrade(req):
+    headers = req.headers
 
     for protocol in headers.upgrade:
         if protocol.item == upgrade.h2c:
             if req.is_tls:
-                complain(1233)
+                req.complain(1233)
             if headers.http2_settings.is_absent:
-                complain(1231)
+                req.complain(1231)
 
     if headers.http2_settings and u'HTTP2-Settings' not in headers.connection:
-        complain(1230)
+        req.complain(1230)
 
     if headers.http2_settings.is_okay:
         if not _is_urlsafe_base64(headers.http2_settings.value):
-            complain(1234)
+            req.complain(1234)
+
 
+@check(u'request', 1270, 1271, 1272)
+def _check_access_token(req):
     if u'access_token' in req.query_params:
-        complain(1270)
+        req.complain(1270)
         if req.is_tls is False:
-            complain(1271, where=req.target)
-        if not headers.cache_control.no_store:
-            complain(1272)
+            req.complain(1271, where=req.target)
+        if not req.headers.cache_control.no_store:
+            req.complain(1272)
 
     if okay(req.url_encoded_data) and u'access_token' in req.url_encoded_data:
         if req.is_tls is False:
-            complain(1271, where=req.displayable_body)
+            req.complain(1271, where=req.displayable_body)
 
+
+@check(u'request', 1276)
+def _check_accept_subsumptions(req):
+    headers = req.headers
     for hdr in [headers.accept, headers.accept_charset,
                 headers.accept_encoding, headers.accept_language]:
         for (wildcard, value) in _accept_subsumptions(hdr):
-            complain(1276, header=hdr, wildcard=wildcard, value=value)
+            req.complain(1276, header=hdr, wildcard=wildcard, value=value)
             # No need to report more than one subsumption per header.
             break
 
+
+@check(u'request', 1285, 1287, 1288, 1289, 1290)
+def _check_prefer(req):
+    complain = req.complain
+    headers = req.headers
+
     for dup_pref in duplicates(name for ((name, _), _) in headers.prefer):
         complain(1285, name=dup_pref)
 
-    if headers.prefer.respond_async and known.method.is_safe(method):
+    if headers.prefer.respond_async and known.method.is_safe(req.method):
         complain(1287)
 
-    if headers.prefer.return_ == u'minimal' and method == m.GET:
+    if headers.prefer.return_ == u'minimal' and req.method == m.GET:
         complain(1288)
 
     if (prefer.return_, u'minimal') in headers.prefer.without_params and \
@@ -3,6 +3,7 @@ from urllib.parse import urljoin, urlparse
 
 from httpolice import known, message
 from httpolice.blackboard import derived_property
+from httpolice.checks import check, run_checks
 from httpolice.known import (Cacheable, auth, cache, h, hsts, m, media, st, tc,
                              unit, upgrade, warn)
 from httpolice.parse import parse
@@ -16,6 +17,8 @@ from httpolice.util.text import (contains_percent_encodes, force_unicode,
 
 class Response(message.Message):
 
+    __slots__ = ('status', 'reason', 'request')
+
     def __init__(self, version, status, reason, header_entries,
                  body, trailer_entries=None, remark=None):
         """
@@ -225,44 +228,70 @@ def check_response(resp):
 def check_response_itself(resp):
     resp.silence(notice_id
                  for (notice_id, _) in resp.headers.httpolice_silence)
-
     message.check_message(resp)
+    run_checks(u'response', resp)
+    if resp.status == st.early_hints:
+        # 103 (Early Hints) responses are weird in that the headers they carry
+        # do not apply to themselves (RFC 8297 Section 2) but only to the final
+        # response (and then only speculatively). For such responses, we limit
+        # ourselves to checks that do not rely on having a complete and
+        # self-consistent message header block.
+        return
+    run_checks(u'response.complete', resp)
 
-    complain = resp.complain
-    version = resp.version
-    status = resp.status
-    headers = resp.headers
-    body = resp.body
 
+@check(u'response', 1294)
+def _check_reason(resp):
     # Check syntax of reason phrase.
     if okay(resp.reason):
-        parse(resp.reason, rfc7230.reason_phrase, complain, 1294,
+        parse(resp.reason, rfc7230.reason_phrase, resp.complain, 1294,
               place=u'reason phrase')
 
-    if not (100 <= status <= 599):
-        complain(1167)
 
+@check(u'response', 1167)
+def _check_status_code(resp):
+    if not (100 <= resp.status <= 599):
+        resp.complain(1167)
+
+
+@check(u'response', 1025, 1047)
+def _check_delimiting(resp):
     if resp.delimited_by_close:
         if resp.version == http11 and u'close' not in resp.headers.connection:
-            complain(1047)
+            resp.complain(1047)
 
-    for hdr in headers:
+
+@check(u'response', 1064)
+def _check_header_placement(resp):
+    for hdr in resp.headers:
         if known.header.is_for_response(hdr.name) is False:
-            complain(1064, header=hdr)
+            resp.complain(1064, header=hdr)
 
-    if status == st.switching_protocols:
-        if headers.upgrade.is_absent:
-            complain(1048)
-        if version == http2:
-            complain(1246)
 
-    if status == st.no_content and body:
-        complain(1240)
+@check(u'response', 1048, 1246)
+def _check_switching_protocols(resp):
+    if resp.status == st.switching_protocols:
+        if resp.headers.upgrade.is_absent:
+            resp.complain(1048)
+        if resp.version == http2:
+            resp.complain(1246)
 
-    if status == st.reset_content and body:
-        complain(1076)
 
-    if headers.location.is_absent:
+@check(u'response', 1076, 1240)
+def _check_body_with_status(resp):
+    if resp.status == st.no_content and resp.body:
+        resp.complain(1240)
+
+    if resp.status == st.reset_content and resp.body:
+        resp.complain(1076)
+
+
+@check(u'response', 1078, 1079, 1080, 1084, 1205)
+def _check_location_required(resp):
+    complain = resp.complain
+    status = resp.status
+
+    if resp.headers.location.is_absent:
         if status == st.moved_permanently:
             complain(1078)
         elif status == st.found:
@@ -274,6 +303,13 @@ def check_response_itself(resp):
         elif status == st.permanent_redirect:
             complain(1205)
 
+
+@check(u'response', 1082, 1083, 1088, 1089, 1094, 1110)
+def _check_status_codes(resp):
+    complain = resp.complain
+    status = resp.status
+    headers = resp.headers
+
     if status == st.use_proxy:
         complain(1082)
     elif status == 306:
@@ -291,15 +327,23 @@ def check_response_itself(resp):
                                    status.client_error):
         complain(1110)
 
-    if status == st.created and headers.location.is_okay and \
+
+@check(u'response', 1111, 1118)
+def _check_location_and_dates(resp):
+    headers = resp.headers
+
+    if resp.status == st.created and headers.location.is_okay and \
             urlparse(headers.location.value).fragment:
-        complain(1111)
+        resp.complain(1111)
 
     if headers.date < headers.last_modified.value:
-        complain(1118)
+        resp.complain(1118)
 
-    if status == st.not_modified:
-        for hdr in headers:
+
+@check(u'response', 1127)
+def _check_not_modified(resp):
+    if resp.status == st.not_modified:
+        for hdr in resp.headers:
             # RFC 7232 says "Last-Modified might be useful
             # if the response does not have an ETag field",
             # but really it doesn't hurt even if there is an ETag,
@@ -307,30 +351,44 @@ def check_response_itself(resp):
             if hdr.name in [h.etag, h.last_modified]:
                 continue
             elif known.header.is_representation_metadata(hdr.name):
-                complain(1127, header=hdr)
+                resp.complain(1127, header=hdr)
 
-    if status == st.partial_content:
+
+@check(u'response', 1138, 1141, 1142, 1143)
+def _check_partial_content(resp):
+    headers = resp.headers
+    if resp.status == st.partial_content:
         if headers.content_type == media.multipart_byteranges:
             _check_multipart_byteranges(resp)
             if headers.content_range.is_present:
-                complain(1143)
+                resp.complain(1143)
         elif headers.content_range.is_absent:
-            complain(1138)
+            resp.complain(1138)
 
-    for direct in headers.cache_control:
+
+@check(u'response', 1153, 1162)
+def _check_cache_directives(resp):
+    for direct in resp.headers.cache_control:
         if known.cache_directive.is_for_response(direct.item) is False:
-            complain(1153, directive=direct.item)
+            resp.complain(1153, directive=direct.item)
+
+    if u'no-cache' in resp.headers.pragma:
+        resp.complain(1162)
 
-    if u'no-cache' in headers.pragma:
-        complain(1162)
 
-    if status == st.unavailable_for_legal_reasons:
+@check(u'response', 1243)
+def _check_legal_reasons(resp):
+    if resp.status == st.unavailable_for_legal_reasons:
         if not any(u'blocked-by' in link.param.get(u'rel', [])
-                   for link in headers.link):
-            complain(1243)
+                   for link in resp.headers.link):
+            resp.complain(1243)
 
-    if headers.content_disposition.is_okay:
-        params = headers.content_disposition.param
+
+@check(u'response', 1247, 1248, 1249, 1250, 1251, 1252)
+def _check_content_disposition(resp):
+    complain = resp.complain
+    if resp.headers.content_disposition.is_okay:
+        params = resp.headers.content_disposition.param
         for name in params.duplicates():
             complain(1247, param=name)
 
@@ -351,25 +409,38 @@ def check_response_itself(resp):
             elif params.index(u'filename*') < params.index(u'filename'):
                 complain(1252)
 
-    if headers.alt_svc.is_present:
-        if version == http2:
-            complain(1258)
-        if status == st.misdirected_request:
-            complain(1260)
-
-    if headers.strict_transport_security.is_okay:
-        if hsts.max_age not in headers.strict_transport_security:
-            complain(1218)
-        if headers.strict_transport_security.max_age == 0 and \
-                headers.strict_transport_security.includesubdomains:
-            complain(1219)
-        for dupe in duplicates(d.item
-                               for d in headers.strict_transport_security):
-            complain(1220, directive=dupe)
-
-    for patch_type in headers.accept_patch:
+
+@check(u'response', 1258, 1260)
+def _check_alt_svc(resp):
+    if resp.headers.alt_svc.is_present:
+        if resp.version == http2:
+            resp.complain(1258)
+        if resp.status == st.misdirected_request:
+            resp.complain(1260)
+
+
+@check(u'response', 1218, 1219, 1220)
+def _check_strict_transport_security(resp):
+    hsts_header = resp.headers.strict_transport_security
+    if hsts_header.is_okay:
+        if hsts.max_age not in hsts_header:
+            resp.complain(1218)
+        if hsts_header.max_age == 0 and hsts_header.includesubdomains:
+            resp.complain(1219)
+        for dupe in duplicates(d.item for d in hsts_header):
+            resp.complain(1220, directive=dupe)
+
+
+@check(u'response', 1227)
+def _check_accept_patch(resp):
+    for patch_type in resp.headers.accept_patch:
         if known.media_type.is_patch(patch_type.item) is False:
-            complain(1227, patch_type=patch_type.item)
+            resp.complain(1227, patch_type=patch_type.item)
+
+
+@check(u'response', 1193, 1238, 1235)
+def _check_cache_control(resp):
+    headers = resp.headers
 
     for direct1, direct2 in [(cache.public, cache.no_store),
                              (cache.private, cache.public),
@@ -378,7 +449,7 @@ def check_response_itself(resp):
                               cache.stale_while_revalidate),
                              (cache.must_revalidate, cache.stale_if_error)]:
         if headers.cache_control[direct1] and headers.cache_control[direct2]:
-            complain(1193, directive1=direct1, directive2=direct2)
+            resp.complain(1193, directive1=direct1, directive2=direct2)
 
     for direct1, direct2 in [(cache.max_age, cache.no_cache),
                              (cache.max_age, cache.no_store),
@@ -387,17 +458,23 @@ def check_response_itself(resp):
                              (cache.s_maxage, cache.no_store)]:
         if headers.cache_control[direct1] and \
                 headers.cache_control[direct2] in [True, []]:
-            complain(1238, directive1=direct1, directive2=direct2)
+            resp.complain(1238, directive1=direct1, directive2=direct2)
 
     if headers.vary != u'*' and h.host in headers.vary:
-        complain(1235)
+        resp.complain(1235)
 
-    if status == st.unauthorized and headers.www_authenticate.is_absent:
-        complain(1194)
 
-    if status == st.proxy_authentication_required and \
+@check(u'response', 1194, 1195, 1206, 1207, 1208, 1263, 1264, 1265, 1266,
+       1267, 1268, 1269, 1273)
+def _check_challenges(resp):
+    headers = resp.headers
+
+    if resp.status == st.unauthorized and headers.www_authenticate.is_absent:
+        resp.complain(1194)
+
+    if resp.status == st.proxy_authentication_required and \
             headers.proxy_authenticate.is_absent:
-        complain(1195)
+        resp.complain(1195)
 
     for hdr in [headers.www_authenticate, headers.proxy_authenticate]:
         for challenge in hdr:
@@ -406,41 +483,53 @@ def check_response_itself(resp):
             if challenge.item == auth.bearer:
                 _check_bearer_challenge(resp, hdr, challenge)
 
-    if status == st.early_hints:
-        # 103 (Early Hints) responses are weird in that the headers they carry
-        # do not apply to themselves (RFC 8297 Section 2) but only to the final
-        # response (and then only speculatively). For such responses, we limit
-        # ourselves to checks that do not rely on having a complete and
-        # self-consistent message header block.
-        return
+
+@check(u'response.complete', 1018, 1023, 1052, 1198)
+def _check_informational(resp):
+    status = resp.status
+    headers = resp.headers
 
     if status.informational or status == st.no_content:
         if headers.transfer_encoding.is_present:
-            complain(1018)
+            resp.complain(1018)
         if headers.content_length.is_present:
-            complain(1023)
+            resp.complain(1023)
 
     if status.informational and u'close' in headers.connection:
-        complain(1198)
+        resp.complain(1198)
 
     for hdr in headers:
         if known.header.is_representation_metadata(hdr.name) and \
                 status.informational:
-            complain(1052, header=hdr)
+            resp.complain(1052, header=hdr)
+
+
+@check(u'response.complete', 1112, 1113, 1147)
+def _check_headers_for_status(resp):
+    status = resp.status
+    headers = resp.headers
 
     if headers.location.is_present and \
             not status.redirection and status != st.created:
-        complain(1112)
+        resp.complain(1112)
 
     if headers.retry_after.is_present and \
             not status.redirection and \
             status not in [st.payload_too_large, st.service_unavailable,
                            st.too_many_requests]:
-        complain(1113)
+        resp.complain(1113)
 
     if headers.content_range.is_present and \
             status not in [st.partial_content, st.range_not_satisfiable]:
-        complain(1147)
+        resp.complain(1147)
+
+
+@check(u'response.complete', 1166, 1168, 1169, 1175, 1176, 1177, 1178, 1179,
+       1180, 1181, 1182, 1183, 1184, 1185, 1186, 1187, 1202, 1241)
+def _check_caching(resp):
+    complain = resp.complain
+    status = resp.status
+    headers = resp.headers
 
     if resp.from_cache:
         if headers.age.is_absent:
@@ -471,75 +560,111 @@ def check_response_itself(resp):
         if headers.cache_control.must_revalidate:
             complain(1187)
 
+
+@check(u'response.complete', 1301, 1302, 1303)
+def _check_immutable(resp):
+    headers = resp.headers
     if headers.cache_control.immutable:
         if headers.expires.is_absent or headers.expires.value <= headers.date:
             if not headers.cache_control.max_age:
-                complain(1301)
+                resp.complain(1301)
         if resp.is_tls is False:
-            complain(1302)
+            resp.complain(1302)
         if resp.delimited_by_close:
-            complain(1303)
+            resp.complain(1303)
 
+
+@check(u'response.complete', 1217, 1310)
+def _check_allow(resp):
+    headers = resp.headers
     if headers.allow.is_present:
         if headers.accept_patch.is_present and m.PATCH not in headers.allow:
-            complain(1217)
+            resp.complain(1217)
         if headers.accept_post.is_present and m.POST not in headers.allow:
-            complain(1310)
+            resp.complain(1310)
 
-    if resp.transformed_by_proxy and headers.via.is_absent:
-        complain(1046)
+
+@check(u'response.complete', 1046)
+def _check_via(resp):
+    if resp.transformed_by_proxy and resp.headers.via.is_absent:
+        resp.complain(1046)
 
 
 def check_response_in_context(resp, req):
     resp.silence(notice_id
                  for (notice_id, in_resp) in req.headers.httpolice_silence
                  if in_resp)
+    run_checks(u'response_in_context', resp, req)
+    if resp.status == st.early_hints:
+        # See the comment in `check_response_itself`.
+        return
+    run_checks(u'response_in_context.complete', resp, req)
 
-    complain = resp.complain
-    method = req.method
-    status = resp.status
 
+@check(u'response_in_context', 1041)
+def _check_content_type(resp, req):
     if resp.body and resp.headers.content_type.is_absent and \
-            (status != st.partial_content or req.headers.if_range.is_absent):
-        complain(1041)
+            (resp.status != st.partial_content or
+             req.headers.if_range.is_absent):
+        resp.complain(1041)
+
 
-    if method == m.CONNECT and status.successful:
+@check(u'response_in_context', 1019, 1024, 1199, 1239)
+def _check_method_framing(resp, req):
+    if req.method == m.CONNECT and resp.status.successful:
         if resp.headers.transfer_encoding.is_present:
-            complain(1019)
+            resp.complain(1019)
         if resp.headers.content_length.is_present:
-            complain(1024)
+            resp.complain(1024)
         if u'close' in resp.headers.connection:
-            complain(1199)
+            resp.complain(1199)
 
-    if method == m.HEAD and resp.body:
-        complain(1239)
+    if req.method == m.HEAD and resp.body:
+        resp.complain(1239)
 
+
+@check(u'response_in_context', 1033, 1306)
+def _check_version(resp, req):
     if req.version == http10 and resp.headers.transfer_encoding.is_present:
-        complain(1306)
+        resp.complain(1306)
 
     if req.version == http11 and (not req.headers.host.is_okay or
                                   req.headers.host.total_entries > 1):
-        if status.successful or status.redirection:
-            complain(1033)
+        if resp.status.successful or resp.status.redirection:
+            resp.complain(1033)
+
 
+@check(u'response_in_context', 1046, 1236, 1237)
+def _check_proxy(resp, req):
     if resp.transformed_by_proxy and req.is_to_proxy is False:
-        complain(1237)
+        resp.complain(1237)
 
-    if req.is_to_proxy and status.successful and resp.headers.via.is_absent:
+    if req.is_to_proxy and resp.status.successful and \
+            resp.headers.via.is_absent:
         # Non-2xx responses may be generated by the proxy itself (e.g. 407).
-        complain(1046)
+        resp.complain(1046)
 
+
+@check(u'response_in_context', 1049, 1051, 1071, 1232)
+def _check_switching_protocols_to(resp, req):
+    status = resp.status
     if status == st.switching_protocols:
         for protocol in resp.headers.upgrade:
             if protocol not in req.headers.upgrade:
-                complain(1049)
+                resp.complain(1049)
             elif protocol.item == upgrade.h2c:
                 if not req.headers.http2_settings.is_okay:
-                    complain(1232)
+                    resp.complain(1232)
         if req.version == http10:
-            complain(1051)
+            resp.complain(1051)
     elif status.informational and req.version == http10:
-        complain(1071)
+        resp.complain(1071)
+
+
+@check(u'response_in_context', 1055, 1060, 1085)
+def _check_self_references(resp, req):
+    method = req.method
+    status = resp.status
 
     if resp.headers.content_location.is_okay and req.effective_uri:
         if req.effective_uri == urljoin(req.effective_uri,
@@ -548,19 +673,26 @@ def check_response_in_context(resp, req):
                     status in [st.ok, st.non_authoritative_information,
                                st.no_content, st.partial_content,
                                st.not_modified]:
-                complain(1055)
+                resp.complain(1055)
             if method == m.DELETE:
-                complain(1060)
+                resp.complain(1060)
 
     if resp.headers.location.is_okay and req.effective_uri and req.scheme:
         if req.effective_uri == urljoin(req.effective_uri,
                                         resp.headers.location.value):
             if status in [st.multiple_choices, st.temporary_redirect,
                           st.permanent_redirect]:
-                complain(1085)
+                resp.complain(1085)
             if status in [st.moved_permanently, st.found, st.see_other] and \
                     method != m.POST:
-                complain(1085)
+                resp.complain(1085)
+
+
+@check(u'response_in_context', 1058, 1072, 1073, 1074, 1095)
+def _check_status_for_method(resp, req):
+    complain = resp.complain
+    method = req.method
+    status = resp.status
 
     if method == m.PUT and req.headers.content_range.is_present and \
             status.successful:
@@ -578,7 +710,14 @@ def check_response_in_context(resp, req):
             resp.headers.location.is_absent:
         complain(1073)
 
-    if method != m.HEAD and resp.body == b'':
+
+@check(u'response_in_context', 1077, 1081, 1087, 1092, 1096, 1104, 1106,
+       1201, 1203, 1204, 1242, 1284)
+def _check_empty_body(resp, req):
+    complain = resp.complain
+    status = resp.status
+
+    if req.method != m.HEAD and resp.body == b'':
         if status == st.accepted:
             complain(1284)
         elif status == st.multiple_choices:
@@ -604,14 +743,22 @@ def check_response_in_context(resp, req):
         elif status.server_error:
             complain(1104)
 
-    if method == m.OPTIONS and req.target_form is rfc7230.asterisk_form and \
-            status in [st.multiple_choices, st.moved_permanently,
-                       st.found, st.temporary_redirect, st.permanent_redirect]:
-        complain(1086)
 
-    if status == st.not_acceptable:
+@check(u'response_in_context', 1086)
+def _check_options_redirect(resp, req):
+    if req.method == m.OPTIONS and \
+            req.target_form is rfc7230.asterisk_form and \
+            resp.status in [st.multiple_choices, st.moved_permanently,
+                            st.found, st.temporary_redirect,
+                            st.permanent_redirect]:
+        resp.complain(1086)
+
+
+@check(u'response_in_context', 1090, 1117)
+def _check_not_acceptable(resp, req):
+    if resp.status == st.not_acceptable:
         if not req.headers.clearly(known.header.is_proactive_conneg):
-            complain(1090)
+            resp.complain(1090)
             # We used to report a separate comment notice (no. 1091)
             # in case the request had some headers we didn't know.
             # But it's unlikely that anyone would use custom conneg headers,
@@ -619,46 +766,67 @@ def check_response_in_context(resp, req):
             # (after all, it can be silenced).
         elif req.headers.clearly(known.header.is_proactive_conneg) == \
                 {h.accept_language}:
-            complain(1117)
+            resp.complain(1117)
+
+
+@check(u'response_in_context', 1097, 1098, 1099, 1100)
+def _check_client_errors(resp, req):
+    status = resp.status
 
     if status == st.length_required and req.headers.content_length.is_okay:
-        complain(1097)
+        resp.complain(1097)
 
     if req.body == b'':
         if status == st.payload_too_large:
-            complain(1098)
+            resp.complain(1098)
 
         # Even if the request actually has no body,
         # it makes sense for the server to look at the ``Content-Type``
         # and respond with 415 (Unsupported Media Type) anyway.
         if status == st.unsupported_media_type and \
                 req.headers.content_type.is_absent:
-            complain(1099)
+            resp.complain(1099)
 
     if status == st.expectation_failed and req.headers.expect.is_absent:
-        complain(1100)
+        resp.complain(1100)
+
+
+@check(u'response_in_context', 1101, 1102, 1103, 1105)
+def _check_upgrade(resp, req):
+    status = resp.status
 
     for protocol in resp.headers.upgrade:
         if protocol in req.headers.upgrade:
             if status == st.upgrade_required:
-                complain(1102, protocol=protocol)
+                resp.complain(1102, protocol=protocol)
             elif status.successful:
-                complain(1103, protocol=protocol)
+                resp.complain(1103, protocol=protocol)
             break
 
     if status == st.upgrade_required and not resp.headers.upgrade:
-        complain(1101)
+        resp.complain(1101)
 
     if status == st.http_version_not_supported and resp.version and \
             resp.version == req.version:
-        complain(1105)
+        resp.complain(1105)
+
 
-    if status == st.method_not_allowed:
-        if method in resp.headers.allow:
-            complain(1114)
-    elif status.successful:
-        if resp.headers.allow.is_present and method not in resp.headers.allow:
-            complain(1115)
+@check(u'response_in_context', 1114, 1115)
+def _check_allow_method(resp, req):
+    if resp.status == st.method_not_allowed:
+        if req.method in resp.headers.allow:
+            resp.complain(1114)
+    elif resp.status.successful:
+        if resp.headers.allow.is_present and \
+                req.method not in resp.headers.allow:
+            resp.complain(1115)
+
+
+@check(u'response_in_context', 1121, 1123, 1124, 1125, 1128, 1129)
+def _check_conditional(resp, req):
+    complain = resp.complain
+    method = req.method
+    status = resp.status
 
     if method in [m.GET, m.HEAD] and status.successful:
         if resp.headers.etag.is_okay:
@@ -694,10 +862,16 @@ def check_response_in_context(resp, req):
             if method in [m.CONNECT, m.OPTIONS, m.TRACE]:
                 complain(1129)
 
+
+@check(u'response_in_context', 1136, 1137, 1144, 1145, 1146, 1149, 1150)
+def _check_ranges(resp, req):
+    complain = resp.complain
+    status = resp.status
+
     if status == st.partial_content:
         if req.headers.range.is_absent:
             complain(1136)
-        elif method != m.GET:
+        elif req.method != m.GET:
             complain(1137)
 
         if (resp.headers.content_type == media.multipart_byteranges and
@@ -725,8 +899,13 @@ def check_response_in_context(resp, req):
                 resp.headers.content_range.is_absent:
             complain(1150)
 
+
+@check(u'response_in_context', 1170, 1172, 1173, 1174, 1188)
+def _check_caching_in_context(resp, req):
+    complain = resp.complain
+
     if resp.from_cache:
-        if known.method.is_cacheable(method) is False:
+        if known.method.is_cacheable(req.method) is False:
             complain(1172)
         if resp.headers.age > req.headers.cache_control.max_age:
             complain(1170)
@@ -745,54 +924,62 @@ def check_response_in_context(resp, req):
             resp.headers.cache_control.stale_while_revalidate is None:
         complain(1188)
 
-    if status == st.precondition_required:
+
+@check(u'response_in_context', 1200)
+def _check_precondition_required(resp, req):
+    if resp.status == st.precondition_required:
         for hdr in req.headers:
             if known.header.is_precondition(hdr.name):
-                complain(1200, header=hdr)
+                resp.complain(1200, header=hdr)
                 break
 
-    if method == m.PATCH:
-        if status.successful and req.headers.content_type.is_okay and \
+
+@check(u'response_in_context', 1214, 1215)
+def _check_patch(resp, req):
+    if req.method == m.PATCH:
+        if resp.status.successful and req.headers.content_type.is_okay and \
                 known.media_type.is_patch(req.headers.content_type.item) \
                 is False:
-            complain(1214)
-        if status == st.unsupported_media_type and \
+            resp.complain(1214)
+        if resp.status == st.unsupported_media_type and \
                 resp.headers.accept_patch.is_absent:
-            complain(1215)
+            resp.complain(1215)
+
 
+@check(u'response_in_context', 1221, 1283)
+def _check_security(resp, req):
     if resp.headers.strict_transport_security.is_present and \
             req.is_tls is False:
-        complain(1221)
+        resp.complain(1221)
 
-    if status == st.misdirected_request and \
-            known.method.is_cacheable(method) and \
+    if resp.status == st.misdirected_request and \
+            known.method.is_cacheable(req.method) and \
             not resp.headers.cache_control.no_store:
-        complain(1283)
+        resp.complain(1283)
 
+
+@check(u'response_in_context', 1286)
+def _check_preference_applied(resp, req):
     for applied_pref in resp.headers.preference_applied:
         if applied_pref not in req.headers.prefer.without_params:
-            complain(1286, name=applied_pref.item,
-                     value=(u'' if applied_pref.param is None
-                            else u'=%s' % applied_pref.param))
+            resp.complain(1286, name=applied_pref.item,
+                          value=(u'' if applied_pref.param is None
+                                 else u'=%s' % applied_pref.param))
 
-    if status == st.early_hints:
-        # 103 (Early Hints) responses are weird in that the headers they carry
-        # do not apply to themselves (RFC 8297 Section 2) but only to the final
-        # response (and then only speculatively). For such responses, we limit
-        # ourselves to checks that do not rely on having a complete and
-        # self-consistent message header block.
-        return
 
-    if method == m.OPTIONS and m.PATCH in resp.headers.allow and \
+@check(u'response_in_context.complete', 1216, 1291)
+def _check_options_and_prefer(resp, req):
+    if req.method == m.OPTIONS and m.PATCH in resp.headers.allow and \
             resp.headers.accept_patch.is_absent:
-        complain(1216)
-
-    if resp.headers.preference_applied.is_present and method == m.GET and \
-            resp.headers.vary != u'*' and h.prefer not in resp.headers.vary:
-            # We could also look for ``Cache-Control: no-store`` etc.,
-            # but the meaning of ``Vary`` is not limited to caching,
-            # and anyway this is just a mild comment.
-        complain(1291)
+        resp.complain(1216)
+
+    if resp.headers.preference_applied.is_present and \
+            req.method == m.GET and resp.headers.vary != u'*' and \
+            h.prefer not in resp.headers.vary:
+        # We could also look for ``Cache-Control: no-store`` etc.,
+        # but the meaning of ``Vary`` is not limited to caching,
+        # and anyway this is just a mild comment.
+        resp.complain(1291)
 
 
 def _check_basic_challenge(resp, hdr, challenge):
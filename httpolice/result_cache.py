@@ -0,0 +1,469 @@
+"""Reusing the results of checks for exchanges that have been seen before.
+
+Synthetic monitors and crawlers make the same requests over and over,
+and get the same responses, except for a few *volatile* headers
+like ``Date``, ``Age``, or request IDs. A :class:`ResultCache` remembers
+the notices reported on such an exchange under its *fingerprint*
+(a digest of everything that checks can look at, except the values
+of volatile headers), and when the same fingerprint comes up again,
+copies them over to the new exchange instead of checking it.
+
+The objects that notices refer to (messages, headers, header entries)
+are rebound to their counterparts in the new exchange, and parsed headers
+and derived properties are copied along, so the reports look
+as if the new exchange had been checked from scratch.
+The only notices that are not copied are those that may depend on
+the values of volatile headers: these are reported again
+by the checks that can report them, which are run as usual.
+Most volatile headers are not parsed by HTTPolice at all, so their values
+never matter, but ``Date`` and ``Age`` are, so the checks that look at them
+(such as whether a response came from a cache, or is stale)
+are always run, along with the check that parses all headers.
+Their notices are put where they would be without the cache:
+the cache remembers where every such check began and ended
+among the old notices, and a notice that a check reports on the new exchange
+(but did not report on the old one) goes at the end of that check's notices.
+"""
+
+# This module saves and restores the internal state of blackboards.
+# pylint: disable=protected-access
+
+import bisect
+import collections
+import hashlib
+
+from httpolice import checks, known
+from httpolice.blackboard import Complaint, Lazy
+from httpolice.header import PARSE_NOTICES, HeaderView
+from httpolice.known import h
+from httpolice.notice import all_notices
+from httpolice.structure import FieldName, HeaderEntry, okay
+from httpolice.util import deadline, stats
+from httpolice.util.text import force_unicode
+
+
+CACHING_NOTICES = frozenset([
+    1166, 1168, 1169, 1170, 1172, 1173, 1174, 1175, 1176, 1177, 1178, 1179,
+    1180, 1181, 1182, 1183, 1184, 1185, 1186, 1187, 1188, 1202, 1241,
+])
+
+#: The volatile headers whose values HTTPolice does look at,
+#: mapped to the IDs of the notices that may depend on them.
+#: Any other header can only be volatile if HTTPolice does not parse it.
+volatile_notices = {
+    h.date: frozenset([1109, 1118, 1164, 1301]) | CACHING_NOTICES,
+    h.age: CACHING_NOTICES,
+}
+
+#: The derived properties that depend on ``Date`` and ``Age``.
+volatile_properties = frozenset([u'from_cache', u'heuristic_expiration',
+                                 u'stale'])
+
+#: The headers that are volatile unless told otherwise.
+default_volatile = [h.date, h.age, FieldName(u'Request-Id'),
+                    FieldName(u'Traceparent'), FieldName(u'Tracestate'),
+                    FieldName(u'X-Amzn-Trace-Id'),
+                    FieldName(u'X-Correlation-Id'),
+                    FieldName(u'X-Request-Id')]
+
+
+class ResultCache:
+
+    """Remembers the results of :func:`httpolice.check_exchange`.
+
+    Pass it as the `cache` argument to reuse the notices reported
+    on an exchange for later exchanges that differ from it
+    only in the values of volatile headers.
+
+    :param max_size:
+        How many distinct exchanges to remember.
+        When there are more, the least recently seen is forgotten.
+        What is remembered includes decoded bodies,
+        so this also bounds the memory taken by the cache.
+    :param volatile_headers:
+        The names of volatile headers. By default, these are
+        ``Date``, ``Age``, and some common headers for request IDs
+        (such as ``X-Request-Id`` and ``Traceparent``).
+        Apart from ``Date`` and ``Age``, only headers
+        that HTTPolice does not parse can be volatile.
+    """
+
+    def __init__(self, max_size=1000, volatile_headers=None):
+        if volatile_headers is None:
+            volatile_headers = default_volatile
+        self.max_size = max_size
+        self.volatile_headers = frozenset(FieldName(force_unicode(name))
+                                          for name in volatile_headers)
+        for name in self.volatile_headers:
+            if name not in volatile_notices and \
+                    known.header.syntax_for(name) is not None:
+                raise ValueError(u'%s cannot be volatile, because HTTPolice '
+                                 u'checks its value' % name)
+        self._recheck = frozenset().union(*[
+            volatile_notices.get(name, []) for name in self.volatile_headers])
+        # The notices that checks may report again on a cache hit.
+        # This includes the notices about parsing headers, so that
+        # volatile headers are parsed at the same point as without the cache.
+        self._rerun = self._recheck | PARSE_NOTICES if self._recheck \
+            else frozenset()
+        self._results = collections.OrderedDict()
+
+    def __reduce__(self):
+        # With ``httpolice --jobs``, every worker process has its own cache,
+        # which it keeps for all the parts of the input it checks.
+        return (_worker_cache,
+                (self.max_size, tuple(sorted(self.volatile_headers))))
+
+    def __len__(self):
+        return len(self._results)
+
+    def check(self, exch, run):
+        """Check `exch` by calling `run` on it, or by reusing old results."""
+        key = self.fingerprint(exch)
+        if key is None:
+            stats.count(u'cache.uncacheable')
+            run(exch)
+            return
+        result = self._results.get(key)
+        if result is None:
+            stats.count(u'cache.misses')
+            self._results[key] = self._remember(exch, run)
+            if len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        else:
+            stats.count(u'cache.hits')
+            self._results.move_to_end(key)
+            self._reuse(result, exch, run)
+
+    def fingerprint(self, exch):
+        """Digest everything in `exch` that matters for checking it.
+
+        Returns `None` if that cannot be done, which only happens
+        when an input has assigned an unusual value to a derived property.
+        """
+        digest = hashlib.sha256()
+
+        def feed(*items):
+            for item in items:
+                if isinstance(item, bytes):
+                    tag = u'b'
+                else:
+                    (tag, item) = (u'r', repr(item).encode('utf-8'))
+                digest.update((u'%s%d:' % (tag, len(item))).encode('ascii'))
+                digest.update(item)
+
+        for obj in [exch] + exch.children:
+            feed(type(obj).__name__, sorted(obj._silenced))
+            feed(*[_plain(getattr(obj, name, None))
+                   for name in _attributes])
+            for entries in [getattr(obj, u'header_entries', []),
+                            getattr(obj, u'trailer_entries', [])]:
+                feed(len(entries))
+                for entry in entries:
+                    if entry.name in self.volatile_headers:
+                        feed(str(entry.name), u'volatile')
+                    else:
+                        feed(str(entry.name), entry.value)
+            body = getattr(obj, u'body', None)
+            feed(body if okay(body) else u'unavailable')
+            for name in sorted(obj.memoized):
+                value = obj.memoized[name]
+                if isinstance(value, Lazy):
+                    feed(name, _plain(value.func), *value.args)
+                elif value is None or isinstance(value, (bool, bytes, str)):
+                    feed(name, value)
+                else:
+                    return None
+        return digest.digest()
+
+    def _volatile(self, complaint):
+        # Might `complaint` not be reported again if volatile headers change?
+        if complaint.id in self._recheck:
+            return True
+        return complaint.id in PARSE_NOTICES and any(
+            isinstance(value, (HeaderEntry, HeaderView)) and
+            value.name in self.volatile_headers
+            for value in complaint.context.values())
+
+    def _run_traced(self, exch, objs, before, run):
+        # Call `run` on `exch`, noting where every check that may be
+        # run again on a cache hit began and ended. Return, for every object
+        # in `objs`, a list of how many complaints it had at these points,
+        # not counting the `before` complaints it had already.
+        # These are the same checks on the old and on the new exchange,
+        # because they are the ones that can report any of `_rerun`,
+        # and these notices are silenced the same way on both.
+        positions = [[] for _ in objs]
+
+        def tracer(notice_ids, args):
+            notice_ids = self._rerun.intersection(notice_ids)
+            if any(obj.wants(notice_ids) for obj in args):
+                for (k, obj) in enumerate(objs):
+                    positions[k].append(len(obj._complaints) - before[k])
+
+        saved = checks.tracer
+        checks.tracer = tracer
+        try:
+            run(exch)
+        finally:
+            checks.tracer = saved
+        return positions
+
+    def _remember(self, exch, run):
+        objs = [exch] + exch.children
+        before = [len(obj._complaints) for obj in objs]
+        if self._rerun:
+            positions = self._run_traced(exch, objs, before, run)
+        else:
+            run(exch)
+            positions = [[] for _ in objs]
+        refs = _References(objs)
+        return _Result(
+            complaints=[
+                [(complaint.notice,
+                  None if self._volatile(complaint)
+                  else refs.replace(complaint.context))
+                 for complaint in obj._complaints[n:]]
+                for (obj, n) in zip(objs, before)],
+            # The exchange itself (``objs[0]``) has no headers.
+            annotations=[{}] + [
+                {(from_trailer, i): annotations
+                 for ((from_trailer, i), annotations)
+                 in msg.annotations.items()
+                 if _entries(msg, from_trailer)[i].name
+                 not in self.volatile_headers}
+                for msg in objs[1:]],
+            # Parsed headers are kept for the same reason.
+            headers=[[]] + [
+                [(type(view), name, refs.replace(view._entries), view._value)
+                 for (name, view) in msg.headers._cache.items()
+                 if view._entries is not None and
+                 name not in self.volatile_headers]
+                for msg in objs[1:]],
+            parsed=[[]] + [
+                [name for (name, view) in msg.headers._cache.items()
+                 if view._entries is not None and
+                 name in self.volatile_headers]
+                for msg in objs[1:]],
+            # Derived properties are kept, so that they are not derived again
+            # (possibly reporting the same notices again) on the new exchange.
+            memoized=[{name: value for (name, value) in obj.memoized.items()
+                       if not (self._recheck and name in volatile_properties)}
+                      for obj in objs],
+            silenced=[frozenset(obj._silenced) for obj in objs],
+            positions=positions,
+        )
+
+    def _reuse(self, result, exch, run):
+        objs = [exch] + exch.children
+        before = [len(obj._complaints) for obj in objs]
+        for (obj, memoized, headers) in zip(objs, result.memoized,
+                                            result.headers):
+            for (name, value) in memoized.items():
+                setattr(obj, name, value)
+            for (cls, name, entries, value) in headers:
+                view = obj.headers._cache[name] = cls(obj, name)
+                view._entries = _rebind(entries, objs)
+                view._value = value
+        positions = [[] for _ in objs]
+        if self._rerun:
+            # Run only the checks that can report volatile notices,
+            # by silencing all other notices for a while.
+            ignored = set(all_notices) - self._rerun
+            saved = [obj._silenced for obj in objs]
+            for obj in objs:
+                obj._silenced = obj._silenced | ignored
+            try:
+                positions = self._run_traced(exch, objs, before, run)
+            except deadline.Exceeded:
+                # Don't leave the notice about it silenced, too.
+                for (obj, silenced) in zip(objs, saved):
+                    obj._silenced = silenced
+                raise
+        for (obj, names) in zip(objs, result.parsed):
+            for name in names:
+                _ = obj.headers[name].value
+
+        for (k, obj) in enumerate(objs):
+            complaints = obj._complaints[:before[k]]
+            complaints.extend(_merge(
+                [(notice, context if context is None
+                  else _rebind(context, objs))
+                 for (notice, context) in result.complaints[k]],
+                result.positions[k],
+                [(bisect.bisect_right(positions[k], i), complaint)
+                 for (i, complaint)
+                 in enumerate(obj._complaints[before[k]:])
+                 if self._volatile(complaint)]))
+            obj._reset(complaints, result.silenced[k])
+            if result.annotations[k]:
+                obj.annotations.update(result.annotations[k])
+
+
+def _merge(old, old_positions, fresh):
+    # Put together the complaints on an object of an exchange
+    # that has been checked with an old result (see `ResultCache._reuse`).
+    # `old` is a list of ``(notice, context)`` from the old result,
+    # with `None` for the context of a volatile complaint, and
+    # `old_positions` are where the checks that ran again began and ended
+    # (and their steps, see `httpolice.checks.step`) among them.
+    # These points split both the old and the new complaints into segments.
+    # `fresh` is a list of ``(segment, complaint)`` for the volatile
+    # complaints reported again.
+    # The old and the fresh complaints are in the right order
+    # among themselves. For every old volatile complaint, we take the next
+    # fresh one with the same notice ID in its place. Every fresh one
+    # that is left goes right before the next fresh one that did take
+    # a place in the same segment, or else at the end of its segment.
+    queues = collections.defaultdict(collections.deque)
+    for (j, (_, complaint)) in enumerate(fresh):
+        queues[complaint.id].append(j)
+    matched = {}
+    for (i, (notice, context)) in enumerate(old):
+        if context is None and queues[notice.id]:
+            matched[i] = queues[notice.id].popleft()
+
+    placeholder_of = {j: i for (i, j) in matched.items()}
+    ahead = collections.defaultdict(list)   # Old index -> fresh complaints.
+    left = collections.deque()              # ``(segment, complaint)``.
+    (next_segment, next_taken) = (None, None)
+    for j in reversed(range(len(fresh))):
+        (segment, complaint) = fresh[j]
+        if j in placeholder_of:
+            i = placeholder_of[j]
+            if bisect.bisect_right(old_positions, i) == segment:
+                (next_segment, next_taken) = (segment, i)
+            else:
+                (next_segment, next_taken) = (None, None)
+        elif next_segment == segment:
+            ahead[next_taken].insert(0, complaint)
+        else:
+            left.appendleft((segment, complaint))
+
+    r = []
+    for (i, (notice, context)) in enumerate(old):
+        segment = bisect.bisect_right(old_positions, i)
+        while left and left[0][0] < segment:
+            r.append(left.popleft()[1])
+        if context is not None:
+            r.append(Complaint(notice, context))
+        elif i in matched:
+            r.extend(ahead[i])
+            r.append(fresh[matched[i]][1])
+    r.extend(complaint for (_, complaint) in left)
+    return r
+
+
+_worker_caches = {}
+
+
+def _worker_cache(max_size, volatile_headers):
+    key = (max_size, volatile_headers)
+    if key not in _worker_caches:
+        _worker_caches[key] = ResultCache(max_size, volatile_headers)
+    return _worker_caches[key]
+
+
+_Result = collections.namedtuple(
+    '_Result',
+    ['complaints', 'annotations', 'headers', 'parsed', 'memoized',
+     'silenced', 'positions'])
+
+
+_attributes = [u'scheme', u'method', u'target', u'version', u'status',
+               u'reason']
+
+
+def _plain(value):
+    # Something with a stable ``repr`` that can be fed into a digest.
+    if value is None or isinstance(value, (bool, bytes)):
+        return value
+    if callable(value):
+        return u'%s.%s' % (getattr(value, '__module__', None),
+                           value.__qualname__)
+    return force_unicode(value)
+
+
+def _entries(msg, from_trailer):
+    return msg.trailer_entries if from_trailer else msg.header_entries
+
+
+# Complaint contexts are kept with references to the objects of an exchange
+# replaced by these, and resolved again against another exchange.
+
+class _ObjectRef(collections.namedtuple('_ObjectRef', ['k'])):
+
+    __slots__ = ()
+
+    def resolve(self, objs):
+        return objs[self.k]
+
+
+class _AttributeRef(collections.namedtuple('_AttributeRef', ['k', 'name'])):
+
+    # Like the request target, which the HTML report highlights
+    # when a notice refers to it.
+
+    __slots__ = ()
+
+    def resolve(self, objs):
+        return getattr(objs[self.k], self.name)
+
+
+class _ViewRef(collections.namedtuple('_ViewRef', ['k', 'name'])):
+
+    __slots__ = ()
+
+    def resolve(self, objs):
+        return objs[self.k].headers[self.name]
+
+
+class _EntryRef(collections.namedtuple('_EntryRef',
+                                       ['k', 'from_trailer', 'i'])):
+
+    __slots__ = ()
+
+    def resolve(self, objs):
+        return _entries(objs[self.k], self.from_trailer)[self.i]
+
+
+_refs = (_ObjectRef, _AttributeRef, _ViewRef, _EntryRef)
+
+
+class _References:
+
+    def __init__(self, objs):
+        self.objects = {id(obj): k for (k, obj) in enumerate(objs)}
+        # What a notice refers to is the very same object, not just equal.
+        self.refs = {}
+        for (k, obj) in enumerate(objs):
+            self.refs[id(obj)] = _ObjectRef(k)
+            for name in _attributes:
+                self.refs.setdefault(id(getattr(obj, name, None)),
+                                     _AttributeRef(k, name))
+            if k > 0:
+                for from_trailer in [False, True]:
+                    for (i, entry) in enumerate(_entries(obj, from_trailer)):
+                        self.refs[id(entry)] = _EntryRef(k, from_trailer, i)
+        self.refs.pop(id(None))
+
+    def replace(self, value):
+        if isinstance(value, dict):
+            return {key: self.replace(v) for (key, v) in value.items()}
+        if isinstance(value, list):
+            return [self.replace(v) for v in value]
+        if isinstance(value, HeaderView):
+            k = self.objects.get(id(value.message))
+            if k is not None:
+                return _ViewRef(k, value.name)
+        return self.refs.get(id(value), value)
+
+
+def _rebind(value, objs):
+    if isinstance(value, dict):
+        return {key: _rebind(v, objs) for (key, v) in value.items()}
+    if isinstance(value, list):
+        return [_rebind(v, objs) for v in value]
+    if isinstance(value, _refs):
+        return value.resolve(objs)
+    return value
@@ -0,0 +1,156 @@
+"""Checking only a sample of the exchanges in a huge input.
+
+For some purposes (such as capacity planning), checking every exchange
+of a big capture is a waste of time. A :class:`Sampler` picks
+the exchanges to check before they are checked, in two ways:
+
+- by the *hash* of their URLs (or, in the ``tcpflow``, ``tcpick``,
+  and ``pcap`` input formats, of their connections; see :func:`sampled`),
+  so that every run on the same input picks the same exchanges;
+- by their *key* (see :func:`sample_key`), so that no more than
+  a given number of exchanges are checked for the same endpoint
+  and outcome, which thins out the most repetitive traffic.
+
+Because the sample is known to be a certain fraction of the input
+(see :attr:`Sampler.ratio`), counts of notices in it can be extrapolated
+to the whole input.
+"""
+
+import collections
+import hashlib
+import re
+from urllib.parse import urlsplit
+
+from httpolice.structure import okay
+from httpolice.util import stats
+
+
+def sampled(key, rate):
+    """Is `key` (a string) in a sample of `rate` (from 0 to 1) of all keys?
+
+    The answer depends only on `key` and `rate`, so it is the same
+    on every run, and the sample only grows with the rate.
+
+    >>> sampled(u'http://example.com/', 1)
+    True
+    >>> sampled(u'http://example.com/', 0)
+    False
+    """
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') < rate * 2 ** 64
+
+
+_ID_SEGMENT = re.compile(
+    r'^(?:\d+'                                              # Number.
+    r'|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'  # UUID.
+    r'|(?=[a-z]*\d)[0-9a-f]{8,}'                            # Hex digest.
+    r'|(?=.*\d)(?=.*[a-z])[0-9a-z_-]{20,})$',               # Token.
+    re.IGNORECASE)
+
+
+def collapse_path(path):
+    """Replace the segments of `path` that look like IDs with ``{id}``.
+
+    >>> collapse_path(u'/users/12345/orders/5f0c6e1a9b')
+    '/users/{id}/orders/{id}'
+    >>> collapse_path(u'/static/logo-2x.png')
+    '/static/logo-2x.png'
+    """
+    return u'/'.join(u'{id}' if _ID_SEGMENT.match(segment) else segment
+                     for segment in path.split(u'/'))
+
+
+def sample_key(exch):
+    """The key of `exch` for ``max_per_key`` in :class:`Sampler`.
+
+    This is a tuple of the request method, the host,
+    the path (without query) with IDs collapsed (see :func:`collapse_path`),
+    and the status code of the last response (or `None`).
+    Returns `None` for an exchange without a request.
+    """
+    req = exch.request
+    if req is None:
+        return None
+    (host, path) = (None, req.target)
+    uri = req.effective_uri
+    if okay(uri):
+        parts = urlsplit(uri)
+        (host, path) = (parts.hostname, parts.path)
+    status = exch.responses[-1].status if exch.responses else None
+    return (req.method, host, collapse_path(path.split(u'?')[0]), status)
+
+
+class Sampler:
+
+    """Decides which exchanges to check, out of many.
+
+    Call :meth:`admit` with every exchange, and only check
+    (and report) those for which it returns true.
+    Exchanges without a request (such as notices about connections)
+    are always admitted.
+
+    :param rate:
+        The fraction of URLs (from 0 to 1) whose exchanges are checked.
+        An exchange is admitted if its effective URI
+        (or, if it is not known, its request target)
+        is :func:`sampled` at this rate.
+    :param max_per_key:
+        If not `None`, no more than this many exchanges are admitted
+        for every :func:`sample_key`.
+    :param by:
+        ``url``, or ``connection`` if the exchanges have already been
+        sampled by connection at this `rate`
+        (as with the `sample_connections` argument of some input formats),
+        so :meth:`admit` only has to apply `max_per_key`.
+    """
+
+    def __init__(self, rate=1, max_per_key=None, by=u'url'):
+        self.rate = rate
+        self.max_per_key = max_per_key
+        self.by = by
+        self.n_admitted = 0
+        self.n_capped = 0
+        self._counts = collections.Counter()
+
+    def __reduce__(self):
+        # With ``httpolice --jobs``, every part of the input is sampled
+        # from scratch, and the main process applies `max_per_key` again
+        # (with :meth:`admit_key`) to the results of all parts.
+        return (Sampler, (self.rate, self.max_per_key, self.by))
+
+    def admit(self, exch):
+        """Should `exch` be checked?"""
+        req = exch.request
+        if req is None:
+            return True
+        if self.by == u'url' and self.rate < 1:
+            uri = req.effective_uri
+            if not sampled(uri if okay(uri) else req.target, self.rate):
+                stats.count(u'sample.exchanges_skipped')
+                return False
+        return self.admit_key(sample_key(exch))
+
+    def admit_key(self, key):
+        """Should an exchange with this :func:`sample_key` be checked?"""
+        if key is None:
+            return True
+        if self.max_per_key is not None:
+            if self._counts[key] >= self.max_per_key:
+                self.n_capped += 1
+                stats.count(u'sample.exchanges_capped')
+                return False
+            self._counts[key] += 1
+        self.n_admitted += 1
+        return True
+
+    @property
+    def ratio(self):
+        """About what fraction of the exchanges have been admitted so far.
+
+        To estimate how many times something happens in all exchanges,
+        divide how many times it happened in the admitted ones by this.
+        """
+        if self.n_admitted + self.n_capped == 0:
+            return self.rate
+        return self.rate * (self.n_admitted /
+                            (self.n_admitted + self.n_capped))
@@ -1,3 +1,5 @@
+import io
+
 from httpolice.parse import ParseError
 
 
@@ -11,16 +13,25 @@ class Stream:
 
     Methods of this class **do not attempt** to uphold the exact same interface
     as similarly-named methods of file objects.
+
+    If `skip_bodies` is true, :mod:`httpolice.framing1` will skip over
+    message bodies (with :meth:`skip`) instead of reading them.
+
+    `file_` must be at its beginning. It need not be seekable
+    (it may be a pipe), unless :meth:`seek` is called.
     """
 
     max_line_length = 16 * 1024
+    skip_chunk_size = 64 * 1024
 
-    def __init__(self, file_, name=None):
+    def __init__(self, file_, name=None, skip_bodies=False):
         self.file = file_
         self.name = name
+        self.skip_bodies = skip_bodies
         self.eof = False
         self.sane = True
         self.complaints = []
+        self._pos = 0
         self._currently_parsing = [None]
         self._next_symbol = None
 
@@ -46,23 +57,77 @@ class Stream:
         return self.sane and not self.eof
 
     def tell(self):
-        return self.file.tell()
+        # We keep track of the position ourselves, because `file`
+        # may be a pipe, which doesn't know it.
+        return self._pos
+
+    def seek(self, pos):
+        """Reposition the stream at `pos` and start parsing anew from there."""
+        self.file.seek(pos)
+        self._pos = pos
+        self.eof = False
+        self.sane = True
+        self.complaints[:] = []
 
     def peek(self, n=1):
         return self.file.peek(n)[:n]
 
     def read(self, n=-1):
-        pos = self.tell()
+        pos = self._pos
         r = self.file.read(n)
+        self._pos += len(r)
         if self.peek() == b'':
             self.eof = True
         if len(r) < n and n > 0:
             raise self.error(pos, expected=u'at least %d bytes' % n)
         return r
 
+    def skip(self, n=-1):
+        """Like :meth:`read`, but discard the data.
+
+        Return the number of bytes skipped.
+        """
+        pos = self._pos
+        if self.file.seekable():
+            self._skip_by_seeking(n)
+        else:
+            self._skip_by_reading(n)
+        skipped = self._pos - pos
+        if self.peek() == b'':
+            self.eof = True
+        if skipped < n:
+            raise self.error(pos, expected=u'at least %d bytes' % n)
+        return skipped
+
+    def _skip_by_seeking(self, n):
+        if n >= 0:
+            self.file.seek(self._pos + n)
+            if self.peek() != b'':
+                self._pos += n
+                return
+        # We are at (or past) the end, so we need to know where it is.
+        # Don't ask this beforehand, as it may be expensive
+        # (see :mod:`httpolice.inputs.packed`).
+        end = self.file.seek(0, io.SEEK_END)
+        self._pos = end if n < 0 else min(self._pos + n, end)
+        self.file.seek(self._pos)
+
+    def _skip_by_reading(self, n):
+        # For pipes. Memory is bounded by `skip_chunk_size`.
+        end = None if n < 0 else self._pos + n
+        while end is None or self._pos < end:
+            size = self.skip_chunk_size
+            if end is not None:
+                size = min(size, end - self._pos)
+            data = self.file.read(size)
+            if not data:
+                break
+            self._pos += len(data)
+
     def readline(self, decode=True):
-        pos = self.tell()
+        pos = self._pos
         r = self.file.readline(self.max_line_length)
+        self._pos += len(r)
         if self.peek() == b'':
             self.eof = True
         if not r.endswith(b'\n'):
@@ -0,0 +1,62 @@
+"""Stopping work on an exchange that takes too long (``httpolice --budget``).
+
+While a time limit is in effect (see :func:`limit`), code that may run
+for long calls :func:`check` at *safe points*, where it can stop
+without leaving anything half-done: before every check
+(see :mod:`httpolice.checks`), before deriving a property,
+at every byte of input to the parser, and at every chunk of decoded data.
+When the time is up, :func:`check` raises :exc:`Exceeded`.
+
+Code between safe points cannot be stopped this way,
+so a single long step (such as parsing a huge XML body)
+is only stopped after it is done.
+With ``httpolice --jobs``, such steps are stopped by killing
+the worker process (see :mod:`httpolice.parallel`).
+
+Limits can be nested, but an inner limit never extends an outer one:
+
+>>> from httpolice.util import deadline
+>>> with deadline.limit(0):
+...     with deadline.limit(60):
+...         deadline.check()
+Traceback (most recent call last):
+  ...
+httpolice.util.deadline.Exceeded
+"""
+
+import contextlib
+import time
+
+
+#: When the current limit runs out (by :func:`time.monotonic`),
+#: or `None` if there is no limit.
+current = None
+
+
+class Exceeded(BaseException):
+
+    """Raised by :func:`check` when the time is up.
+
+    Like :exc:`KeyboardInterrupt`, it is not an :exc:`Exception`,
+    so that code that handles errors in the data does not swallow it.
+    """
+
+
+@contextlib.contextmanager
+def limit(seconds):
+    """Allow the code in this context `seconds` of time, at most."""
+    global current                  # pylint: disable=global-statement
+    outer = current
+    current = time.monotonic() + seconds
+    if outer is not None:
+        current = min(current, outer)
+    try:
+        yield
+    finally:
+        current = outer
+
+
+def check():
+    """Raise :exc:`Exceeded` if the time is up."""
+    if current is not None and time.monotonic() >= current:
+        raise Exceeded()
@@ -0,0 +1,29 @@
+"""Counters of things that happen while HTTPolice works.
+
+These have no effect on the results. They are only meant to help
+understand where the effort goes on big inputs (see ``httpolice --stats``).
+Counters are global and named with dotted strings, like ``files.reopened``.
+
+>>> reset()
+>>> count(u'files.opened')
+>>> count(u'files.opened', 2)
+>>> snapshot()
+{'files.opened': 3}
+"""
+
+import collections
+
+
+counters = collections.Counter()
+
+
+def count(name, n=1):
+    counters[name] += n
+
+
+def snapshot():
+    return dict(counters)
+
+
+def reset():
+    counters.clear()
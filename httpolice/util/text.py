@@ -233,4 +233,6 @@ def contains_percent_encodes(s):
 
 
 def decode_path(path):
+    if isinstance(path, str):
+        return path         # Keep subclasses like `ArchiveMember` intact.
     return force_unicode(path, fs_encoding)
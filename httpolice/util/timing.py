@@ -0,0 +1,115 @@
+"""Measuring where the time goes (see ``httpolice --timings``).
+
+Timing is off unless :data:`enabled` is set to true. When it is off,
+:func:`measure` only calls the function it is given,
+and :func:`iterate` returns the iterable it is given.
+
+Measurements are added up by name, such as ``input``,
+``check.request.check_host``, or ``property.decoded_body``.
+Measured calls are often nested (checks look at derived properties,
+which parse headers), so every name gets both its total time
+and its *self* time, which leaves out the time of nested measured calls.
+The self times of all names add up to the time of the whole run.
+Every name also gets the net change in the number of memory blocks
+allocated by Python (:func:`sys.getallocatedblocks`) during its calls.
+
+Other code can follow measurements as they happen by adding functions
+to :data:`hooks`. Every hook is called after every measured call
+with its name, its time in seconds, and its change in allocated blocks.
+With ``httpolice --jobs``, hooks only see the calls in the main process.
+
+>>> from httpolice.util import timing
+>>> timing.reset()
+>>> timing.enabled = True
+>>> timing.measure(u'sum', sum, [1, 2, 3])
+6
+>>> timing.snapshot()[u'sum'][u'calls']
+1
+>>> timing.enabled = False
+"""
+
+import sys
+import time
+
+
+enabled = False
+
+hooks = []
+
+# Name -> ``[calls, seconds, self_seconds, blocks]``.
+totals = {}
+
+# For every measured call in progress, the time spent in nested calls.
+_nested = []
+
+
+def measure(name, func, *args):
+    """Call ``func(*args)`` and add its time to `name`."""
+    if not enabled:
+        return func(*args)
+    _nested.append(0.0)
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        seconds = time.perf_counter() - start
+        blocks = sys.getallocatedblocks() - blocks
+        nested = _nested.pop()
+        if _nested:
+            _nested[-1] += seconds
+        _add(name, [1, seconds, seconds - nested, blocks])
+        for hook in hooks:
+            hook(name, seconds, blocks)
+
+
+def iterate(name, iterable):
+    """Measure getting every item from `iterable` under `name`."""
+    if not enabled:
+        return iterable
+    return _iterate(name, iter(iterable))
+
+
+def _iterate(name, iterator):
+    while True:
+        try:
+            item = measure(name, next, iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+def _add(name, values):
+    total = totals.setdefault(name, [0, 0.0, 0.0, 0])
+    for i, value in enumerate(values):
+        total[i] += value
+
+
+def snapshot():
+    return {name: {u'calls': calls, u'seconds': seconds,
+                   u'self_seconds': self_seconds, u'blocks': blocks}
+            for (name, (calls, seconds, self_seconds, blocks))
+            in totals.items()}
+
+
+def merge(other):
+    """Add up a :func:`snapshot` from another process."""
+    for (name, total) in other.items():
+        _add(name, [total[u'calls'], total[u'seconds'],
+                    total[u'self_seconds'], total[u'blocks']])
+
+
+def reset():
+    totals.clear()
+    del _nested[:]
+
+
+def table():
+    """Render the totals as text, with the biggest self times first."""
+    lines = [u'%-50s %9s %10s %10s %10s' %
+             (u'name', u'calls', u'total s', u'self s', u'blocks')]
+    for (name, (calls, seconds, self_seconds, blocks)) in sorted(
+            totals.items(), key=lambda item: (-item[1][2], item[0])):
+        lines.append(u'%-50s %9d %10.3f %10.3f %10d' %
+                     (name, calls, seconds, self_seconds, blocks))
+    return u''.join(line + u'\n' for line in lines)
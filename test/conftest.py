@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import httpolice.inputs.streams
+
+
+@pytest.fixture
+def stdin_pipe(monkeypatch):
+    """Return a function that makes standard input a pipe fed with `data`."""
+    pipes = []
+
+    def feed(data):
+        (read_fd, write_fd) = os.pipe()
+
+        def write():
+            try:
+                with io.open(write_fd, 'wb') as f:
+                    f.write(data)
+            except BrokenPipeError:         # pragma: no cover
+                pass            # The test didn't read everything.
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        stdin = io.open(read_fd, 'rb')
+        pipes.append((stdin, thread))
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        return stdin
+
+    yield feed
+    for (stdin, thread) in pipes:
+        stdin.close()
+        thread.join()
+
+
+class FakeTime:
+
+    """Stands in for the clock when following captures.
+
+    Instead of sleeping between polls, it runs the next of `actions`
+    (such as writing more data), and when they run out, it interrupts
+    the follow.
+    """
+
+    def __init__(self, actions):
+        self.now = 0
+        self.started = time.time()
+        self.actions = list(actions)
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.started + self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if not self.actions:
+            raise KeyboardInterrupt
+        self.actions.pop(0)()
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    """Return a function that installs a `FakeTime` with `actions`."""
+    def install(actions):
+        fake = FakeTime(actions)
+        monkeypatch.setattr(httpolice.inputs.streams, 'monotonic',
+                            fake.monotonic)
+        monkeypatch.setattr(httpolice.inputs.streams, 'sleep', fake.sleep)
+        monkeypatch.setattr(httpolice.inputs.streams, 'wall_clock', fake.time)
+        return fake
+
+    return install
@@ -1,4 +1,14 @@
-from httpolice import Exchange, Request, Response, check_exchange
+import io
+import pickle
+
+import pytest
+
+from httpolice import (Exchange, Request, Response, ResultCache, Sampler,
+                       check_exchange, text_report)
+from httpolice.blackboard import Lazy
+from httpolice.sampling import sample_key
+from httpolice.structure import Unavailable
+from httpolice.util import stats
 
 
 def test_informational_response_after_final():
@@ -33,3 +43,216 @@ def test_informational_response_after_final():
     assert [notice.id for notice in exch.responses[0].notices] == []
     assert [notice.id for notice in exch.responses[1].notices] == []
     assert [notice.id for notice in exch.responses[2].notices] == [1304]
+
+
+def test_headers_only():
+    def make_exchange():
+        resp = Response(
+            u'HTTP/1.1', 200, u'OK',
+            [
+                (u'Date', b'Fri, 02 Feb 2018 15:44:33 GMT'),
+                (u'Content-Length', b'1'),
+                (u'Content-Type', b'application/json'),
+            ],
+            b'{',
+        )
+        return Exchange(None, [resp])
+
+    exch = make_exchange()
+    check_exchange(exch)
+    assert [notice.id for notice in exch.responses[0].notices] == [1038]
+
+    exch = make_exchange()
+    assert exch.responses[0].decoded_body == b'{'
+    check_exchange(exch, headers_only=True)
+    assert [notice.id for notice in exch.responses[0].notices] == []
+    assert isinstance(exch.responses[0].body, Unavailable)
+    assert isinstance(exch.responses[0].decoded_body, Unavailable)
+
+
+def test_budget():
+    def make_exchange():
+        req = Request(u'https', u'GET', u'/', u'HTTP/1.1',
+                      [(u'Host', b'example.com'), (u'X-Request-Id', b'1')],
+                      b'')
+        resp = Response(u'HTTP/1.1', 200, u'OK',
+                        [(u'Date', b'Fri, 02 Feb 2018 15:44:33 GMT'),
+                         (u'Content-Length', b'0')],
+                        b'')
+        return Exchange(req, [resp])
+
+    exch = make_exchange()
+    assert check_exchange(exch, budget=0) is False
+    assert [notice.id for notice in exch.notices] == [1313]
+    assert check_exchange(make_exchange(), budget=60) is True
+
+    # Also when rechecking with a cache.
+    cache = ResultCache()
+    check_exchange(make_exchange(), cache=cache)
+    exch = make_exchange()
+    assert check_exchange(exch, cache=cache, budget=0) is False
+    assert [notice.id for notice in exch.notices] == [1313]
+
+
+def test_release():
+    def make_exchange():
+        req = Request(u'http', u'POST', u'/', u'HTTP/1.1',
+                      [(u'Host', b'example.com'),
+                       (u'Content-Type', b'application/json')],
+                      b'{"foo": "bar"')
+        resp = Response(u'HTTP/1.1', 200, u'OK',
+                        [(u'Content-Length', b'2'),
+                         (u'Content-Type', b'application/json'),
+                         (u'Content-Type', b'text/plain')],
+                        b'{}')
+        return Exchange(req, [resp])
+
+    exch = make_exchange()
+    check_exchange(exch)
+    (req, [resp]) = (exch.request, exch.responses)
+    assert [notice.id for notice in req.notices] == [1038, 1021, 1070]
+    error = req.notices[0].context['error']
+    assert error.__traceback__ is not None
+    assert [notice.id for notice in resp.notices] == [1013, 1110]
+    before = io.BytesIO()
+    text_report([exch], before)
+
+    exch.release(keep=[u'decoded_body'])
+    after = io.BytesIO()
+    text_report([exch], after)
+    assert after.getvalue() == before.getvalue()
+    assert isinstance(req.body, Unavailable)
+    assert isinstance(req.json_data, Unavailable)
+    assert req.json_data.inner is None
+    assert isinstance(resp.body, Unavailable)
+    assert req.decoded_body == b'{"foo": "bar"'
+    # Only the views of present headers are kept, because the others
+    # can be made again as if nothing happened.
+    # pylint: disable=protected-access
+    assert sorted(resp.headers._cache) == [u'Content-Length', u'Content-Type']
+    assert resp.headers.date.is_absent
+    assert [notice.id for notice in resp.notices] == [1013, 1110]
+
+    assert req.notices[0].context['error'] is error
+    assert error.__traceback__ is None
+    assert repr(req.notices[0].context['msg']) == 'Snapshot()'
+    assert not hasattr(req.notices[0].context['msg'], '__html__')
+    header = resp.notices[0].context['header']
+    assert header.message is None
+    assert header.name == u'Content-Type'
+    assert header == u'text/plain'
+    assert repr(resp.notices[1].context['msg'].request) == 'Snapshot()'
+
+    with pytest.raises(ValueError):
+        make_exchange().release(keep=[u'headers'])
+
+
+def test_result_cache():
+    def make_exchange(request_id, date, body=b'{}'):
+        req = Request(
+            u'https', u'GET', u'/status', u'HTTP/1.1',
+            [(u'Host', b'example.com'), (u'User-Agent', b'monitor'),
+             (u'X-Request-Id', request_id)],
+            b'',
+        )
+        resp = Response(
+            u'HTTP/1.1', 200, u'OK',
+            [(u'Date', date), (u'Content-Type', b'application/json'),
+             (u'Content-Length', b'%d' % len(body))],
+            body,
+            trailer_entries=[(u'X-Request-Id', request_id)],
+        )
+        return Exchange(req, [resp])
+
+    def ids(exch):
+        return [[notice.id for notice in obj.notices]
+                for obj in [exch] + exch.children]
+
+    stats.reset()
+    cache = ResultCache(max_size=2)
+    exchanges = [
+        make_exchange(b'1', b'Fri, 02 Feb 2018 15:44:33 GMT'),
+        make_exchange(b'2', b'Fri, 02 Feb 2018 15:44:34 GMT'),
+        make_exchange(b'3', b'Sat, 01 Jan 2050 00:00:00 GMT'),
+        make_exchange(b'4', b'Fri, 02 Feb 2018 15:44:35 GMT', b'{'),
+        make_exchange(b'5', b'Fri, 02 Feb 2018 15:44:35 GMT', b'[]'),
+        make_exchange(b'6', b'Fri, 02 Feb 2018 15:44:36 GMT'),
+    ]
+    for exch in exchanges:
+        check_exchange(exch, cache=cache)
+    assert [ids(exch) for exch in exchanges] == [
+        [[], [1277], [1277, 1030]],
+        [[], [1277], [1277, 1030]],
+        [[], [1277], [1277, 1030, 1109]],
+        [[], [1277], [1277, 1038, 1030]],
+        [[], [1277], [1277, 1030]],
+        [[], [1277], [1277, 1030]],
+    ]
+    # The notices are about the new exchange, not the old one.
+    complaint = exchanges[1].request.notices[0]
+    assert complaint.context[u'msg'] is exchanges[1].request
+    assert complaint.context[u'headers'][0].message is exchanges[1].request
+    # The first exchange was forgotten when the one with ``[]`` came in.
+    assert len(cache) == 2
+    assert stats.snapshot() == {u'cache.hits': 2, u'cache.misses': 4}
+
+
+def test_result_cache_unusual():
+    def make_exchange():
+        return Exchange(None, [Response(u'HTTP/1.1', 200, u'OK',
+                                        [(u'Date', b'now'), (u'Age', b'0')],
+                                        b'')])
+
+    stats.reset()
+    # Without ``Date`` and ``Age``, no checks have to be run again.
+    cache = ResultCache(volatile_headers=[u'X-Request-Id'])
+    exchanges = [make_exchange(), make_exchange(), make_exchange()]
+    exchanges[1].responses[0].decoded_body = Lazy(bytes.upper, b'')
+    exchanges[2].responses[0].content_is_full = 1
+    for exch in exchanges:
+        check_exchange(exch, cache=cache)
+    assert stats.snapshot() == {u'cache.misses': 2, u'cache.uncacheable': 1}
+    assert [notice.id for notice in exchanges[0].responses[0].notices] == \
+        [1000, 1168, 1178]
+
+    # Caches are not sent between processes,
+    # but every process keeps its own.
+    assert not pickle.loads(pickle.dumps(cache))
+    assert pickle.loads(pickle.dumps(cache)) is \
+        pickle.loads(pickle.dumps(cache))
+
+    with pytest.raises(ValueError):
+        ResultCache(volatile_headers=[u'Content-Type'])
+
+
+def test_sampler():
+    def make_exchange(target, status=200):
+        req = Request(u'https', u'GET', target, u'HTTP/1.1',
+                      [(u'Host', b'example.com')], b'')
+        return Exchange(req, [Response(u'HTTP/1.1', status, u'OK', [], b'')])
+
+    targets = [u'/items/%d' % i for i in range(100)]
+    # Always the same ones, about as many as asked for.
+    admitted = [target for target in targets
+                if Sampler(rate=0.3).admit(make_exchange(target))]
+    assert 20 < len(admitted) < 40
+    stats.reset()
+    sampler = Sampler(rate=0.3)
+    assert [target for target in targets
+            if sampler.admit(make_exchange(target))] == admitted
+    assert sampler.ratio == 0.3
+    assert stats.snapshot() == \
+        {u'sample.exchanges_skipped': len(targets) - len(admitted)}
+
+    sampler = Sampler(max_per_key=2)
+    exchanges = [make_exchange(target) for target in targets[:5]] + \
+        [make_exchange(u'/items/1', 404), Exchange(None, [])]
+    assert [sampler.admit(exch) for exch in exchanges] == \
+        [True, True, False, False, False, True, True]
+    assert sampler.ratio == 0.5
+    assert sample_key(exchanges[-1]) is None
+    # Every process starts afresh.
+    assert pickle.loads(pickle.dumps(sampler)).admit(exchanges[0])
+    assert Sampler(0.5, 1).ratio == 0.5
+    # Already sampled by connection.
+    assert Sampler(0.01, by=u'connection').admit(exchanges[0])
@@ -0,0 +1,63 @@
+import ast
+import glob
+import inspect
+import io
+import os
+import re
+import textwrap
+
+from httpolice.checks import registry
+import httpolice.header
+from httpolice.header import PARSE_NOTICES
+from httpolice.notice import all_notices
+
+
+def reported_notices(func):
+    """Find the IDs of notices that `func` reports explicitly.
+
+    This includes the notices reported by helper functions it calls,
+    but not those reported by derived properties or when parsing headers.
+    """
+    ids = set()
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        callee = node.func
+        if isinstance(callee, ast.Attribute):
+            name = callee.attr
+        elif isinstance(callee, ast.Name):
+            name = callee.id
+        else:                       # pragma: no cover
+            continue
+        if name == u'complain':
+            ids.add(ast.literal_eval(node.args[0]))
+        elif name == u'parse':
+            # ``parse(data, symbol, complain, fail_notice_id, ...)``
+            ids.add(ast.literal_eval(node.args[3]))
+        elif name.startswith(u'_check_'):
+            ids.update(reported_notices(func.__globals__[name]))
+    return ids
+
+
+def test_declared_notices():
+    assert registry
+    for checks in registry.values():
+        for check in checks:
+            assert check.notice_ids <= set(all_notices)
+            assert reported_notices(check.func) <= check.notice_ids, \
+                check.name
+
+
+def test_parse_notices():
+    paths = [httpolice.header.__file__] + glob.glob(
+        os.path.join(os.path.dirname(httpolice.header.__file__),
+                     u'syntax', u'*.py'))
+    found = set()
+    for path in paths:
+        with io.open(path, 'rt', encoding='utf-8') as f:
+            code = f.read()
+        if path == httpolice.header.__file__:
+            code = code.split(u'class HeadersView', 1)[1]
+        found.update(int(n) for n in re.findall(r'\b1\d{3}\b', code))
+    assert found == PARSE_NOTICES
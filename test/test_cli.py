@@ -1,6 +1,14 @@
+import io
+import json
 import os
+import sys
+
+import pytest
 
 import httpolice.cli
+import httpolice.inputs.har
+import httpolice.inputs.ndjson
+from httpolice.util import timing
 from httpolice.util.text import MockStdio
 
 
@@ -63,6 +71,61 @@ def test_fail_on():
     assert stderr == b''
 
 
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_fail_fast(jobs):
+    paths = ['combined_data/simple_ok', 'combined_data/1250_1',
+             'combined_data/simple_ok', 'combined_data/1172_1',
+             'combined_data/1125_1']
+    (code, stdout, stderr) = run(['-i', 'combined', '--jobs', jobs,
+                                  '--fail-on', 'comment', '--fail-fast'],
+                                 paths)
+    assert code > 0
+    assert b'C 1250' in stdout
+    assert b'E 1172' not in stdout
+    assert stdout.endswith(b'------------\nD 1315 Checking stopped early\n')
+    assert stderr == (b'httpolice: stopped because of --fail-fast '
+                      b'(exchanges reported: 2, notices of severity comment '
+                      b'or higher: 1); the rest of the input, if any, '
+                      b'was not checked\n')
+
+    (code, stdout, stderr) = run(['-i', 'combined', '--jobs', jobs,
+                                  '--fail-on', 'error', '--fail-fast',
+                                  '--max-failures', '2'], paths)
+    assert code > 0
+    assert b'E 1172' in stdout
+    assert b'E 1125' in stdout
+    assert b'D 1315' in stdout
+    assert b'(exchanges reported: 5, notices of severity error ' \
+        b'or higher: 2)' in stderr
+
+    (code, stdout, stderr) = run(['-i', 'combined', '--jobs', jobs,
+                                  '-o', 'html', '--fail-on', 'error',
+                                  '--fail-fast'], paths)
+    assert code > 0
+    assert b'Checking stopped early' in stdout
+    assert b'>4</span> exchanges, with <span data-ref-to="2">1</span> ' \
+        b'such notices.' in stdout
+    assert stdout.rstrip().endswith(b'</html>')
+
+    (code, stdout, stderr) = run(['-i', 'combined', '--jobs', jobs,
+                                  '--fail-on', 'error', '--fail-fast',
+                                  '--max-failures', '3'], paths)
+    assert code > 0
+    assert b'1315' not in stdout
+    assert stderr == b''
+
+
+@pytest.mark.parametrize('options', [
+    ['--fail-fast'],
+    ['--fail-on', 'error', '--max-failures', '2'],
+    ['--fail-on', 'error', '--fail-fast', '--max-failures', '0'],
+])
+def test_bad_fail_fast(options):
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'combined'] + options +
+                                 ['foo'])
+
+
 def test_bad_combined_file():
     (code, stdout, stderr) = run(['-i', 'combined'],
                                  ['har_data/simple_ok.har'])
@@ -102,6 +165,191 @@ def test_tcpflow():
     assert stderr == b''
 
 
+def test_pcap():
+    (code, stdout, stderr) = run(['-i', 'pcap'], ['pcap_data/tls.pcap'])
+    assert code == 0
+    assert b'E 1279' in stdout
+    assert stderr == b''
+
+
+def test_no_reorder():
+    (code, stdout, stderr) = run(['-i', 'tcpflow', '--no-reorder'],
+                                 ['tcpflow_data/rearrange'])
+    assert code == 0
+    assert stderr == b''
+    (code, stdout, stderr) = run(['-i', 'har', '--no-reorder'],
+                                 ['har_data/1045_5.har'])
+    assert code > 0
+    assert stdout == b''
+    assert b'--no-reorder is not supported with -i har' in stderr
+
+
+def test_stats(tmpdir):
+    path = str(tmpdir.join('stats.json'))
+    (code, _, stderr) = run(['-i', 'tcpflow', '--stats', path],
+                            ['tcpflow_data/httpbin'])
+    assert code == 0
+    assert stderr == b''
+    with io.open(path, 'rt', encoding='utf-8') as f:
+        assert json.load(f) == {u'counters': {u'files.opened': 2,
+                                             u'files.sniffed': 2}}
+
+
+@pytest.mark.parametrize('output', ['text', 'html'])
+@pytest.mark.parametrize('options, relative_paths', [
+    (['-i', 'har'], ['har_data/firefox_gif.har', 'har_data/1045_5.har']),
+    (['-i', 'tcpflow'], ['tcpflow_data/httpbin', 'tcpflow_data/rearrange']),
+    (['-i', 'tcpflow', '--no-reorder'], ['tcpflow_data/rearrange']),
+    (['-i', 'tcpick', '--headers-only'], ['tcpick_data/httpbin']),
+    (['-i', 'pcap'], ['pcap_data/httpbin.pcap', 'pcap_data/tls.pcap']),
+    (['-i', 'combined'], ['combined_data/1003_1', 'combined_data/1250_1']),
+    (['-i', 'ndjson', '--lines', '2-'], ['ndjson_data/simple.ndjson']),
+    (['-i', 'streams'], ['tcpflow_data/httpbin/'
+                         '1470133183-172.016.000.100-53222-'
+                         '023.022.014.018-00080-0',
+                         'tcpflow_data/httpbin/'
+                         '1470133183-023.022.014.018-00080-'
+                         '172.016.000.100-53222-0']),
+])
+@pytest.mark.parametrize('more_options', [
+    ['--fail-on', 'comment'],
+    ['--fail-on', 'error', '-s', '1277', '-s', '1250'],
+])
+def test_jobs(monkeypatch, output, options, relative_paths, more_options):
+    monkeypatch.setattr(httpolice.inputs.ndjson, 'BATCH_SIZE', 1)
+    monkeypatch.setattr(httpolice.inputs.har, 'BATCH_SIZE', 3)
+    options = options + more_options + ['-o', output]
+    (code1, stdout1, stderr) = run(options, relative_paths)
+    assert stderr == b''
+    (code2, stdout2, stderr) = run(options + ['--jobs', '2'], relative_paths)
+    assert stderr == b''
+    assert (code1, stdout1) == (code2, stdout2)
+    assert stdout1.strip()
+
+
+def test_jobs_har_index(tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    for name in ['firefox_gif.har', 'simple_ok.har']:
+        with io.open(os.path.join(base_path, 'har_data', name), 'rb') as f:
+            (input_dir / name).write_bytes(f.read())
+    paths = sorted(str(path) for path in input_dir.iterdir())
+    (_, expected, _) = run(['-i', 'har'], paths)
+
+    # Nothing is written next to the input unless asked.
+    (code, stdout, stderr) = run(['-i', 'har', '--jobs', '2'], paths)
+    assert (code, stdout, stderr) == (0, expected, b'')
+    assert sorted(str(path) for path in input_dir.iterdir()) == paths
+    assert list(tmp_path.iterdir()) == [input_dir]
+
+    index_path = str(tmp_path / 'har.index')
+    for _ in range(2):
+        (code, stdout, stderr) = run(['-i', 'har', '--jobs', '2',
+                                      '--index', index_path], paths)
+        assert (code, stdout, stderr) == (0, expected, b'')
+        assert sorted(str(path) for path in input_dir.iterdir()) == paths
+        assert os.path.exists(index_path)
+
+
+def test_jobs_stats(tmp_path):
+    counters = []
+    for jobs in ['1', '0']:
+        stats_path = str(tmp_path / 'stats.json')
+        (code, _, stderr) = run(['-i', 'tcpflow', '--jobs', jobs,
+                                 '--stats', stats_path,
+                                 '--host', 'example.com'],
+                                ['tcpflow_data/httpbin'])
+        assert code == 0
+        assert stderr == b''
+        with io.open(stats_path, 'rt', encoding='utf-8') as f:
+            counters.append(json.load(f)['counters'])
+    # Counted in the main process (sniffing) and in the workers (filtering).
+    for name in ['files.sniffed', 'filter.exchanges_skipped']:
+        assert counters[0][name] == counters[1][name] > 0
+
+
+def test_timings(tmp_path, monkeypatch):
+    seen = set()
+    monkeypatch.setattr(timing, 'hooks',
+                        [lambda name, seconds, blocks: seen.add(name)])
+    timings = []
+    for jobs in ['1', '2']:
+        stats_path = str(tmp_path / 'stats.json')
+        (code, _, stderr) = run(['-i', 'tcpflow', '--jobs', jobs,
+                                 '--stats', stats_path, '--timings'],
+                                ['tcpflow_data/httpbin'])
+        assert code == 0
+        assert stderr.startswith(b'name ')
+        assert b'\ncheck.request.check_host ' in stderr
+        with io.open(stats_path, 'rt', encoding='utf-8') as f:
+            timings.append(json.load(f)['timings'])
+    assert not timing.enabled
+    assert {'input', 'report'} <= seen
+    # Input and reports are measured differently with ``--jobs``
+    # (in parts and fragments), but the rest is the same.
+    for name in ['framing', 'check', 'headers', 'check.message.parse_body',
+                 'property.decoded_body']:
+        assert name in seen
+        assert timings[0][name][u'calls'] == timings[1][name][u'calls'] > 0
+        assert timings[1][name][u'self_seconds'] <= \
+            timings[1][name][u'seconds']
+
+    # Without ``--timings``, nothing is measured.
+    seen.clear()
+    (code, _, stderr) = run(['-i', 'tcpflow', '--stats', stats_path],
+                            ['tcpflow_data/httpbin'])
+    assert stderr == b''
+    assert not seen
+    with io.open(stats_path, 'rt', encoding='utf-8') as f:
+        assert u'timings' not in json.load(f)
+
+
+def test_jobs_stdin(monkeypatch):
+    # Standard input can only be read in the main process. A regular file
+    # stands in for it here, because with a pipe, the worker processes
+    # could inherit its writing end and keep it from ever ending.
+    stdout = MockStdio()
+    stderr = MockStdio()
+    with io.open(os.path.join(base_path, 'ndjson_data', 'simple.ndjson'),
+                 'rb') as f:
+        monkeypatch.setattr(sys, 'stdin', f)
+        args = httpolice.cli.parse_args(['httpolice', '-i', 'ndjson',
+                                         '-o', 'html', '--jobs', '2', '-'])
+        code = httpolice.cli.run_cli(args, stdout, stderr)
+    assert code == 0
+    assert stdout.buffer.getvalue().count(b'<div class="exchange">') == 3
+    assert b'from &lt;stdin&gt;, line 3' in stdout.buffer.getvalue()
+
+
+def test_jobs_error(tmp_path):
+    path = tmp_path / 'input.ndjson'
+    path.write_bytes(b'{"response": {"status": 200, "reason": "Hi"}}\n'
+                     b'{"response": {"status": 200\n')
+    (code1, stdout1, stderr1) = run(['-i', 'ndjson'], [str(path)])
+    (code2, stdout2, stderr2) = run(['-i', 'ndjson', '--jobs', '2'],
+                                    [str(path)])
+    assert code1 == code2 == 1
+    assert b'1110' in stdout1
+    assert (stdout1, stderr1) == (stdout2, stderr2)
+    assert b'bad NDJSON record' in stderr1
+
+
+def test_jobs_follow():
+    (code, stdout, stderr) = run(['-i', 'tcpflow', '--follow', '--jobs', '2'],
+                                 ['tcpflow_data/request_timeout'])
+    assert code > 0
+    assert stdout == b''
+    assert b'--jobs cannot be used with --follow' in stderr
+
+
+def test_pcap_index():
+    (code, stdout, stderr) = run(['-i', 'pcap', '--index', 'foo'],
+                                 ['pcap_data/tls.pcap'])
+    assert code > 0
+    assert stdout == b''
+    assert b'--index is not supported with -i pcap' in stderr
+
+
 def test_bad_tcpflow_directory():
     (code, stdout, stderr) = run(['-i', 'tcpflow'],
                                  ['tcpflow_data/wrong_filenames'])
@@ -127,3 +375,289 @@ def test_silence():
     assert b'1187' not in stdout
     assert b'1183' in stdout
     assert stderr == b''
+
+
+def test_only():
+    (code, stdout, stderr) = run(['-i', 'combined', '--fail-on=error',
+                                  '--only', '1183,1187', '-s', '1187'],
+                                 ['combined_data/1187_1'])
+    assert code == 0
+    assert b'1187' not in stdout
+    assert b'1183' in stdout
+    assert b'1168' not in stdout
+    assert stderr == b''
+
+    (code, stdout, stderr) = run(['-i', 'combined', '--only', '1168',
+                                  '--only', '1187'],
+                                 ['combined_data/1187_1'])
+    assert code == 0
+    assert b'1168' in stdout
+    assert b'1187' in stdout
+    assert b'1183' not in stdout
+
+
+@pytest.mark.parametrize('value', ['', '1000,', 'x', '9999'])
+def test_bad_only(value):
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'combined',
+                                  '--only', value, 'foo'])
+
+
+def test_cache(tmp_path):
+    paths = ['combined_data/1187_1', 'combined_data/1277_1',
+             'combined_data/1187_1', 'combined_data/1187_1']
+    (code1, stdout1, stderr) = run(['-i', 'combined', '-o', 'html'], paths)
+    assert stderr == b''
+    stats_path = str(tmp_path / 'stats.json')
+    (code2, stdout2, stderr) = run(['-i', 'combined', '-o', 'html',
+                                    '--cache', '10', '--volatile-header',
+                                    'X-Foo', '--stats', stats_path], paths)
+    assert stderr == b''
+    assert (code1, stdout1) == (code2, stdout2)
+    with io.open(stats_path, 'rt', encoding='utf-8') as f:
+        counters = json.load(f)['counters']
+    assert counters[u'cache.misses'] == 2
+    assert counters[u'cache.hits'] == 2
+
+    for options in [[], ['--jobs', '2']]:
+        (code, stdout, stderr) = run(['-i', 'tcpflow', '--cache', '10'] +
+                                     options, ['tcpflow_data/httpbin'])
+        assert stderr == b''
+        assert (code, stdout) == run(['-i', 'tcpflow'],
+                                     ['tcpflow_data/httpbin'])[:2]
+
+
+def test_cache_order(tmp_path):
+    # The second exchange differs from the first only in its ``Age`` header,
+    # which has a syntax error, so the cache reuses the notices of the first
+    # and the check that parses headers runs again. Its notice must
+    # still come first, as it does without the cache.
+    paths = ['combined_data/1168_1', 'combined_data/1168_2']
+    (code1, stdout1, stderr) = run(['-i', 'combined'], paths)
+    assert stderr == b''
+    assert b'E 1000 Syntax error in Age header\nD 1168' in stdout1
+    stats_path = str(tmp_path / 'stats.json')
+    (code2, stdout2, stderr) = run(['-i', 'combined', '--cache', '10',
+                                    '--stats', stats_path], paths)
+    assert stderr == b''
+    assert (code1, stdout1) == (code2, stdout2)
+    with io.open(stats_path, 'rt', encoding='utf-8') as f:
+        assert json.load(f)['counters'][u'cache.hits'] == 1
+
+
+@pytest.mark.parametrize('options', [
+    ['--cache', '10', '--volatile-header', 'Content-Type'],
+    ['--volatile-header', 'X-Foo'],
+])
+def test_bad_cache(options):
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'combined'] + options +
+                                 ['foo'])
+
+
+def test_headers_only():
+    (code, stdout, stderr) = run(['-i', 'combined', '--headers-only'],
+                                 ['combined_data/1038_1'])
+    assert code == 0
+    assert b'1038' not in stdout
+    assert stderr == b''
+
+
+def test_index(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    (code, stdout, stderr) = run(['-i', 'tcpflow', '--index', index_path],
+                                 ['tcpflow_data/request_timeout'])
+    assert code == 0
+    assert b'C 1278' in stdout
+    assert stderr == b''
+    assert os.path.exists(index_path)
+
+    (code, stdout, stderr) = run(['-i', 'har', '--index', index_path],
+                                 ['har_data/simple_ok.har'])
+    assert code > 0
+    assert stdout == b''
+    assert b'--index requires --jobs with -i har' in stderr
+
+
+def test_ndjson_lines():
+    (code, stdout, stderr) = run(['-i', 'ndjson', '-o', 'html',
+                                  '--lines', '3-'],
+                                 ['ndjson_data/simple.ndjson'])
+    assert code == 0
+    assert b'line 3' in stdout
+    assert b'line 1' not in stdout
+    assert stderr == b''
+    (code, stdout, stderr) = run(['-i', 'har', '--lines', '-3'],
+                                 ['har_data/simple_ok.har'])
+    assert code > 0
+    assert b'--lines is not supported with -i har' in stderr
+
+
+@pytest.mark.parametrize('value', ['5', 'a-b', '0-3'])
+def test_bad_line_range(value):
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'ndjson',
+                                  '--lines', value, 'foo.ndjson'])
+
+
+def test_follow(tmp_path, fake_time):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    fake_time([lambda: None] * 3)
+    (code, stdout, stderr) = run(['-i', 'tcpflow', '-o', 'html', '--follow',
+                                  '--idle-timeout', '2',
+                                  '--checkpoint', checkpoint_path],
+                                 ['tcpflow_data/request_timeout'])
+    assert code == 0
+    assert stdout.endswith(b'</html>')
+    assert b'1278' in stdout
+    assert stderr == b''
+    assert os.path.exists(checkpoint_path)
+
+
+@pytest.mark.parametrize('options, message', [
+    (['-i', 'tcpflow', '--idle-timeout', '5'], b'--idle-timeout requires'),
+    (['-i', 'tcpflow', '--checkpoint', 'foo'], b'--checkpoint requires'),
+    (['-i', 'streams', '--follow'], b'--follow is not supported'),
+])
+def test_bad_follow(options, message):
+    (code, _, stderr) = run(options, ['tcpflow_data/request_timeout'])
+    assert code > 0
+    assert message in stderr
+
+
+def test_interrupted(monkeypatch):
+    def interrupt(*_args, **_kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(httpolice.cli, 'check_exchange', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        run(['-i', 'combined'], ['combined_data/simple_ok'])
+
+
+def test_filters(tmp_path):
+    stats_path = str(tmp_path / 'stats.json')
+    (code, stdout, stderr) = run(['-i', 'har', '-o', 'html',
+                                  '--stats', stats_path,
+                                  '--host', 'IDSync.rlcdn.com',
+                                  '--host', 'pippio.com',
+                                  '--target-prefix', '/api/sync/',
+                                  '--target-prefix', '/favicon.ico'],
+                                 ['har_data/firefox_gif.har'])
+    assert code == 0
+    assert stdout.count(b'<div class="exchange">') == 2
+    assert b'/api/sync/ddp' in stdout
+    assert b'/favicon.ico' in stdout
+    assert stderr == b''
+    with io.open(stats_path, 'rt', encoding='utf-8') as f:
+        counters = json.load(f)['counters']
+    assert counters['filter.exchanges_skipped'] == 6
+
+    (code, stdout, stderr) = run(['-i', 'har', '-o', 'html',
+                                  '--since', '2019-06-27T13:33:54+03:00'],
+                                 ['har_data/firefox_gif.har'])
+    assert code == 0
+    assert stdout.count(b'<div class="exchange">') == 3
+
+    # Without a scheme, the request's host is unknown,
+    # but its target is still there.
+    for (options, n) in [(['--host', 'example.com'], 2),
+                         (['--target-prefix', '/'], 3)]:
+        (code, stdout, stderr) = run(['-i', 'ndjson', '-o', 'html'] + options,
+                                     ['ndjson_data/simple.ndjson'])
+        assert stdout.count(b'<div class="exchange">') == n
+
+    (code, stdout, stderr) = run(['-i', 'ndjson', '--until', '2019-06-27'],
+                                 ['ndjson_data/simple.ndjson'])
+    assert code > 0
+    assert b'--until is not supported with -i ndjson' in stderr
+
+
+def test_bad_timestamp():
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'har',
+                                  '--since', 'yesterday', 'foo.har'])
+
+
+def test_budget(tmp_path):
+    quarantine = tmp_path / 'quarantine'
+    stats_path = str(tmp_path / 'stats.json')
+    (code, stdout, stderr) = run(['-i', 'ndjson', '--budget', '0',
+                                  '--quarantine', str(quarantine),
+                                  '--stats', stats_path],
+                                 ['ndjson_data/simple.ndjson'])
+    assert code == 0
+    assert stderr == b''
+    assert stdout.count(b'1313 Checking took too long') == 3
+    with io.open(stats_path, 'rt', encoding='utf-8') as f:
+        counters = json.load(f)['counters']
+    assert counters[u'budget.exceeded'] == 3
+    assert counters[u'budget.quarantined'] == 3
+
+    # With more time, the quarantined exchanges give the same notices.
+    paths = sorted(str(path) for path in quarantine.iterdir())
+    assert len(paths) == 3
+    notices = sorted(run(['-i', 'ndjson'], paths)[1].splitlines())
+    assert notices == \
+        sorted(run(['-i', 'ndjson'], ['ndjson_data/simple.ndjson'])[1].
+               splitlines())
+
+
+def test_bad_budget():
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'ndjson',
+                                  '--quarantine', 'q', 'foo.ndjson'])
+
+
+def test_sampling(tmp_path):
+    stats_path = str(tmp_path / 'stats.json')
+    outputs = []
+    for jobs in ['1', '2']:
+        (code, stdout, stderr) = run(['-i', 'tcpflow', '--jobs', jobs,
+                                      '--sample-rate', '0.9',
+                                      '--max-per-key', '1',
+                                      '--stats', stats_path],
+                                     ['tcpflow_data/httpbin',
+                                      'tcpflow_data/rearrange',
+                                      'tcpflow_data/multiple_connections'])
+        assert code == 0
+        assert stderr == b''
+        outputs.append(stdout)
+        with io.open(stats_path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        assert data[u'counters'][u'sample.exchanges_skipped'] == 4
+        assert data[u'counters'][u'sample.exchanges_capped'] == 2
+        # 18 exchanges were checked, 2 more were left out of them.
+        ratio = data[u'sampling'][u'ratio']
+        assert ratio == 0.9 * (18 / 20)
+        # Two errors are not about exchanges (1009 about a connection
+        # and 1279 about unprocessable streams), and they are never
+        # sampled out, so they are not extrapolated.
+        assert b'------------\nE 1009 ' in stdout
+        assert b'------------\nE 1279 ' in stdout
+        assert data[u'sampling'][u'notices'][u'error'] == \
+            pytest.approx((stdout.count(b'\nE ') - 2) / ratio + 2)
+    assert outputs[0] == outputs[1]
+    assert outputs[0].endswith(b'D 1314 Only a sample of the input '
+                               b'was checked\n')
+
+    (code, stdout, stderr) = run(['-i', 'tcpflow', '--sample-rate', '0.5',
+                                  '--sample-by', 'connection'],
+                                 ['tcpflow_data/multiple_connections'])
+    assert stdout.count(b'------------ request:') == 1
+
+    (code, stdout, stderr) = run(['-i', 'har', '--sample-rate', '0.5',
+                                  '--sample-by', 'connection'],
+                                 ['har_data/firefox_gif.har'])
+    assert code > 0
+    assert b'--sample-by connection is not supported with -i har' in stderr
+
+
+@pytest.mark.parametrize('options', [
+    ['--sample-rate', '0'],
+    ['--sample-rate', '1.5'],
+    ['--sample-by', 'url'],
+    ['--max-per-key', '0'],
+])
+def test_bad_sampling(options):
+    with pytest.raises(SystemExit):
+        httpolice.cli.parse_args(['httpolice', '-i', 'tcpflow'] + options +
+                                 ['foo'])
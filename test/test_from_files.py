@@ -13,12 +13,22 @@ import re
 
 import pytest
 
+from httpolice.blackboard import Blackboard, Snapshot
 from httpolice.exchange import check_exchange
+from httpolice.header import HeadersView, HeaderView
+from httpolice.known import h
 from httpolice.inputs.har import har_input
 from httpolice.inputs.streams import combined_input, parse_combined
+from httpolice.notice import all_notices
 from httpolice.reports import html_report, text_report
+from httpolice.result_cache import ResultCache
+from httpolice.structure import HeaderEntry
 from httpolice.util.text import decode_path
 
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member
+
 
 base_path = os.path.dirname(decode_path(__file__))
 
@@ -27,32 +37,39 @@ relative_paths = [os.path.join(section, fn)
                   for fn in os.listdir(os.path.join(base_path, section))]
 
 
+def load(path, **kwargs):
+    if path.endswith('.har'):
+        return list(har_input([path], **kwargs))
+    return list(combined_input([path], **kwargs))
+
+
+def notice_ids(exchanges, headers_only=False, cache=None):
+    for exch in exchanges:
+        check_exchange(exch, headers_only=headers_only, cache=cache)
+    buf = io.BytesIO()
+    text_report(exchanges, buf)
+    return sorted(int(ln[2:6])
+                  for ln in buf.getvalue().decode('utf-8').splitlines()
+                  if not ln.startswith(u'----'))
+
+
 @pytest.fixture(params=relative_paths)
 def input_from_file(request):
     path = os.path.join(base_path, request.param)
     if path.endswith('.har'):
         with io.open(path, 'rt', encoding='utf-8-sig') as f:
             expected = sorted(json.load(f)['_expected'])
-        exchanges = list(har_input([path]))
     else:
         (_, _, _, preamble) = parse_combined(path)
         lines = [ln for ln in preamble.splitlines() if not ln.startswith(u'#')]
         expected = sorted(int(n) for n in lines[0].split())
-        exchanges = list(combined_input([path]))
-    return (exchanges, expected)
+    return (path, expected)
 
 
 def test_from_file(input_from_file):    # pylint: disable=redefined-outer-name
-    (exchanges, expected) = input_from_file
-    for exch in exchanges:
-        check_exchange(exch)
-
-    buf = io.BytesIO()
-    text_report(exchanges, buf)
-    actual = sorted(int(ln[2:6])
-                    for ln in buf.getvalue().decode('utf-8').splitlines()
-                    if not ln.startswith(u'----'))
-    assert expected == actual
+    (path, expected) = input_from_file
+    exchanges = load(path)
+    assert expected == notice_ids(exchanges)
 
     buf = io.BytesIO()
     html_report(exchanges, buf)
@@ -60,3 +77,91 @@ def test_from_file(input_from_file):    # pylint: disable=redefined-outer-name
     # Python object reprs, meaning that we failed to render something.
     # This pops up from time to time.
     assert not re.search(b'&lt;[^>]+ at 0x[0-9a-fA-F]+&gt;', buf.getvalue())
+
+
+def test_headers_only(input_from_file):  # pylint: disable=redefined-outer-name
+    # Skipping bodies may hide some notices, but must never add new ones.
+    (path, expected) = input_from_file
+    for actual in [notice_ids(load(path, headers_only=True)),
+                   notice_ids(load(path), headers_only=True)]:
+        assert all(actual.count(n) <= expected.count(n) for n in actual)
+
+
+def test_only(input_from_file):     # pylint: disable=redefined-outer-name
+    # When all other notices are silenced, the checks that cannot report
+    # a given notice are skipped (like with ``httpolice --only``),
+    # but the notice itself must still be reported.
+    (path, expected) = input_from_file
+    for notice_id in set(expected):
+        exchanges = load(path)
+        for exch in exchanges:
+            exch.silence(set(all_notices) - {notice_id})
+        assert notice_ids(exchanges) == [notice_id] * expected.count(notice_id)
+
+
+def test_cached(input_from_file):   # pylint: disable=redefined-outer-name
+    # Exchanges that only differ in volatile headers get the same notices
+    # from a cache, down to the details of the HTML report,
+    # even when some of these notices depend on the volatile headers.
+    (path, expected) = input_from_file
+    cache = ResultCache()
+    assert notice_ids(load(path), cache=cache) == expected
+    exchanges = [load(path), load(path)]
+    assert notice_ids(exchanges[0], cache=cache) == expected
+    assert notice_ids(exchanges[1]) == expected
+    reports = [io.BytesIO(), io.BytesIO()]
+    for (exchs, buf) in zip(exchanges, reports):
+        html_report(exchs, buf)
+    assert reports[0].getvalue() == reports[1].getvalue()
+
+    for (date, age) in [(b'Sat, 01 Jan 2050 00:00:00 GMT', b'5'),
+                        (b'Mon, 01 Jan 2001 00:00:00 GMT', b'999999'),
+                        (b'yesterday', b'-1')]:
+        exchanges = [load(path), load(path)]
+        for exch in exchanges[0] + exchanges[1]:
+            for msg in exch.children:
+                for entries in [msg.header_entries, msg.trailer_entries]:
+                    entries[:] = [
+                        HeaderEntry(entry.name, {h.date: date, h.age: age}.
+                                    get(entry.name, entry.value))
+                        for entry in entries]
+        # The notices are also in the same order.
+        reports = [io.BytesIO(), io.BytesIO()]
+        for (exchs, buf, exch_cache) in zip(exchanges, reports,
+                                            [cache, None]):
+            for exch in exchs:
+                check_exchange(exch, cache=exch_cache)
+            text_report(exchs, buf)
+        assert reports[0].getvalue() == reports[1].getvalue()
+
+
+def test_released(input_from_file):     # pylint: disable=redefined-outer-name
+    # After release, the notices still render the same in text reports,
+    # and HTML reports still work, but nothing refers to the messages.
+    (path, expected) = input_from_file
+    exchanges = load(path)
+    assert notice_ids(exchanges) == expected
+    before = io.BytesIO()
+    text_report(exchanges, before)
+    for exch in exchanges:
+        exch.release()
+    after = io.BytesIO()
+    text_report(exchanges, after)
+    assert after.getvalue() == before.getvalue()
+    html_report(exchanges, io.BytesIO())
+
+    def refers_to_message(value):
+        if isinstance(value, list):
+            return any(refers_to_message(x) for x in value)
+        if isinstance(value, Snapshot):
+            return any(refers_to_message(x) for x in vars(value).values())
+        if isinstance(value, HeaderView):
+            return value.message is not None
+        return isinstance(value, (Blackboard, HeadersView))
+
+    for exch in exchanges:
+        for obj in [exch] + exch.children:
+            for complaint in obj.complaints:
+                assert not refers_to_message(list(complaint.context.values()))
+            body = getattr(obj, 'body', None)
+            assert body in [None, b''] or body.inner is None
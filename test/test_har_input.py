@@ -1,7 +1,30 @@
+import codecs
+from datetime import datetime
+import io
+import json
 import os
+import pickle
+from urllib.parse import urlsplit
 
-from httpolice.inputs.har import har_input
+import pytest
+
+from httpolice.blackboard import Lazy
+import httpolice.inputs.har
+from httpolice.inputs.common import InputError
+from httpolice.inputs.har import (
+    _batch_exchanges,
+    _EntryIndex,
+    har_input,
+)
+from httpolice.inputs.filters import parse_timestamp
+from httpolice.inputs.jsonstream import JSONScanError, JSONScanner
 from httpolice.structure import Unavailable
+from httpolice.util import stats
+
+
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member,unbalanced-tuple-unpacking
 
 
 def load_from_file(name):
@@ -35,6 +58,13 @@ def test_request_text():
     assert exch.request.unicode_body.startswith(u'custname=Vasiliy')
 
 
+def test_bytes_path():
+    path = os.path.join(os.path.dirname(__file__), 'har_data',
+                        'chrome_text.har')
+    [exch] = har_input([os.fsencode(path)])
+    assert path in exch.request.remark
+
+
 def test_response_fail():
     [exch] = load_from_file('chrome_https_fail.har')
     assert exch.responses == []
@@ -60,7 +90,12 @@ def test_response_text():
 
 def test_response_base64():
     exchanges = load_from_file('firefox_gif.har')
-    assert exchanges[-2].responses[0].decoded_body.startswith(b'GIF89')
+    resp = exchanges[-2].responses[0]
+    # Not decoded until needed.
+    assert isinstance(resp.memoized['decoded_body'], Lazy)
+    resp = pickle.loads(pickle.dumps(resp))
+    assert resp.decoded_body.startswith(b'GIF89')
+    assert not isinstance(resp.memoized['decoded_body'], Lazy)
 
 
 def test_response_bad_base64():
@@ -90,3 +125,327 @@ def test_firefox_304():
     assert exch.responses[0].body == b''
     assert exch.responses[0].decoded_body == b''
     assert exch.responses[0].unicode_body == u''
+
+
+def load_from_text(tmpdir, text):
+    path = tmpdir.join('test.har')
+    path.write_binary(text)
+    return list(har_input([str(path)]))
+
+
+@pytest.mark.parametrize('name', sorted(
+    os.listdir(os.path.join(os.path.dirname(__file__), 'har_data'))))
+def test_scanner_small_chunks(name):
+    # Walk through the HAR files 7 bytes at a time
+    # and check that we see exactly what the ``json`` module sees.
+    path = os.path.join(os.path.dirname(__file__), 'har_data', name)
+    with io.open(path, 'rb') as f:
+        data = json.loads(f.read().decode('utf-8-sig'))
+        f.seek(0)
+        if f.read(3) != codecs.BOM_UTF8:
+            f.seek(0)
+        scanner = JSONScanner(f, chunk_size=7)
+        entries = []
+        for key in scanner.iter_object():
+            if key != u'log':
+                scanner.skip_value()
+                continue
+            for log_key in scanner.iter_object():
+                if log_key == u'entries':
+                    for _ in scanner.iter_array():
+                        entries.append(scanner.load())
+                else:
+                    scanner.skip_value()
+        assert scanner.peek() == b''
+    assert entries == data['log']['entries']
+
+
+@pytest.mark.parametrize('text', [
+    b'{}',
+    b'{"x": {"y": ["]", "\\"", {}, [[]]]}, "z": -1.5e3} ',
+    b'[1, true, null, "a\\\\"]',
+    b'"\\u0041"',
+    b'"abc"',
+    b' { } ',
+    b'12345',
+])
+def test_scanner_skip(text):
+    scanner = JSONScanner(io.BytesIO(text), chunk_size=2)
+    scanner.skip_value()
+    assert scanner.peek() == b''
+    scanner.seek(0)
+    assert scanner.load() == json.loads(text.decode('utf-8'))
+    scanner.seek(0)
+    out = io.BytesIO()
+    scanner.copy_value(out)
+    assert out.getvalue() == text.strip()
+
+
+def test_scanner_big_value():
+    # Reading a value much bigger than a chunk takes linear time.
+    text = b'["' + b'x' * (4 * 1024 * 1024) + b'", {"y": "\\""}]'
+    scanner = JSONScanner(io.BytesIO(text), chunk_size=64)
+    value = scanner.read_value()
+    assert isinstance(value, bytes)
+    assert value == text
+    assert scanner.peek() == b''
+
+
+@pytest.mark.parametrize('text', [
+    b'',
+    b'{"a" 1}',
+    b'{1: 2}',
+    b'{"a": 1 "b": 2}',
+    b'[1 2]',
+    b'[1, ,]',
+    b'"abc',
+    b'"abc\\',
+    b'{"a": [1, 2',
+])
+def test_scanner_errors(text):
+    scanner = JSONScanner(io.BytesIO(text), chunk_size=3)
+    with pytest.raises(JSONScanError):
+        if scanner.peek() == b'{':
+            for _ in scanner.iter_object():
+                scanner.skip_value()
+        elif scanner.peek() == b'[':
+            for _ in scanner.iter_array():
+                scanner.skip_value()
+        else:
+            scanner.skip_value()
+
+
+@pytest.mark.parametrize('from_stdin', [False, True])
+def test_entries_before_creator(tmpdir, stdin_pipe, from_stdin):
+    text = (b'''
+        {"log": {
+            "version": "1.2",
+            "entries": [
+                {"request": {"method": "CONNECT",
+                             "url": "https://example.com:443",
+                             "httpVersion": "HTTP/1.1",
+                             "headers": [], "bodySize": 0,
+                             "postData": {"text": "Fiddler stuff"}},
+                 "response": {"status": 0}},
+                {"request": {"method": "GET",
+                             "url": "http://example.com/",
+                             "httpVersion": "HTTP/1.1",
+                             "headers": [], "bodySize": 0},
+                 "response": {"status": 0}}
+            ],
+            "creator": {"name": "Fiddler", "version": "4.6"},
+            "comment": "entries are not required to come first"
+        }}
+    ''')
+    if from_stdin:
+        # A pipe can't be read again, so the entries are saved aside.
+        with stdin_pipe(text):
+            exchanges = list(har_input([u'-']))
+    else:
+        exchanges = load_from_text(tmpdir, text)
+    assert [exch.request.method for exch in exchanges] == \
+        [u'CONNECT', u'GET']
+    # Fiddler quirks are applied even though the creator came later.
+    assert exchanges[0].request.body == b''
+
+
+@pytest.mark.parametrize('text', [
+    b'{"log": {"creator": {"name": "x"}, "entries": []}',
+    b'{"log": {"creator": {"name": "x"}, "entries": []}} []',
+    b'{"log": {"creator": {"name": "x"}, "entries": [}}',
+    b'{"log": "\xff"}',
+    b'{"log": {"creator": {"name": "x"}, "entries": []}, "x": }',
+])
+def test_bad_json(tmpdir, text):
+    with pytest.raises(InputError, match=u'bad HAR file'):
+        load_from_text(tmpdir, text)
+
+
+@pytest.mark.parametrize('text', [
+    b'[]',
+    b'{"hello": "world"}',
+    b'{"log": []}',
+    b'{"log": {}}',
+    b'{"log": {"entries": []}}',
+    b'{"log": {"creator": {"name": "x"}}}',
+    b'{"log": {"creator": {"name": "x"}, "entries": {}}}',
+    b'{"log": {"entries": [], "creator": "x"}}',
+])
+def test_not_har(tmpdir, text):
+    with pytest.raises(InputError, match=u'cannot understand HAR file'):
+        load_from_text(tmpdir, text)
+
+
+def test_from_stdin(stdin_pipe):
+    path = os.path.join(os.path.dirname(__file__), 'har_data',
+                        'firefox_gif.har')
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    # With ``--jobs``, a pipe is still read in the main process.
+    with stdin_pipe(codecs.BOM_UTF8 + data):
+        exchanges = load_parts([u'-'])
+    assert len(exchanges) == 8
+    assert exchanges[0].request.remark == u'from <stdin>'
+    with stdin_pipe(b'{"log": {"creator": {"name": "x"}, "entries": [}}'):
+        with pytest.raises(InputError, match=u'<stdin>: bad HAR file'):
+            list(har_input([u'-']))
+
+
+def copy_to(tmpdir, name):
+    path = tmpdir.join(name)
+    with io.open(os.path.join(os.path.dirname(__file__), 'har_data', name),
+                 'rb') as f:
+        path.write_binary(f.read())
+    return str(path)
+
+
+def load_parts(paths, **kwargs):
+    # Read the parts for ``httpolice --jobs`` right here, one after another.
+    (parts, _) = har_input(paths, parts=True, **kwargs)
+    return [exch for part in parts for exch in part.func(*part.args)]
+
+
+def test_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.har, 'BATCH_SIZE', 3)
+    names = ['chrome_http2.har', 'fiddler+ie11_connect.har',
+             'firefox_gif.har', 'simple_ok.har']
+    paths = [copy_to(tmpdir, name) for name in names]
+    expected = [repr(exch) for exch in har_input(paths)]
+    assert [repr(exch) for exch in load_parts(paths)] == expected
+    assert sorted(tmpdir.listdir()) == sorted(tmpdir.join(name)
+                                              for name in names)
+    index_path = str(tmpdir.join('har.index'))
+    assert [repr(exch) for exch in load_parts(paths, index=index_path)] == \
+        expected
+    # The second time, the index file is reused.
+    monkeypatch.setattr(httpolice.inputs.har, '_read_entries', None)
+    assert [repr(exch) for exch in load_parts(paths, index=index_path)] == \
+        expected
+
+
+def test_parallel_batch(tmpdir):
+    path = copy_to(tmpdir, 'firefox_gif.har')
+    (creator, offsets) = _EntryIndex(None).entries(path)
+    exchanges = _batch_exchanges(path, creator, offsets[2:6],
+                                 False, None, None)
+    assert [repr(exch) for exch in exchanges] == \
+        [repr(exch) for exch in har_input([path])][2:6]
+
+
+def test_parallel_stale_index(tmpdir):
+    path = copy_to(tmpdir, 'chrome_text.har')
+    index_path = str(tmpdir.join('har.index'))
+    assert len(load_parts([path], index=index_path)) == 1
+    tmpdir.join('chrome_text.har').write_binary(b'''
+        {"log": {"creator": {"name": "x"}, "entries": []}}
+    ''')
+    assert load_parts([path], index=index_path) == []
+    with io.open(index_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    data[u'httpolice_har_index'] = 1
+    with io.open(index_path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f)
+    assert load_parts([path], index=index_path) == []
+
+
+@pytest.mark.parametrize('text, message', [
+    (b'{"foo":', u'bad index file'),
+    (b'{"httpolice_index": 2}', u'not an HTTPolice index file for HAR'),
+])
+def test_parallel_bad_index(tmpdir, text, message):
+    path = copy_to(tmpdir, 'chrome_text.har')
+    index_path = tmpdir.join('har.index')
+    index_path.write_binary(text)
+    with pytest.raises(InputError, match=message):
+        load_parts([path], index=str(index_path))
+
+
+def test_index_without_parts(tmpdir):
+    path = copy_to(tmpdir, 'chrome_text.har')
+    with pytest.raises(InputError, match=u'--index requires --jobs'):
+        har_input([path], index=str(tmpdir.join('har.index')))
+
+
+@pytest.mark.parametrize('text, message', [
+    (b'{"log": {"creator": {"name": "x"}, "entries": [[1 2]]}}',
+     u'bad HAR file'),
+    (b'{"log": {"creator": {"name": "x"}, "entries": [{}]}}',
+     u'cannot understand HAR file'),
+])
+def test_parallel_errors(tmpdir, text, message):
+    path = tmpdir.join('test.har')
+    path.write_binary(text)
+    with pytest.raises(InputError, match=message):
+        load_parts([str(path)])
+
+
+def test_parallel_batch_error(tmpdir):
+    path = tmpdir.join('test.har')
+    path.write_binary(
+        b'{"log": {"creator": {"name": "x"}, "entries": [{}, [1 2]]}}')
+    (_, offsets) = _EntryIndex(None).entries(str(path))
+    with pytest.raises(InputError, match=u'bad HAR file'):
+        list(_batch_exchanges(str(path), u'x', offsets[1:], False, None, None))
+
+
+@pytest.mark.parametrize('text, decoded_body', [
+    (u'aGVsbG8=', b'hello'),
+    (u'abc', None),
+])
+def test_fiddler_connect_other_body(tmpdir, text, decoded_body):
+    [exch] = load_from_text(tmpdir, json.dumps({u'log': {
+        u'creator': {u'name': u'Fiddler'},
+        u'entries': [{
+            u'request': {u'method': u'CONNECT',
+                         u'url': u'https://example.com:443',
+                         u'httpVersion': u'HTTP/1.1',
+                         u'headers': [], u'bodySize': 0},
+            u'response': {u'status': 200, u'statusText': u'OK',
+                          u'httpVersion': u'HTTP/1.1', u'headers': [],
+                          u'bodySize': 5,
+                          u'content': {u'size': 5, u'encoding': u'base64',
+                                       u'text': text}},
+        }],
+    }}).encode('utf-8'))
+    resp = exch.responses[0]
+    if decoded_body is None:
+        assert isinstance(resp.decoded_body, Unavailable)
+    else:
+        assert resp.decoded_body == decoded_body
+
+
+@pytest.mark.parametrize('load', [har_input, load_parts])
+def test_time_window(tmpdir, load):
+    path = copy_to(tmpdir, 'firefox_gif.har')
+    stats.reset()
+    exchanges = list(load(
+        [path], since=datetime(2019, 6, 27, 10, 33, 53, 700000),
+        until=parse_timestamp(u'2019-06-27T13:33:54.200+03:00')))
+    assert [urlsplit(exch.request.effective_uri).hostname
+            for exch in exchanges] == \
+        [u'cm.g.doubleclick.net', u'pippio.com', u'tags.rd.linksynergy.com']
+    assert stats.snapshot()[u'filter.entries_skipped'] == 5
+
+
+def test_time_window_batch(tmpdir):
+    path = copy_to(tmpdir, 'firefox_gif.har')
+    (creator, offsets) = _EntryIndex(None).entries(path)
+    stats.reset()
+    exchanges = list(_batch_exchanges(
+        path, creator, offsets[2:6], False,
+        None, datetime(2019, 6, 27, 10, 33, 53, 700000)))
+    assert len(exchanges) == 1
+    assert stats.snapshot() == {u'filter.entries_skipped': 3}
+
+
+def test_time_window_bad_time(tmpdir):
+    # Entries without a proper ``startedDateTime`` are not skipped.
+    with io.open(os.path.join(os.path.dirname(__file__), 'har_data',
+                              'firefox_gif.har'), 'rb') as f:
+        data = json.load(f)
+    [entry1, entry2] = data['log']['entries'][:2]
+    entry1['startedDateTime'] = u'yesterday'
+    del entry2['startedDateTime']
+    path = tmpdir.join('test.har')
+    path.write_text(json.dumps(data), 'utf-8')
+    assert len(list(har_input([str(path)], since=datetime(2019, 7, 1)))) == 2
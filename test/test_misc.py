@@ -1,5 +1,8 @@
 import io
 
+import pytest
+
+from httpolice import Response
 import httpolice.helpers
 from httpolice.known import h
 import httpolice.notice
@@ -34,3 +37,47 @@ def test_notices_list():
     assert b'1151' in out
     assert b'Empty list elements in ' in out
     assert b'<var>place</var>' in out
+
+
+def test_complaint_deduplication():
+    resp = Response(u'HTTP/1.1', 200, u'OK',
+                    [(u'Date', b'foo'), (u'Date', b'bar')], b'')
+    (entry1, entry2) = resp.header_entries
+    # Headers are only equal to themselves, so that complaints about
+    # different headers are not mistaken for duplicates.
+    assert resp.headers.date != resp.headers.age
+    for _ in range(2):
+        resp.complain(1013, header=resp.headers.date,
+                      entries=[entry1, entry2])
+        resp.complain(1013, header=resp.headers.age, entries=(entry1,))
+        resp.complain(1000, place=entry1, error=ValueError(u'bad'))
+    assert [complaint.id for complaint in resp.complaints] == \
+        [1013, 1013, 1000, 1000]
+
+    notices = resp.notices
+    notices.clear()
+    assert len(resp.notices) == 4
+    resp.silence([1000])
+    assert [complaint.id for complaint in resp.complaints] == [1013, 1013]
+    resp.complain(1013, header=resp.headers.date, entries=[entry1])
+    assert len(resp.complaints) == 3
+
+
+def test_compact_messages():
+    resp = Response(u'HTTP/1.1', 200, u'OK',
+                    [(u'Content-Type', b'text/plain')], b'hello')
+    # Messages and headers are slotted, with no ``__dict__`` of their own.
+    for obj in [resp, resp.headers, resp.headers.content_type]:
+        with pytest.raises(AttributeError):
+            obj.foo = 1
+    assert resp.headers.content_type.name == h.content_type
+    assert resp.headers.cache_control.name == h.cache_control
+
+    assert resp.memoized == {}
+    assert resp.unicode_body == u'hello'
+    assert sorted(resp.memoized) == [u'decoded_body', u'guessed_charset',
+                                     u'unicode_body']
+    resp.forget()
+    assert resp.memoized == {}
+    assert u'decoded_body' in resp.derived_names
+    assert u'content_is_full' in resp.derived_names
@@ -0,0 +1,202 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from httpolice.exchange import check_exchange
+from httpolice.inputs.common import InputError
+from httpolice.inputs.ndjson import ndjson_input, ndjson_record
+from httpolice.structure import Unavailable
+from httpolice.util import stats
+
+
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member
+
+
+base_path = os.path.dirname(__file__)
+sample_path = os.path.join(base_path, 'ndjson_data', 'simple.ndjson')
+
+
+def write_records(tmpdir, records, compress=None):
+    data = b''.join(json.dumps(record).encode('utf-8') + b'\n'
+                    if isinstance(record, dict) else record
+                    for record in records)
+    path = tmpdir.join('input.ndjson')
+    path.write_binary(compress(data) if compress else data)
+    return str(path)
+
+
+def test_sample():
+    [exch1, exch2, exch3] = ndjson_input([sample_path])
+    assert exch1.request.method == u'GET'
+    assert exch1.request.target == u'/index.html'
+    assert exch1.request.body == b''
+    assert exch1.responses[0].status == 200
+    assert exch1.responses[0].body == b'Hello world!\r\n'
+    assert exch1.request.remark == u'from %s, line 1' % sample_path
+    assert exch3.request.body is None
+    for exch in [exch1, exch2, exch3]:
+        check_exchange(exch)
+
+
+def test_pseudo_headers():
+    [_, exch, _] = ndjson_input([sample_path])
+    check_exchange(exch)
+    assert exch.request.version == u'HTTP/2'
+    assert exch.request.method == u'POST'
+    assert exch.request.scheme == u'https'
+    assert exch.request.target == u'https://example.com/api/items'
+    assert not any(name.startswith(u':')
+                   for (name, _) in exch.request.header_entries)
+    [resp] = exch.responses
+    assert resp.version == u'HTTP/2'
+    assert resp.status == 201
+    assert resp.reason is None
+    assert resp.json_data == {u'id': 1}
+    assert not resp.complaints
+
+
+def test_pseudo_headers_target(tmpdir):
+    path = write_records(tmpdir, [
+        {'request': {'headers': [[':method', 'CONNECT'],
+                                 [':authority', 'example.com:443']]}},
+        {'request': {'headers': [[':method', 'GET'], [':path', '/foo']]}},
+        {'request': {'method': 'GET', 'target': '/bar',
+                     'headers': [[':path', '/foo']]}},
+    ])
+    assert [exch.request.target for exch in ndjson_input([path])] == \
+        [u'example.com:443', u'/foo', u'/bar']
+
+
+def test_only_response_and_trailers(tmpdir):
+    path = write_records(tmpdir, [
+        {'response': {'version': 'HTTP/1.1', 'status': 200, 'reason': 'OK',
+                      'headers': [['Transfer-Encoding', 'chunked'],
+                                  ['Trailer', 'Expires']],
+                      'trailers': [['Expires', '0']],
+                      'body': 'aGVsbG8=', 'body_encoding': 'base64'}},
+    ])
+    [exch] = ndjson_input([path])
+    assert exch.request is None
+    [resp] = exch.responses
+    assert resp.body == b'hello'
+    assert [entry.name for entry in resp.trailer_entries] == [u'Expires']
+
+
+def test_responses(tmpdir):
+    record = {
+        'request': {'method': 'POST', 'target': '/upload', 'scheme': 'http',
+                    'version': 'HTTP/1.1',
+                    'headers': [['Host', 'example.com'],
+                                ['Expect', '100-continue'],
+                                ['Content-Length', '3']],
+                    'body': 'AP8=', 'body_encoding': 'base64'},
+        'responses': [
+            {'version': 'HTTP/1.1', 'status': 100, 'reason': 'Continue',
+             'headers': []},
+            {'version': 'HTTP/1.1', 'status': 204, 'reason': 'No Content',
+             'headers': [['X-Caf\u00e9', 'caf\u00e9']], 'trailers': [],
+             'body': ''},
+        ],
+    }
+    path = write_records(tmpdir, [record, {'request': record['request']}])
+    [exch1, exch2] = ndjson_input([path])
+    assert [resp.status for resp in exch1.responses] == [100, 204]
+    assert exch1.responses[0].body is None
+    assert exch2.responses == []
+
+    # Records are written back the same way.
+    for exch in [exch1, exch2]:
+        [copy] = ndjson_input([write_records(tmpdir, [ndjson_record(exch)
+                                                      .encode('utf-8') +
+                                                      b'\n'])])
+        for (msg1, msg2) in zip(exch.children, copy.children):
+            assert msg1.header_entries == msg2.header_entries
+            assert msg1.trailer_entries == msg2.trailer_entries
+            assert msg1.body == msg2.body
+        assert [resp.status for resp in copy.responses] == \
+            [resp.status for resp in exch.responses]
+    assert json.loads(ndjson_record(exch1))['request']['body'] == 'AP8='
+
+
+def test_headers_only(tmpdir):
+    path = write_records(tmpdir, [
+        {'response': {'status': 200, 'body': 'not base64!',
+                      'body_encoding': 'base64'}},
+        {'response': {'status': 200, 'body': ''}},
+    ])
+    [exch1, exch2] = ndjson_input([path], headers_only=True)
+    assert isinstance(exch1.responses[0].body, Unavailable)
+    assert exch2.responses[0].body == b''
+
+
+def test_bad_body(tmpdir):
+    # A body that can't be decoded is unknown, but the rest is still read.
+    path = write_records(tmpdir, [
+        {'response': {'status': 200, 'body': '%%%',
+                      'body_encoding': 'base64'}},
+        {'response': {'status': 200, 'body': 'x', 'body_encoding': 'gzip'}},
+        {'response': {'status': 200, 'body': 'aGVsbG8=',
+                      'body_encoding': 'base64'}},
+    ])
+    stats.reset()
+    [exch1, exch2, exch3] = ndjson_input([path])
+    assert isinstance(exch1.responses[0].body, Unavailable)
+    assert isinstance(exch2.responses[0].body, Unavailable)
+    assert exch3.responses[0].body == b'hello'
+    assert stats.snapshot() == {u'ndjson.bad_bodies': 2}
+
+
+def test_lines(tmpdir):
+    records = [{'response': {'status': 200 + i}} for i in range(10)]
+    records.insert(3, b'\n')              # Blank lines are skipped.
+    path = write_records(tmpdir, records)
+
+    def statuses(lines):
+        return [exch.responses[0].status
+                for exch in ndjson_input([path], lines=lines)]
+
+    assert statuses(None) == list(range(200, 210))
+    assert statuses((2, 5)) == [201, 202, 203]
+    assert statuses((None, 2)) == [200, 201]
+    assert statuses((10, None)) == [208, 209]
+    exchanges = list(ndjson_input([path], lines=(11, 11)))
+    assert exchanges[0].responses[0].remark == u'from %s, line 11' % path
+
+
+def test_compressed(tmpdir):
+    path = write_records(tmpdir, [{'response': {'status': 200}}] * 3,
+                         compress=gzip.compress)
+    assert len(list(ndjson_input([path]))) == 3
+
+
+@pytest.mark.parametrize('compress', [None, gzip.compress])
+def test_stdin_pipe(stdin_pipe, compress):
+    data = b''.join([b'{"response": {"status": 200}}\n'] * 1000)
+    with stdin_pipe(compress(data) if compress else data):
+        exchanges = list(ndjson_input([u'-']))
+    assert len(exchanges) == 1000
+    assert exchanges[-1].responses[0].remark == u'from <stdin>, line 1000'
+
+
+@pytest.mark.parametrize('line, message', [
+    (b'{"response": {"status": 200', u'bad NDJSON record'),
+    (b'\xff\n', u'bad NDJSON record'),
+    (b'[1, 2]\n', u'cannot understand NDJSON record'),
+    (b'{"request": {"method": "GET"}}\n', u'cannot understand'),
+    (b'{"request": {"method": "GET", "target": "/", '
+     b'"headers": [["Host", 5]]}}\n', u'header is'),
+    (b'{"response": {"status": "200"}}\n', u'status is'),
+    (b'{"response": {"headers": [[":status", "OK"]]}}\n', u'bad NDJSON'),
+    (b'{"response": {"status": 200, "body": 5}}\n', u'body is'),
+])
+def test_bad_record(tmpdir, line, message):
+    path = write_records(tmpdir, [{'response': {'status': 200}}, line])
+    exchanges = ndjson_input([path])
+    next(exchanges)
+    with pytest.raises(InputError, match=message) as excinfo:
+        next(exchanges)
+    assert u'line 2' in str(excinfo.value)
@@ -0,0 +1,268 @@
+import bz2
+from datetime import datetime
+import gzip
+import io
+import lzma
+import os
+import pickle
+import random
+import shutil
+import tarfile
+import zipfile
+
+import pytest
+
+from httpolice.exchange import check_exchange
+import httpolice.inputs.packed
+from httpolice.inputs import InputError
+from httpolice.inputs.har import har_input
+from httpolice.inputs.packed import (ArchiveMember, DecompressedRaw, GzipRaw,
+                                     is_compressed, open_input)
+from httpolice.inputs.pcap import pcap_input
+from httpolice.inputs.streams import (combined_input, resp_stream_input,
+                                      tcpflow_input, tcpick_input)
+
+
+base_path = os.path.dirname(__file__)
+
+
+def summarize(exchanges):
+    r = []
+    for exch in exchanges:
+        check_exchange(exch)
+        r.append((repr(exch),
+                  [(repr(msg.body), sorted(c.id for c in msg.complaints))
+                   for msg in exch.children],
+                  sorted(c.id for c in exch.complaints)))
+    return r
+
+
+def compress_zstd(data):
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSORS = [gzip.compress, bz2.compress, lzma.compress, compress_zstd]
+
+
+def compressed_copy(tmpdir, relative_path, compress):
+    with io.open(os.path.join(base_path, relative_path), 'rb') as f:
+        data = f.read()
+    path = tmpdir.join(os.path.basename(relative_path) + '.packed')
+    path.write_binary(compress(data))
+    return str(path)
+
+
+@pytest.mark.parametrize('compress', COMPRESSORS)
+@pytest.mark.parametrize('input_func, relative_path', [
+    (har_input, 'har_data/firefox_gif.har'),
+    (combined_input, 'combined_data/complex_connection'),
+    (resp_stream_input, 'tcpflow_data/httpbin/'
+     '1470133183-023.022.014.018-00080-172.016.000.100-53222-0'),
+    (pcap_input, 'pcap_data/httpbin.pcap'),
+])
+def test_compressed_file(tmpdir, compress, input_func, relative_path):
+    path = compressed_copy(tmpdir, relative_path, compress)
+    assert is_compressed(path)
+    assert summarize(input_func([path])) == \
+        summarize(input_func([os.path.join(base_path, relative_path)]))
+
+
+def test_compressed_headers_only(tmpdir):
+    relative_path = ('tcpflow_data/httpbin/'
+                     '1470133183-023.022.014.018-00080-172.016.000.100-53222-0')
+    path = compressed_copy(tmpdir, relative_path, gzip.compress)
+    exchanges = list(resp_stream_input([path], headers_only=True))
+    assert summarize(exchanges) == summarize(resp_stream_input(
+        [os.path.join(base_path, relative_path)], headers_only=True))
+
+
+def test_compressed_har_jobs(tmpdir):
+    # Compressed HAR files are read in the main process, without an index.
+    path = compressed_copy(tmpdir, 'har_data/firefox_gif.har', gzip.compress)
+    (parts, _) = har_input([path], parts=True)
+    assert [part.args[0] for part in parts] == [[path]]
+    assert len(list(parts[0].func(*parts[0].args))) == 8
+    assert not os.path.exists(path + u'.httpolice-index')
+
+
+def check_seek(f, data, rnd):
+    for _ in range(200):
+        pos = rnd.randrange(len(data) + 10)
+        n = rnd.randrange(500)
+        f.seek(pos)
+        assert f.read(n) == data[pos : pos + n]
+        assert f.tell() == min(pos + n, len(data)) or pos > len(data)
+    f.seek(10)
+    f.seek(5, io.SEEK_CUR)
+    assert f.read(3) == data[15:18]
+    with pytest.raises(ValueError):
+        f.seek(-1)
+
+
+def test_gzip_seek(tmpdir, monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.packed, 'CHUNK_SIZE', 100)
+    monkeypatch.setattr(httpolice.inputs.packed, 'CHECKPOINT_INTERVAL', 1000)
+    monkeypatch.setattr(httpolice.inputs.packed, 'CACHED_BLOCKS', 2)
+    rnd = random.Random(0)
+    data = bytes(rnd.randrange(256) for _ in range(50000))
+    data += b'hello world' * 5000
+    path = tmpdir.join('data.gz')
+    # Two gzip streams one after another are read as one.
+    path.write_binary(gzip.compress(data[:30000]) + gzip.compress(data[30000:]))
+    raw = GzipRaw(io.open(str(path), 'rb'), str(path))
+    with io.BufferedReader(raw, buffer_size=64) as f:
+        assert f.seek(0, io.SEEK_END) == len(data)
+        assert len(raw.index.checkpoints) > 50
+        check_seek(f, data, rnd)
+
+
+def test_decompressed_seek(tmpdir, monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.packed, 'CHUNK_SIZE', 100)
+    rnd = random.Random(0)
+    data = bytes(rnd.randrange(256) for _ in range(5000)) + b'hello' * 1000
+    path = tmpdir.join('data.bz2')
+    path.write_binary(bz2.compress(data[:3000]) + bz2.compress(data[3000:]))
+    raw = DecompressedRaw(io.open(str(path), 'rb'), str(path), u'bzip2')
+    with io.BufferedReader(raw, buffer_size=64) as f:
+        assert f.seek(0, io.SEEK_END) == len(data)
+        check_seek(f, data, rnd)
+
+
+def test_not_compressed(tmpdir):
+    path = tmpdir.join('plain')
+    path.write_binary(b'hello')
+    assert not is_compressed(str(path))
+    with open_input(str(path)) as f:
+        assert f.read() == b'hello'
+
+
+TAR_MODES = {'.tar': 'w', '.tar.gz': 'w:gz', '.tar.xz': 'w:xz'}
+
+
+def make_archive(tmpdir, relative_path, kind):
+    dir_path = os.path.join(base_path, relative_path)
+    archive_path = str(tmpdir.join(os.path.basename(relative_path) + kind))
+    if kind == '.zip':
+        with zipfile.ZipFile(archive_path, 'w',
+                             compression=zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(dir_path)):
+                archive.write(os.path.join(dir_path, name), 'capture/' + name)
+    else:
+        with tarfile.open(archive_path, TAR_MODES[kind]) as archive:
+            archive.add(dir_path, 'capture')
+    return archive_path
+
+
+@pytest.mark.parametrize('kind', ['.tar', '.tar.gz', '.zip'])
+@pytest.mark.parametrize('input_func, relative_path', [
+    (tcpflow_input, 'tcpflow_data/httpbin'),
+    (tcpflow_input, 'tcpflow_data/multiple_connections'),
+    (tcpflow_input, 'tcpflow_data/tls'),
+    (tcpick_input, 'tcpick_data/multiple_connections'),
+])
+def test_archive(tmpdir, kind, input_func, relative_path):
+    path = make_archive(tmpdir, relative_path, kind)
+    expected = summarize(input_func([os.path.join(base_path, relative_path)]))
+    assert summarize(input_func([path])) == expected
+    assert summarize(input_func([path], headers_only=True, reorder=False)) \
+        == summarize(input_func([os.path.join(base_path, relative_path)],
+                                headers_only=True, reorder=False))
+    # With an index, the framing of archive members is remembered
+    # by their sizes and times in the archive.
+    index_path = str(tmpdir.join('index'))
+    assert summarize(input_func([path], index=index_path)) == expected
+    assert summarize(input_func([path], index=index_path)) == expected
+
+
+def test_archive_member_names(tmpdir, monkeypatch):
+    path = make_archive(tmpdir, 'tcpflow_data/httpbin', '.tar.gz')
+    exchanges = list(tcpflow_input([path]))
+    assert u'httpbin.tar.gz%scapture%s' % (os.sep, '/') in \
+        exchanges[0].request.remark
+    member = [p for p in httpolice.inputs.packed.scan_archive(path)
+              if p.endswith('53222-0')][0]
+    assert isinstance(member, ArchiveMember)
+    assert is_compressed(member)
+    with open_input(member) as f:
+        data = f.read()
+        f.seek(-10, io.SEEK_END)
+        f.seek(5, io.SEEK_CUR)
+        assert f.read() == data[-5:]
+        with pytest.raises(ValueError):
+            f.seek(-1)
+    # Members are sent to worker processes by name, and found again there.
+    monkeypatch.setattr(httpolice.inputs.packed, '_scanned', {})
+    copy = pickle.loads(pickle.dumps(member))
+    assert copy == member
+    assert copy.size == member.size
+    with open_input(copy) as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize('kind, n_expected', [('.tar', 13), ('.zip', 0)])
+def test_archive_time_window(tmpdir, kind, n_expected):
+    # A zip archive only has local times, which are no good for filtering,
+    # so a connection inside it is judged by its tcpflow name alone.
+    capture = tmpdir.mkdir('httpbin')
+    source_path = os.path.join(base_path, 'tcpflow_data', 'httpbin')
+    timestamp = (datetime(2018, 1, 1) - datetime(1970, 1, 1)).total_seconds()
+    for name in os.listdir(source_path):
+        shutil.copy(os.path.join(source_path, name), str(capture))
+        os.utime(str(capture.join(name)), (timestamp, timestamp))
+    path = make_archive(tmpdir, str(capture), kind)
+    assert len(list(tcpflow_input([path], since=datetime(2017, 1, 1)))) == \
+        n_expected
+    assert list(tcpflow_input([path], since=datetime(2030, 1, 1))) == []
+
+
+def test_archive_gzip_checkpoints(tmpdir, monkeypatch):
+    # Members of a gzip-compressed tar archive are found
+    # by restarting from the checkpoints made while listing it.
+    monkeypatch.setattr(httpolice.inputs.packed, 'CHUNK_SIZE', 256)
+    monkeypatch.setattr(httpolice.inputs.packed, 'CHECKPOINT_INTERVAL', 512)
+    monkeypatch.setattr(httpolice.inputs.packed, 'CACHED_BLOCKS', 1)
+    relative_path = 'tcpflow_data/multiple_connections'
+    path = make_archive(tmpdir, relative_path, '.tar.gz')
+    assert summarize(tcpflow_input([path])) == \
+        summarize(tcpflow_input([os.path.join(base_path, relative_path)]))
+
+
+def test_archive_unsupported_compression(tmpdir):
+    path = make_archive(tmpdir, 'tcpflow_data/httpbin', '.tar.xz')
+    with pytest.raises(InputError, match=u'compressed with xz'):
+        list(tcpflow_input([path]))
+
+
+def test_archive_broken(tmpdir):
+    # A bad header after an extended (pax) header can't be skipped over.
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for name in ['first', 'x' * 200]:
+            info = tarfile.TarInfo(name)
+            info.size = 5
+            tar.addfile(info, io.BytesIO(b'hello'))
+    data = f.getvalue()
+    # Spoil the checksum of the second member's header.
+    checksum_pos = 4 * tarfile.BLOCKSIZE + 148
+    data = data[:checksum_pos] + b'0000000\x00' + data[checksum_pos + 8:]
+    path = tmpdir.join('capture.tar')
+    path.write_binary(data)
+    with pytest.raises(InputError, match=u'bad tar archive'):
+        list(tcpflow_input([str(path)]))
+
+
+def test_not_archive(tmpdir):
+    path = tmpdir.join('capture')
+    path.write_binary(b'hello')
+    with pytest.raises(EnvironmentError):
+        list(tcpflow_input([str(path)]))
+
+
+def test_archive_in_directory(tmpdir):
+    # An archive inside a directory is not looked into.
+    capture = tmpdir.mkdir('capture')
+    shutil.copy(make_archive(tmpdir, 'tcpflow_data/httpbin', '.zip'),
+                str(capture))
+    with pytest.raises(InputError, match=u'wrong tcpflow filename'):
+        list(tcpflow_input([str(capture)]))
@@ -0,0 +1,220 @@
+from datetime import datetime
+import functools
+import gzip
+import io
+import os
+import pickle
+import time
+
+import pytest
+
+from httpolice.cli import _process_exchange
+from httpolice.inputs.common import InputError, Part
+from httpolice.inputs.har import har_input
+from httpolice.inputs.ndjson import ndjson_input
+import httpolice.inputs.ndjson
+from httpolice.inputs.streams import tcpflow_input
+import httpolice.parallel
+from httpolice.parallel import _init_worker, _run_part, _Scheduler, run_parts
+from httpolice.reports import text_fragment, text_report
+
+
+base_path = os.path.dirname(__file__)
+
+process = functools.partial(_process_exchange, hosts=None,
+                            target_prefixes=None, silence=None, cache=None)
+
+
+def serial_report(exchanges):
+    buf = io.BytesIO()
+    text_report((exch for exch in exchanges if process(exch) is not None),
+                buf)
+    return buf.getvalue()
+
+
+def run_in_process(parts):
+    # Like the workers do, but here, where coverage can see it.
+    fragments = []
+    for part in parts:
+        # Parts must survive the trip to a worker.
+        part = pickle.loads(pickle.dumps(part))
+        (results, _, _, error) = _run_part(part, process, text_fragment,
+                                           False)
+        fragments.extend(result.fragment for result in results)
+        if error is not None:
+            raise error
+    return b''.join(fragments)
+
+
+def test_ndjson_parts(monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.ndjson, 'BATCH_SIZE', 2)
+    path = os.path.join(base_path, 'ndjson_data', 'simple.ndjson')
+    for lines in [None, (2, None), (None, 2), (2, 2)]:
+        (parts, reorder) = ndjson_input([path], lines=lines, parts=True)
+        assert not reorder
+        assert run_in_process(parts) == \
+            serial_report(ndjson_input([path], lines=lines))
+
+
+def test_har_parts(tmp_path):
+    with io.open(os.path.join(base_path, 'har_data', 'firefox_gif.har'),
+                 'rb') as f:
+        data = f.read()
+    path = tmp_path / 'input.har'
+    path.write_bytes(data)
+    # Compressed files are not split, but still go to a worker.
+    packed_path = tmp_path / 'input.har.gz'
+    packed_path.write_bytes(gzip.compress(data))
+    since = datetime(2019, 6, 27, 10, 33, 54)
+    for paths in [[str(path)], [str(packed_path)]]:
+        (parts, _) = har_input(paths, since=since, parts=True)
+        assert not any(part.local for part in parts)
+        assert run_in_process(parts) == \
+            serial_report(har_input(paths, since=since))
+
+
+def test_part_error(tmp_path):
+    path = tmp_path / 'input.ndjson'
+    path.write_bytes(b'{"response": {"status": 200}}\n[]\n')
+    (parts, _) = ndjson_input([str(path)], parts=True)
+    assert len(parts) == 1
+    (results, _, _, error) = _run_part(parts[0], process, text_fragment,
+                                       False)
+    assert len(results) == 1
+    assert isinstance(error, InputError)
+
+
+def test_bad_har_parts(tmp_path):
+    with pytest.raises(InputError, match=u'cannot understand HAR file'):
+        har_input([os.path.join(base_path, 'misc_data', 'bad.har')],
+                  parts=True)
+    path = tmp_path / 'input.har'
+    path.write_bytes(b'{"log": {"creator": {"name": "Foo"}, '
+                     b'"entries": [{"request": {}}]}}')
+    (parts, _) = har_input([str(path)], parts=True)
+    with pytest.raises(InputError, match=u'cannot understand HAR file'):
+        run_in_process(parts)
+
+
+class FakePool:
+
+    def __init__(self):
+        self.sent = []
+
+    def apply_async(self, func, args):
+        self.sent.append(args[0])
+        return FakeAsyncResult(func(*args))
+
+
+class FakeAsyncResult:
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, _timeout=None):
+        return self.value
+
+
+def test_scheduler_window():
+    (parts, _) = tcpflow_input(
+        [os.path.join(base_path, 'tcpflow_data', 'rearrange')], parts=True)
+    pool = FakePool()
+    scheduler = _Scheduler(pool, parts, process, text_fragment,
+                           window=2, by_time=True)
+    sequences = list(scheduler.sequences())
+    assert pool.sent == []
+    list(sequences[-1][0])
+    # The part that was asked for, and two more in order of time.
+    assert len(pool.sent) == 3
+    assert pool.sent[0] is parts[-1]
+
+
+def test_scheduler_lazy():
+    # Parts from an iterator are only taken as they are needed.
+    taken = []
+
+    def generate_parts():
+        for part in parts:
+            taken.append(part)
+            yield part
+
+    (parts, _) = tcpflow_input(
+        [os.path.join(base_path, 'tcpflow_data', 'rearrange')], parts=True,
+        reorder=False)
+    pool = FakePool()
+    scheduler = _Scheduler(pool, generate_parts(), process, text_fragment,
+                           window=2, by_time=False)
+    sequences = scheduler.sequences()
+    (sequence, _) = next(sequences)
+    assert len(taken) == 1
+    list(sequence)
+    assert len(taken) == 3
+    assert len(list(sequences)) == len(parts) - 1
+
+
+def test_run_parts_local():
+    # Parts that can only be read here are never sent to a worker.
+    path = os.path.join(base_path, 'ndjson_data', 'simple.ndjson')
+    parts = [Part(ndjson_input, ([path],), None, local=True)]
+    results = list(run_parts(parts, False, 1, process, text_fragment))
+    assert b''.join(result.fragment for result in results) == \
+        serial_report(ndjson_input([path]))
+
+
+def slow_process(exch, give_up=False):     # pragma: no cover
+    # Only runs in worker processes. Gets stuck checking requests to ``/`` (in a way that the budget
+    # cannot stop), unless it gives up on them.
+    if exch.request is not None and exch.request.target == u'/' and \
+            not give_up:
+        time.sleep(60)
+    return process(exch, budget=0.1, give_up=give_up)
+
+
+def slow_input(path):                      # pragma: no cover
+    # Only runs in worker processes. Gets stuck reading the second exchange.
+    for (k, exch) in enumerate(ndjson_input([path])):
+        if k == 1:
+            time.sleep(60)
+        yield exch
+
+
+def notice_ids(fragment):
+    return [line.split()[1] for line in fragment.decode().splitlines()
+            if line.startswith(u'E ') or line.startswith(u'C ') or
+            line.startswith(u'D ')]
+
+
+def test_run_parts_kill():
+    path = os.path.join(base_path, 'ndjson_data', 'simple.ndjson')
+    parts = [Part(ndjson_input, ([path],), None, local=False),
+             Part(slow_input, (path,), None, local=False)]
+    results = list(run_parts(parts, False, 2, slow_process, text_fragment,
+                             budget=0.1))
+    # Checking ``/`` in the first part is given up.
+    assert [u'1313' in notice_ids(result.fragment)
+            for result in results[:3]] == [False, False, True]
+    # The second part is cut short at its second exchange.
+    assert len(results) == 5
+    assert notice_ids(results[4].fragment) == [u'1313']
+
+
+class FakeQueue(list):
+
+    def put(self, item):
+        self.append(item)
+
+
+def test_run_part_progress(monkeypatch):
+    # Like `test_run_parts_kill`, but here, where coverage can see it.
+    progress = FakeQueue()
+    monkeypatch.setattr(httpolice.parallel, '_progress', None)
+    _init_worker(progress)
+    path = os.path.join(base_path, 'ndjson_data', 'simple.ndjson')
+    part = Part(ndjson_input, ([path],), None, local=False)
+    (results, counters, _, _) = _run_part(
+        part, functools.partial(process, budget=1), text_fragment, False,
+        7, skip=frozenset([0]), stop=2)
+    assert [k for (_, _, k) in progress] == [0, 1, 2, None]
+    assert [notice_ids(result.fragment)[-1:] for result in results] == \
+        [[u'1313'], [u'1070'], [u'1313']]
+    assert counters[u'budget.exceeded'] == 2
@@ -0,0 +1,534 @@
+from datetime import datetime
+import os
+import struct
+
+import pytest
+
+from httpolice.exchange import check_exchange
+from httpolice.inputs import InputError
+import httpolice.inputs.pcap
+from httpolice.inputs.pcap import _read_packets, _reassemble, pcap_input
+from httpolice.inputs.streams import tcpflow_input
+from httpolice.known import m, st
+from httpolice.util import stats
+
+
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=unbalanced-tuple-unpacking
+
+
+def load(name):
+    path = os.path.join(os.path.dirname(__file__), 'pcap_data', name)
+    return list(pcap_input([path]))
+
+
+def summarize(exchanges):
+    r = []
+    for exch in exchanges:
+        check_exchange(exch)
+        r.append((
+            exch.request.target if exch.request else None,
+            [resp.status for resp in exch.responses],
+            [complaint.id for complaint in exch.complaints],
+            [complaint.id
+             for msg in [exch.request] + exch.responses if msg
+             for complaint in msg.complaints],
+        ))
+    return r
+
+
+# Helpers for building small captures right in the tests.
+
+SYN, ACK, FIN, RST = 0x02, 0x10, 0x01, 0x04
+
+CLIENT = (b'\x0a\x00\x00\x01', 40000)
+SERVER = (b'\x0a\x00\x00\x02', 80)
+
+REQUEST = b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n'
+RESPONSE = (b'HTTP/1.1 200 OK\r\nDate: Thu, 01 Sep 2016 12:00:00 GMT\r\n'
+            b'Content-Type: text/plain\r\nContent-Length: 5\r\n\r\nhello')
+
+
+def tcp(source, destination, seq, flags=ACK, payload=b''):
+    return struct.pack('!HHIIBBHHH', source[1], destination[1], seq, 0,
+                       5 << 4, flags, 65535, 0, 0) + payload
+
+
+def ipv4(source, destination, segment, protocol=6, fragment=0):
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0,
+                       fragment, 64, protocol, 0,
+                       source[0], destination[0]) + segment
+
+
+def ipv6(source, destination, segment, extension=None):
+    next_header = 6
+    if extension is not None:
+        segment = bytes([6, 0]) + b'\0' * 6 + segment
+        next_header = extension
+    return struct.pack('!IHBB16s16s', 6 << 28, len(segment), next_header, 64,
+                       b'\0' * 12 + source[0],
+                       b'\0' * 12 + destination[0]) + segment
+
+
+def exchange_packets(ip=ipv4, request=REQUEST, response=RESPONSE):
+    return [
+        ip(CLIENT, SERVER, tcp(CLIENT, SERVER, 100, SYN)),
+        ip(SERVER, CLIENT, tcp(SERVER, CLIENT, 500, SYN | ACK)),
+        ip(CLIENT, SERVER, tcp(CLIENT, SERVER, 101, ACK, request)),
+        ip(SERVER, CLIENT, tcp(SERVER, CLIENT, 501, ACK, response)),
+    ]
+
+
+def write_pcap(tmpdir, frames, link_type=101, header=None):
+    path = str(tmpdir.join('capture.pcap'))
+    with open(path, 'wb') as f:
+        f.write(header or struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0,
+                                      65535, link_type))
+        for (i, frame) in enumerate(frames):
+            f.write(struct.pack('<IIII', 1472731200 + i, 0,
+                                len(frame), len(frame)))
+            f.write(frame)
+    return path
+
+
+def pcapng_block(block_type, body):
+    body += b'\0' * (-len(body) % 4)
+    length = len(body) + 12
+    return (struct.pack('<II', block_type, length) + body +
+            struct.pack('<I', length))
+
+
+PCAPNG_HEADER = pcapng_block(0x0A0D0D0A,
+                             struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+
+
+def write_pcapng(tmpdir, blocks):
+    path = str(tmpdir.join('capture.pcapng'))
+    with open(path, 'wb') as f:
+        f.write(b''.join(blocks))
+    return path
+
+
+def test_httpbin():
+    # This capture was made to contain the same traffic as
+    # ``tcpflow_data/httpbin``, but with TCP segments reordered,
+    # retransmitted, overlapping, and with sequence numbers wrapping around.
+    exchanges = load('httpbin.pcap')
+    assert summarize(exchanges) == summarize(tcpflow_input([
+        os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'httpbin')]))
+    assert exchanges[0].request.method == m.GET
+    assert exchanges[0].request.target == u'/get'
+    assert exchanges[0].responses[0].status == st.ok
+    assert exchanges[0].request.remark.endswith(
+        u'httpbin.pcap (172.16.0.100:53222 -> 23.22.14.18:80), offset 0')
+
+
+def test_multiple_connections():
+    # Big-endian pcapng with VLAN tags, IPv6, and different block types
+    # and timestamp resolutions.
+    exchanges = load('multiple_connections.pcapng')
+    assert summarize(exchanges) == summarize(tcpflow_input([
+        os.path.join(os.path.dirname(__file__), 'tcpflow_data',
+                     'multiple_connections')]))
+    assert u'[2001:db8::2]:80' in exchanges[1].responses[0].remark
+
+
+def test_source_port_reused():
+    # Unlike with tcpflow, this is no problem.
+    exchanges = load('source_port_reused.pcap')
+    assert [exch.request.target for exch in exchanges] == \
+        [u'/get', u'/encoding/utf8']
+    assert [len(exch.responses) for exch in exchanges] == [1, 1]
+
+
+def test_tls():
+    [box] = load('tls.pcap')
+    assert box.request is None
+    assert box.responses == []
+    assert [complaint.id for complaint in box.complaints] == [1279]
+
+
+def test_hole():
+    exchanges = load('hole.pcap')
+    assert [complaint.id for complaint in exchanges[0].complaints] == [1312]
+    assert exchanges[0].complaints[0].context['offset'] == 8400
+    # Requests after the hole are still fine, but responses are missing.
+    assert exchanges[1].responses[0].status == st.ok
+    assert exchanges[-1].request.method == m.POST
+    assert exchanges[-1].responses == []
+
+
+def test_headers_only():
+    exchanges = load('httpbin.pcap')
+    exchanges_headers_only = list(pcap_input(
+        [os.path.join(os.path.dirname(__file__), 'pcap_data', 'httpbin.pcap')],
+        headers_only=True))
+    assert len(exchanges_headers_only) == len(exchanges)
+    assert exchanges[0].responses[0].body != b''
+    assert exchanges_headers_only[0].responses[0].body != \
+        exchanges[0].responses[0].body
+
+
+def test_time_order(tmpdir):
+    # Connections without Date headers are put in order of their start.
+    frames = []
+    for (i, port) in enumerate([41000, 42000]):
+        client = (CLIENT[0], port)
+        request = b'GET /%d HTTP/1.1\r\nHost: example.com\r\n\r\n' % i
+        frames.append(ipv4(client, SERVER,
+                           tcp(client, SERVER, 100, ACK, request)))
+    path = write_pcap(tmpdir, list(reversed(frames)))
+    assert [exch.request.target for exch in pcap_input([path])] == \
+        [u'/1', u'/0']
+
+
+def test_time_order_many_files(tmpdir):
+    # Connections from all files are put in order of their start,
+    # even when one file has both earlier and later connections.
+    def request_frames(i):
+        client = (CLIENT[0], 41000 + i)
+        request = b'GET /%d HTTP/1.1\r\nHost: example.com\r\n\r\n' % i
+        return [ipv4(client, SERVER, tcp(client, SERVER, 100, ACK, request))]
+    paths = [
+        write_pcap(tmpdir.mkdir('a'),
+                   request_frames(0) + [FILLER] + request_frames(2) +
+                   [FILLER] + request_frames(4)),
+        write_pcap(tmpdir.mkdir('b'), [FILLER] + request_frames(1)),
+    ]
+    assert [exch.request.target for exch in pcap_input(paths)] == \
+        [u'/0', u'/1', u'/2', u'/4']
+    (parts, _) = pcap_input(paths, parts=True)
+    assert [part.args[1].time - 1472731200 for part in parts] == [0, 1, 2, 4]
+    assert [exch.request.target
+            for exch in pcap_input(paths, reorder=False)] == \
+        [u'/0', u'/2', u'/4', u'/1']
+
+
+@pytest.mark.parametrize('link_type,wrap', [
+    (0, lambda packet: b'\x02\0\0\0' + packet),
+    (1, lambda packet: b'\0' * 12 + b'\x88\xa8\0\0\x81\0\0\0\x08\0' + packet),
+    (12, lambda packet: packet),
+    (113, lambda packet: b'\0' * 14 + b'\x08\0' + packet),
+    (228, lambda packet: packet),
+    (276, lambda packet: b'\x08\0' + b'\0' * 18 + packet),
+])
+def test_link_types(tmpdir, link_type, wrap):
+    path = write_pcap(tmpdir, [wrap(packet) for packet in exchange_packets()],
+                      link_type=link_type)
+    [exch] = pcap_input([path])
+    assert exch.request.target == u'/'
+    assert exch.responses[0].body == b'hello'
+
+
+def test_ipv6_extension_header(tmpdir):
+    path = write_pcap(tmpdir, [
+        ipv6(source, destination, segment, extension=60)
+        for (source, destination, segment) in [
+            (CLIENT, SERVER, tcp(CLIENT, SERVER, 101, ACK, REQUEST)),
+            (SERVER, CLIENT, tcp(SERVER, CLIENT, 501, ACK, RESPONSE)),
+        ]
+    ], link_type=229)
+    [exch] = pcap_input([path])
+    assert exch.responses[0].remark.endswith(
+        u'([::a00:2]:80 -> [::a00:1]:40000), offset 0')
+
+
+@pytest.mark.parametrize('ip, length_at', [(ipv4, 2), (ipv6, 4)])
+def test_offloaded_length(tmpdir, ip, length_at):
+    # Packets captured before segmentation offload have a length of zero.
+    frames = exchange_packets(ip=ip)
+    for i in [2, 3]:
+        frames[i] = frames[i][:length_at] + b'\0\0' + frames[i][length_at + 2:]
+    [exch] = pcap_input([write_pcap(tmpdir, frames,
+                                    link_type=228 if ip is ipv4 else 229)])
+    assert exch.request.target == u'/'
+    assert exch.responses[0].body == b'hello'
+
+
+def test_ignored_packets(tmpdir):
+    frames = [
+        b'\0' * 10,                                     # Too short.
+        b'\0' * 12 + b'\x08\x06' + b'\0' * 28,          # ARP.
+        b'\0' * 12 + b'\x08\0' + b'\0' * 20,            # Garbage "IPv4".
+        b'\0' * 12 + b'\x08\0' + ipv4(CLIENT, SERVER, b'\0' * 8,
+                                      protocol=17),     # UDP.
+        b'\0' * 12 + b'\x08\0' + ipv4(CLIENT, SERVER, b'junk',
+                                      fragment=100),    # A fragment.
+        b'\0' * 12 + b'\x08\0' + ipv4(CLIENT, SERVER, b'junk'),
+        b'\0' * 12 + b'\x86\xdd' +
+        ipv6(CLIENT, SERVER, b'\0' * 8)[:6] + b'\x11' +
+        ipv6(CLIENT, SERVER, b'\0' * 8)[7:],            # IPv6 UDP.
+        b'\0' * 12 + b'\x08\0' + b'\x60' + b'\0' * 10,  # Truncated IPv6.
+    ]
+    assert list(pcap_input([write_pcap(tmpdir, frames, link_type=1)])) == []
+
+
+def test_truncated_packet(tmpdir):
+    frames = exchange_packets()
+    frames[3] = frames[3][:-3]
+    frames.append(ipv4(SERVER, CLIENT,
+                       tcp(SERVER, CLIENT, 501 + len(RESPONSE), ACK, b'x')))
+    [box, exch] = pcap_input([write_pcap(tmpdir, frames)])
+    assert [complaint.id for complaint in box.complaints] == [1312]
+    assert box.complaints[0].context['offset'] == 0
+    assert exch.request.target == u'/'
+    assert exch.responses == []
+
+
+def test_nothing_but_hole(tmpdir):
+    frames = exchange_packets()[:3]
+    frames[2] = frames[2][:-3]
+    [box] = pcap_input([write_pcap(tmpdir, frames)])
+    assert [complaint.id for complaint in box.complaints] == [1312]
+
+
+def test_never_filled(tmpdir, monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.pcap, 'MAX_PENDING_SIZE', 10)
+    frames = exchange_packets()
+    frames[3] = ipv4(SERVER, CLIENT, tcp(SERVER, CLIENT, 511, ACK,
+                                         RESPONSE[10:]))
+    [box, exch] = pcap_input([write_pcap(tmpdir, frames)])
+    assert [complaint.id for complaint in box.complaints] == [1312]
+    assert exch.responses == []
+
+
+def test_missing_segment_at_end(tmpdir):
+    frames = exchange_packets()
+    frames.append(ipv4(SERVER, CLIENT, tcp(SERVER, CLIENT, 1000, ACK,
+                                           b'more data')))
+    [box, exch] = pcap_input([write_pcap(tmpdir, frames)])
+    assert box.complaints[0].context['offset'] == len(RESPONSE)
+    assert exch.responses[0].body == b'hello'
+
+
+def test_too_long(tmpdir, monkeypatch):
+    monkeypatch.setattr(httpolice.inputs.pcap, 'MAX_STREAM_SIZE', 20)
+    exchanges = list(pcap_input([write_pcap(tmpdir, exchange_packets())]))
+    for box in exchanges[:2]:
+        assert [complaint.id for complaint in box.complaints] == [1312]
+        assert box.complaints[0].context['offset'] == 20
+    assert all(exch.request is None for exch in exchanges)
+
+
+def test_one_sided(tmpdir):
+    frames = exchange_packets()[:3]
+    frames.append(ipv4(CLIENT, SERVER, tcp(CLIENT, SERVER, 0, FIN)))
+    [exch] = pcap_input([write_pcap(tmpdir, frames)])
+    assert exch.request.target == u'/'
+    assert exch.responses == []
+
+
+def test_one_sided_non_http(tmpdir):
+    frames = exchange_packets(request=b'\x16\x03\x01 whatever')[:3]
+    [box] = pcap_input([write_pcap(tmpdir, frames)])
+    assert box.complaints[0].id == 1279
+    assert box.complaints[0].context['path2'] == u'(none)'
+
+
+def test_port_reused_after_close(tmpdir):
+    frames = exchange_packets()[:2]
+    frames.append(ipv4(CLIENT, SERVER, tcp(CLIENT, SERVER, 101, FIN)))
+    frames += exchange_packets()
+    [exch] = pcap_input([write_pcap(tmpdir, frames)])
+    assert exch.request.target == u'/'
+
+
+def test_pcap_variants(tmpdir):
+    frames = exchange_packets()
+    for header in [
+            struct.pack('>IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101),
+            struct.pack('<IHHiIII', 0xA1B23C4D, 2, 4, 0, 0, 65535,
+                        0x0F000065)]:
+        path = write_pcap(tmpdir, [], header=header)
+        with open(path, 'ab') as f:
+            byte_order = '>' if header[0] == 0xA1 else '<'
+            for frame in frames:
+                f.write(struct.pack(byte_order + 'IIII', 1472731200,
+                                    500000000, len(frame), len(frame)))
+                f.write(frame)
+            f.write(b'\0' * 20)     # A truncated record is ignored.
+        [exch] = pcap_input([path])
+        assert exch.responses[0].status == st.ok
+
+
+def test_truncated_record(tmpdir):
+    path = write_pcap(tmpdir, exchange_packets())
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+    [exch] = pcap_input([path])
+    assert exch.responses == []
+
+
+def test_pcapng_blocks(tmpdir):
+    frames = exchange_packets()
+    path = write_pcapng(tmpdir, [
+        PCAPNG_HEADER,
+        pcapng_block(1, struct.pack('<HHI', 101, 0, 0) +
+                     struct.pack('<HH', 9, 1) + b'\x03\0\0\0'),
+        pcapng_block(3, struct.pack('<I', len(frames[0])) + frames[0]),
+        pcapng_block(3, struct.pack('<I', len(frames[1])) + frames[1]),
+        pcapng_block(6, struct.pack('<IIIII', 0, 342, 3813265664,
+                                    len(frames[2]), len(frames[2])) +
+                     frames[2]),
+        pcapng_block(6, struct.pack('<IIIII', 0, 342, 3813266664,
+                                    len(frames[3]), len(frames[3])) +
+                     frames[3]),
+    ])
+    [exch] = pcap_input([path])
+    assert exch.responses[0].status == st.ok
+
+
+def test_pcapng_truncated(tmpdir):
+    frames = exchange_packets()
+    blocks = [PCAPNG_HEADER, pcapng_block(1, struct.pack('<HHI', 101, 0, 0))]
+    for frame in frames:
+        blocks.append(pcapng_block(6, struct.pack('<IIIII', 0, 0, 0,
+                                                  len(frame), len(frame)) +
+                                   frame))
+    for data in [b''.join(blocks)[:-cut] for cut in [2, 6, 10]] + \
+            [b''.join(blocks[:-1]) + b'\x06\0\0\0\x10\0']:
+        path = write_pcapng(tmpdir, [data])
+        [exch] = pcap_input([path])
+        assert exch.responses == []
+
+
+@pytest.mark.parametrize('data,error', [
+    (b'', u'not a pcap or pcapng file'),
+    (b'hello world', u'not a pcap or pcapng file'),
+    (struct.pack('<I', 0xA1B2C3D4) + b'\0' * 4, u'truncated pcap header'),
+    (b'\x0A\x0D\x0D\x0A' + b'\0' * 8, u'bad pcapng section header'),
+    (b'\x0A\x0D\x0D\x0A' + struct.pack('<I', 8) + b'\x4D\x3C\x2B\x1A',
+     u'bad pcapng block length'),
+    (PCAPNG_HEADER + pcapng_block(6, struct.pack('<IIIII', 0, 0, 0, 0, 0)),
+     u'packet from unknown interface 0'),
+    (PCAPNG_HEADER + pcapng_block(3, struct.pack('<I', 0)),
+     u'packet from unknown interface 0'),
+    (struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 105) +
+     struct.pack('<IIII', 0, 0, 1, 1) + b'\0', u'unsupported link type 105'),
+])
+def test_bad_file(tmpdir, data, error):
+    path = str(tmpdir.join('bad.pcap'))
+    with open(path, 'wb') as f:
+        f.write(data)
+    with pytest.raises(InputError) as exc_info:
+        list(pcap_input([path]))
+    assert error in str(exc_info.value)
+
+
+def test_time_hint():
+    path = os.path.join(os.path.dirname(__file__), 'pcap_data',
+                        'source_port_reused.pcap')
+    with open(path, 'rb') as f:
+        connections = list(_reassemble(path, _read_packets(path, f)))
+    assert [datetime.utcfromtimestamp(conn.time).replace(microsecond=0)
+            for conn in connections] == [datetime(2016, 8, 2, 10, 34, 9),
+                                         datetime(2016, 8, 2, 10, 35, 25)]
+
+
+def test_time_window():
+    path = os.path.join(os.path.dirname(__file__), 'pcap_data',
+                        'multiple_connections.pcapng')
+    stats.reset()
+    exchanges = list(pcap_input([path],
+                                since=datetime(2016, 8, 2, 10, 57, 15),
+                                until=datetime(2016, 8, 2, 10, 57, 18)))
+    assert [exch.responses[0].status for exch in exchanges] == [401]
+    assert stats.snapshot() == {u'filter.connections_skipped': 2}
+
+
+def test_sample_connections():
+    path = os.path.join(os.path.dirname(__file__), 'pcap_data',
+                        'multiple_connections.pcapng')
+    stats.reset()
+    # The same connections are picked every time, and more of them
+    # at a higher rate.
+    for (rate, statuses) in [(0.5, [400]), (0.5, [400]), (0.8, [400, 402]),
+                             (1, [400, 401, 402])]:
+        exchanges = list(pcap_input([path], sample_connections=rate))
+        assert [exch.responses[0].status for exch in exchanges] == statuses
+    assert stats.snapshot() == {u'sample.connections_skipped': 5}
+
+
+def connection_frames(port, close=True):
+    client = (CLIENT[0], port)
+    frames = [
+        ipv4(client, SERVER, tcp(client, SERVER, 100, SYN)),
+        ipv4(SERVER, client, tcp(SERVER, client, 500, SYN | ACK)),
+        ipv4(client, SERVER, tcp(client, SERVER, 101, ACK, REQUEST)),
+        ipv4(SERVER, client, tcp(SERVER, client, 501, ACK, RESPONSE)),
+    ]
+    if close:
+        frames += [
+            ipv4(client, SERVER, tcp(client, SERVER, 101 + len(REQUEST), FIN)),
+            ipv4(SERVER, client,
+                 tcp(SERVER, client, 501 + len(RESPONSE), FIN | ACK)),
+        ]
+    return frames
+
+
+def reassemble_as_read(frames, in_order=False):
+    # Return the connections along with how many packets had been read
+    # by the time each of them was generated.
+    n_read = [0]
+
+    def packets():
+        for (i, frame) in enumerate(frames):
+            n_read[0] += 1
+            yield (1472731200 + i, 101, frame)
+
+    return [(conn, n_read[0])
+            for conn in _reassemble('x', packets(), in_order)]
+
+
+FILLER = ipv4(CLIENT, SERVER, b'\0' * 20, protocol=17)
+
+
+def test_streaming(monkeypatch):
+    # Connections are generated as soon as they are finished,
+    # not at the end of the capture.
+    monkeypatch.setattr(httpolice.inputs.pcap, 'LINGER_PACKETS', 2)
+    monkeypatch.setattr(httpolice.inputs.pcap, 'IDLE_PACKETS', 6)
+    frames = (connection_frames(41000) + connection_frames(42000, close=False)
+              + [FILLER] * 20)
+    [(closed, n_read1), (idle, n_read2)] = reassemble_as_read(frames)
+    assert [sorted(closed.fin_sources), idle.fin_sources] == \
+        [sorted([(CLIENT[0], 41000), SERVER]), set()]
+    assert n_read1 < n_read2 < len(frames)
+
+    # A reset connection is over even if only one side has closed it.
+    client = (CLIENT[0], 43000)
+    frames = (connection_frames(43000, close=False) +
+              [ipv4(SERVER, client, tcp(SERVER, client, 501 + len(RESPONSE),
+                                        RST))] +
+              [FILLER] * 20)
+    [(reset, n_read)] = reassemble_as_read(frames)
+    assert reset.reset
+    assert n_read < 10
+
+
+def test_streaming_order(monkeypatch):
+    # A finished connection waits for the earlier ones to finish...
+    monkeypatch.setattr(httpolice.inputs.pcap, 'LINGER_PACKETS', 2)
+    frames = (connection_frames(41000, close=False)[:3] +
+              connection_frames(42000) + [FILLER] * 10)
+    connections = reassemble_as_read(frames)
+    assert [conn.time for (conn, _) in connections] == \
+        [1472731200, 1472731203]
+    assert [n_read for (_, n_read) in connections] == [len(frames)] * 2
+
+    # ...unless too many are waiting.
+    monkeypatch.setattr(httpolice.inputs.pcap, 'MAX_WAITING', 0)
+    stats.reset()
+    connections = reassemble_as_read(frames)
+    assert [conn.time for (conn, _) in connections] == \
+        [1472731203, 1472731200]
+    assert connections[0][1] < len(frames)
+    assert stats.snapshot() == {u'pcap.out_of_order': 1}
+
+    # But not when they must be in order.
+    connections = reassemble_as_read(frames, in_order=True)
+    assert [conn.time for (conn, _) in connections] == \
+        [1472731200, 1472731203]
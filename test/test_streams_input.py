@@ -1,13 +1,33 @@
+from datetime import datetime
+import functools
+import io
+import json
 import os
+import threading
 
 import pytest
 
+from httpolice.exchange import check_exchange
+from httpolice.framing1 import index_streams, parse_step, parse_streams
+import httpolice.inputs.files
+import httpolice.inputs.streams
 from httpolice.inputs import InputError
-from httpolice.inputs.streams import (combined_input, req_stream_input,
-                                      resp_stream_input, streams_input,
-                                      tcpflow_input, tcpick_input)
+from httpolice.inputs.files import FilePool
+from httpolice.inputs.streams import (_parse_tcpflow_name, _rearrange_by_time,
+                                      combined_input, parse_combined,
+                                      req_stream_input, resp_stream_input,
+                                      streams_input, tcpflow_input,
+                                      tcpick_input)
+from httpolice.reports import text_report
+from httpolice.stream import Stream
 from httpolice.known import h, m, st, upgrade
 from httpolice.structure import Unavailable, Versioned, http11, okay
+from httpolice.util import stats
+
+
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member,unbalanced-tuple-unpacking
 
 
 def load_from_file(name):
@@ -170,6 +190,32 @@ def test_tcpflow():
     assert len(exchanges[9].responses[0].body) == 1024
 
 
+def test_tcpflow_headers_only():
+    exchanges = load_from_tcpflow('httpbin')
+    exchanges_ho = list(tcpflow_input(
+        [os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'httpbin')],
+        headers_only=True))
+    assert len(exchanges_ho) == len(exchanges)
+    for (exch, exch_ho) in zip(exchanges, exchanges_ho):
+        assert exch_ho.request.target == exch.request.target
+        assert exch_ho.request.header_entries == exch.request.header_entries
+        for (resp, resp_ho) in zip(exch.responses, exch_ho.responses):
+            assert resp_ho.header_entries == resp.header_entries
+            if resp.body:
+                assert isinstance(resp_ho.body, Unavailable)
+            else:
+                assert resp_ho.body == b''
+    assert exchanges[8].responses[0].headers.transfer_encoding == [u'chunked']
+    assert isinstance(exchanges_ho[8].responses[0].decoded_body, Unavailable)
+
+
+def test_headers_only_truncated_body():
+    [exch1] = load(functools.partial(combined_input, headers_only=True),
+                   ['combined_data/1004_1'])
+    assert isinstance(exch1.request.body, Unavailable)
+    assert [complaint.id for complaint in exch1.request.complaints] == [1004]
+
+
 def test_tcpflow_multiple_connections():
     [exch1, exch2, exch3] = load_from_tcpflow('multiple_connections')
     assert exch1.request.target == u'/status/400'
@@ -345,6 +391,79 @@ def test_resp_stream():
     assert not exch2.complaints
 
 
+@pytest.mark.parametrize('input_func, name', [
+    (req_stream_input,
+     '1470133183-172.016.000.100-53222-023.022.014.018-00080-0'),
+    (resp_stream_input,
+     '1470133183-023.022.014.018-00080-172.016.000.100-53222-0'),
+])
+@pytest.mark.parametrize('headers_only', [False, True])
+def test_stream_from_stdin(stdin_pipe, input_func, name, headers_only):
+    path = os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'httpbin',
+                        name)
+    (remarks, report) = _summarize(list(input_func(
+        [path], headers_only=headers_only)))
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    with stdin_pipe(data):
+        exchanges = list(input_func([u'-'], headers_only=headers_only))
+    assert _summarize(exchanges) == \
+        ([(remark.replace(path, u'<stdin>'), body)
+          for (remark, body) in remarks], report)
+
+
+def test_stream_from_stdin_truncated(stdin_pipe, monkeypatch):
+    # Bodies are skipped by reading them in small pieces.
+    monkeypatch.setattr(Stream, 'skip_chunk_size', 10)
+    with stdin_pipe(b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n' +
+                    b'x' * 95):
+        [exch] = resp_stream_input([u'-'], headers_only=True)
+    [resp] = exch.responses
+    assert isinstance(resp.body, Unavailable)
+    assert [complaint.id for complaint in resp.complaints] == [1004]
+    assert resp.remark == u'from <stdin>, offset 0'
+
+
+def test_stream_from_fifo(tmpdir, monkeypatch, stdin_pipe):
+    # A named pipe is kept open, even when the pool is full.
+    monkeypatch.setattr(httpolice.inputs.files, 'MAX_OPEN_FILES', 1)
+    fifo_path = str(tmpdir.join('fifo'))
+    os.mkfifo(fifo_path)
+    data = (b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello' +
+            b'HTTP/1.1 204 No Content\r\n\r\n')
+    writer = threading.Thread(target=functools.partial(
+        _write_file, fifo_path, data))
+    writer.start()
+    other_path = str(tmpdir.join('other'))
+    _write_file(other_path, data)
+    exchanges = list(resp_stream_input([fifo_path, other_path],
+                                       reorder=False))
+    writer.join()
+    assert [exch.responses[0].status for exch in exchanges] == \
+        [200, 204, 200, 204]
+    assert exchanges[0].responses[0].body == b'hello'
+    with stdin_pipe(data):
+        with pytest.raises(InputError, match=u'cannot index'):
+            list(resp_stream_input([u'-'],
+                                   index=str(tmpdir.join('index'))))
+
+
+def _write_file(path, data):
+    with io.open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_combined_from_stdin(stdin_pipe):
+    path = os.path.join(os.path.dirname(__file__), 'combined_data',
+                        'simple_ok')
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    with stdin_pipe(data):
+        [exch] = combined_input([u'-'])
+    assert exch.request.remark == u'from <stdin> (inbound), offset 0'
+    assert exch.responses[0].status == 200
+
+
 def test_bad_content_encoding():
     [exch1] = load_from_file('bad_content_encoding')
     assert exch1.responses[0].decoded_body == Unavailable(b'Hello world!\r\n')
@@ -372,6 +491,61 @@ def test_rearrange():
     assert exchanges[9].request.target == u'/08'
 
 
+def test_rearrange_no_reorder():
+    path = os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'rearrange')
+    exchanges = list(tcpflow_input([path], reorder=False))
+    assert [exch.request.target if exch.request else None
+            for exch in exchanges] == [
+                u'/04', u'/05',                 # 1488154981
+                u'/01', u'/02', u'/07',         # 1488154987
+                u'/03', None,                   # 1488155040
+                u'/06',                         # 1488155160
+                u'/08', None,                   # 1488155280
+            ]
+
+
+def test_rearrange_empty_sequence():
+    exchanges = load_from_tcpflow('rearrange')
+    sequences = [(iter([]), datetime(2017, 2, 27)),
+                 (iter(exchanges), None),
+                 (iter([]), datetime(2017, 2, 28))]
+    assert list(_rearrange_by_time(sequences)) == \
+        exchanges
+
+
+def test_file_pool(tmpdir, monkeypatch):
+    # With only 3 files allowed to be open at the same time,
+    # they have to be closed and reopened all the time,
+    # but the results are the same.
+    expected = _summarize(load_from_tcpflow('rearrange'))
+    stats.reset()
+    monkeypatch.setattr(httpolice.inputs.files, 'MAX_OPEN_FILES', 3)
+    assert _summarize(load_from_tcpflow('rearrange')) == expected
+    assert stats.counters[u'files.opened'] == 8     # One pair is not HTTP.
+    assert stats.counters[u'files.reopened'] > 0
+
+    pool = FilePool(max_open=1)
+    path1 = str(tmpdir.join('1.dat'))
+    path2 = str(tmpdir.join('2.dat'))
+    with open(path1, 'wb') as f1, open(path2, 'wb') as f2:
+        f1.write(b'hello world\r\n')
+        f2.write(b'foo bar\r\n')
+    with pool.open(path1) as f1, pool.open(path2) as f2:
+        assert f1.tell() == 0
+        assert f1.read(6) == b'hello '
+        assert f1.tell() == 6
+        assert f2.readline() == b'foo bar\r\n'
+        assert f1.tell() == 6
+        assert f1.seek(0, io.SEEK_END) == 13
+        f1.seek(0)
+        assert f1.peek(5)[:5] == b'hello'
+    with pytest.raises(ValueError):
+        f1.read()
+    with pytest.raises(EnvironmentError):
+        pool.open(str(tmpdir.join('nonexistent.dat')))
+    assert pool.open(path2).read() == b'foo bar\r\n'
+
+
 def test_super_long_headers(tmpdir):
     req_path = tmpdir.join('request.dat')
     with req_path.open('wb') as req_file:
@@ -383,3 +557,355 @@ def test_super_long_headers(tmpdir):
     exchanges = load(req_stream_input, [str(req_path)])
     assert exchanges[0].request is None
     assert [complaint.id for complaint in exchanges[0].complaints] == [1006]
+
+
+def _summarize(exchanges):
+    for exch in exchanges:
+        check_exchange(exch)
+    buf = io.BytesIO()
+    text_report(exchanges, buf)
+    return ([(msg.remark, repr(msg.body))
+             for exch in exchanges
+             for msg in [exch.request] + exch.responses if msg is not None],
+            buf.getvalue())
+
+
+@pytest.mark.parametrize('name', os.listdir(os.path.join(
+    os.path.dirname(__file__), 'combined_data')))
+def test_parse_steps(name):
+    path = os.path.join(os.path.dirname(__file__), 'combined_data', name)
+    (inbound, outbound, scheme, _) = parse_combined(path)
+    expected = _summarize(list(parse_streams(inbound, outbound, scheme)))
+
+    (inbound, outbound, scheme, _) = parse_combined(path, headers_only=True)
+    steps = index_streams(inbound, outbound)
+
+    # Steps can be parsed in any order.
+    (inbound, outbound, scheme, _) = parse_combined(path)
+    parsed = {}
+    for i in reversed(range(len(steps))):
+        parsed[i] = parse_step(inbound, outbound, steps[i], scheme)
+    actual = _summarize([exch for i in range(len(steps))
+                         for exch in parsed[i]])
+    assert actual == expected
+
+
+def test_tcpflow_index(tmp_path, monkeypatch):
+    dir_path = os.path.join(os.path.dirname(__file__), 'tcpflow_data')
+    paths = [os.path.join(dir_path, name)
+             for name in ['httpbin', 'request_timeout', 'tls']]
+    index_path = str(tmp_path / 'index.json')
+    expected = _summarize(list(tcpflow_input(paths)))
+
+    assert _summarize(list(tcpflow_input(paths, index=index_path))) == \
+        expected
+    with io.open(index_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['httpolice_index'] == 2
+    assert len(data['connections']) == 2
+
+    assert len(data['directories']) == 3
+
+    # The second time around, nothing is reindexed, and the files
+    # aren't even opened until they are parsed.
+    monkeypatch.setattr(httpolice.inputs.streams, 'index_streams', None)
+    monkeypatch.setattr(httpolice.inputs.streams, '_parse_tcpflow_name', None)
+    monkeypatch.setattr(httpolice.inputs.streams, '_sniff_file', None)
+    assert _summarize(list(tcpflow_input(paths, index=index_path))) == \
+        expected
+
+    # Unless some streams have changed.
+    monkeypatch.undo()
+    data['connections'][0]['stats'][0][1] -= 1
+    with io.open(index_path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f)
+    assert _summarize(list(tcpflow_input(paths, index=index_path))) == \
+        expected
+    with io.open(index_path, 'rt', encoding='utf-8') as f:
+        assert json.load(f) != data
+
+    # Indexes from other versions of HTTPolice are simply rebuilt.
+    with io.open(index_path, 'wt', encoding='utf-8') as f:
+        json.dump({'httpolice_index': 0}, f)
+    assert _summarize(list(tcpflow_input(paths, index=index_path))) == \
+        expected
+
+
+def test_directory_index(tmp_path, monkeypatch):
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    source_path = os.path.join(os.path.dirname(__file__), 'tcpflow_data',
+                               'multiple_connections')
+    names = sorted(os.listdir(source_path))
+    index_path = str(tmp_path / 'index.json')
+
+    def copy(name):
+        with io.open(os.path.join(source_path, name), 'rb') as f:
+            (dir_path / name).write_bytes(f.read())
+
+    parsed = []
+    real_parse = _parse_tcpflow_name
+    def parse(name):
+        parsed.append(name)
+        return real_parse(name)
+    monkeypatch.setattr(httpolice.inputs.streams, '_parse_tcpflow_name', parse)
+
+    for name in names[:2]:
+        copy(name)
+    assert len(list(tcpflow_input([str(dir_path)], index=index_path))) == 1
+    assert sorted(parsed) == names[:2]
+
+    # New files are noticed, and only they are processed.
+    parsed[:] = []
+    for name in names[2:]:
+        copy(name)
+    assert len(list(tcpflow_input([str(dir_path)], index=index_path))) == 3
+    assert sorted(parsed) == names[2:]
+
+    # Removed files are forgotten.
+    (dir_path / names[0]).unlink()
+    (dir_path / names[1]).unlink()
+    assert len(list(tcpflow_input([str(dir_path)], index=index_path))) == 2
+    with io.open(index_path, 'rt', encoding='utf-8') as f:
+        [directory] = json.load(f)['directories']
+    assert sorted(directory['files']) == names[2:]
+
+
+def test_tcpick_index(tmp_path):
+    path = os.path.join(os.path.dirname(__file__), 'tcpick_data', 'httpbin')
+    index_path = str(tmp_path / 'index.json')
+    expected = _summarize(list(tcpick_input([path])))
+    for _ in range(2):
+        assert _summarize(list(tcpick_input([path], index=index_path))) == \
+            expected
+
+
+def test_bad_index(tmp_path):
+    path = os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'httpbin')
+    index_path = str(tmp_path / 'index.json')
+    for content in [u'{"foo": ', u'{"foo": "bar"}']:
+        with io.open(index_path, 'wt', encoding='utf-8') as f:
+            f.write(content)
+        with pytest.raises(InputError):
+            list(tcpflow_input([path], index=index_path))
+
+
+def _follow(input_func, paths, **kwargs):
+    # Collect exchanges until `FakeTime` runs out of actions.
+    exchanges = []
+    with pytest.raises(KeyboardInterrupt):
+        for exch in input_func(paths, follow=True, **kwargs):
+            exchanges.append(exch)
+    return exchanges
+
+
+def _sorted_summaries(exchanges, dir_path):
+    return sorted(repr(_summarize([exch])).replace(dir_path, u'<dir>')
+                  for exch in exchanges)
+
+
+@pytest.mark.parametrize('input_func, relative_path', [
+    (tcpflow_input, 'tcpflow_data/httpbin'),
+    (tcpick_input, 'tcpick_data/httpbin'),
+])
+def test_follow(tmp_path, fake_time, input_func, relative_path):
+    source_path = os.path.join(os.path.dirname(__file__), relative_path)
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    contents = {}
+    for name in os.listdir(source_path):
+        with io.open(os.path.join(source_path, name), 'rb') as f:
+            contents[name] = f.read()
+    names = sorted(contents)
+
+    def write(names_, fraction):
+        def action():
+            for name in names_:
+                data = contents[name]
+                (dir_path / name).write_bytes(data[:int(len(data) * fraction)])
+        return action
+
+    # Files appear and grow between polls.
+    write(names, 0.3)()
+    fake = fake_time([write(names, 0.6), write(names, 1)] +
+                     [lambda: None] * 6)
+    times = []
+    exchanges = []
+    with pytest.raises(KeyboardInterrupt):
+        for exch in input_func([str(dir_path)], follow=True, idle_timeout=5):
+            times.append(fake.now)
+            exchanges.append(exch)
+
+    # Exchanges are reported as soon as they are complete,
+    # but the last one has to wait for the connection to become idle.
+    assert times[0] < 2
+    assert times[-1] == 2 + 5
+    assert _sorted_summaries(exchanges, str(dir_path)) == \
+        _sorted_summaries(input_func([source_path]), source_path)
+
+
+def test_follow_checkpoint(tmp_path, fake_time):
+    source_path = os.path.join(os.path.dirname(__file__), 'tcpflow_data',
+                               'httpbin')
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    for name in os.listdir(source_path):
+        with io.open(os.path.join(source_path, name), 'rb') as f:
+            (dir_path / name).write_bytes(f.read())
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    expected = _sorted_summaries(tcpflow_input([source_path]), source_path)
+
+    # Interrupted before any connection is finished.
+    fake_time([])
+    exchanges1 = _follow(tcpflow_input, [str(dir_path)], idle_timeout=5,
+                         checkpoint=checkpoint_path)
+    assert exchanges1
+    assert len(exchanges1) < len(expected)
+    with io.open(checkpoint_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['httpolice_follow'] == 1
+    assert data['done'] == []
+    assert len(data['connections']) == 1
+
+    # Restarted, it picks up where it left off.
+    fake_time([lambda: None] * 6)
+    exchanges2 = _follow(tcpflow_input, [str(dir_path)], idle_timeout=5,
+                         checkpoint=checkpoint_path)
+    assert _sorted_summaries(exchanges1 + exchanges2, str(dir_path)) == \
+        expected
+    with io.open(checkpoint_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    assert len(data['done']) == 2
+    assert data['connections'] == []
+
+    # Finished connections are not reported again.
+    fake_time([lambda: None] * 6)
+    assert _follow(tcpflow_input, [str(dir_path)], idle_timeout=5,
+                   checkpoint=checkpoint_path) == []
+    # Nor are they remembered once they fall behind the horizon.
+    with io.open(checkpoint_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['done'] == []
+    assert data['horizon'] > max(path.stat().st_mtime
+                                 for path in dir_path.iterdir())
+
+    # Removed files are forgotten.
+    for path in dir_path.iterdir():
+        path.unlink()
+    fake_time([])
+    assert _follow(tcpflow_input, [str(dir_path)],
+                   checkpoint=checkpoint_path) == []
+    with io.open(checkpoint_path, 'rt', encoding='utf-8') as f:
+        assert json.load(f)['done'] == []
+
+
+def test_follow_bad_connections(tmp_path, fake_time):
+    # A stream without the other side is only reported as such
+    # once it has been idle. A non-HTTP/1.x connection, once finished.
+    base_path = os.path.join(os.path.dirname(__file__), 'tcpflow_data')
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    name = '1470133183-172.016.000.100-53222-023.022.014.018-00080-0'
+    with io.open(os.path.join(base_path, 'httpbin', name), 'rb') as f:
+        (dir_path / name).write_bytes(f.read())
+    fake = fake_time([lambda: None] * 3)
+    times = []
+    exchanges = []
+    with pytest.raises(KeyboardInterrupt):
+        for exch in tcpflow_input([str(dir_path), os.path.join(base_path,
+                                                               'tls')],
+                                  follow=True, idle_timeout=2):
+            times.append(fake.now)
+            exchanges.append(exch)
+    assert sorted(exch.complaints[0].id for exch in exchanges
+                  if not exch.request) == [1278, 1279]
+    assert min(times) == 2
+    assert len(exchanges) == len(load_from_tcpflow('tls')) + \
+        len(list(req_stream_input([os.path.join(base_path, 'httpbin',
+                                                name)]))) + 1
+
+
+def test_follow_restart_one_sided(tmp_path, fake_time):
+    # The complaint about a missing side is not repeated after a restart,
+    # even if the connection wasn't finished.
+    source_path = os.path.join(
+        os.path.dirname(__file__), 'tcpflow_data', 'httpbin',
+        '1470133183-172.016.000.100-53222-023.022.014.018-00080-0')
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    with io.open(source_path, 'rb') as f:
+        (dir_path / os.path.basename(source_path)).write_bytes(f.read())
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    fake_time([lambda: None] * 3)
+    exchanges = tcpflow_input([str(dir_path)], follow=True, idle_timeout=2,
+                              checkpoint=checkpoint_path)
+    assert next(exchanges).complaints[0].id == 1278
+    exchanges.close()
+    fake_time([lambda: None] * 3)
+    exchanges = _follow(tcpflow_input, [str(dir_path)], idle_timeout=2,
+                        checkpoint=checkpoint_path)
+    assert all(exch.request for exch in exchanges)
+    assert len(exchanges) == len(list(req_stream_input([source_path])))
+
+
+def test_follow_errors(tmp_path, fake_time):
+    path = os.path.join(os.path.dirname(__file__), 'tcpflow_data', 'httpbin')
+    fake_time([])
+    with pytest.raises(InputError, match=u'--index'):
+        list(tcpflow_input([path], follow=True,
+                           index=str(tmp_path / 'index.json')))
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    for content in [u'{"foo": ', u'{"foo": "bar"}', u'[]']:
+        with io.open(checkpoint_path, 'wt', encoding='utf-8') as f:
+            f.write(content)
+        with pytest.raises(InputError, match=u'checkpoint'):
+            list(tcpflow_input([path], follow=True,
+                               checkpoint=checkpoint_path))
+
+
+def test_tcpflow_time_window(tmp_path):
+    source_path = os.path.join(os.path.dirname(__file__), 'tcpflow_data',
+                               'multiple_connections')
+    dir_path = tmp_path / 'dump'
+    dir_path.mkdir()
+    for name in os.listdir(source_path):
+        with io.open(os.path.join(source_path, name), 'rb') as f:
+            (dir_path / name).write_bytes(f.read())
+        if name != 'report.xml':
+            # Every connection goes on for a second after it starts.
+            timestamp = int(name.split('-')[0]) + 1
+            os.utime(str(dir_path / name), (timestamp, timestamp))
+
+    def statuses(since=None, until=None):
+        return [exch.responses[0].status
+                for exch in tcpflow_input([str(dir_path)], since=since,
+                                          until=until)]
+
+    assert statuses() == [400, 401, 402]
+    stats.reset()
+    # The first connection ends before `since`, and the last
+    # starts after `until`, so they are not even opened.
+    assert statuses(since=datetime(2016, 8, 2, 10, 57, 16),
+                    until=datetime(2016, 8, 2, 10, 57, 18)) == [401]
+    assert stats.snapshot()[u'filter.connections_skipped'] == 2
+    assert stats.snapshot()[u'files.sniffed'] == 2
+    assert statuses(since=datetime(2016, 8, 2, 10, 57, 15, 500000)) == \
+        [401, 402]
+    for input_func in [tcpflow_input, tcpick_input]:
+        with pytest.raises(InputError, match=u'--follow'):
+            input_func([str(dir_path)], follow=True, until=datetime.now())
+        with pytest.raises(InputError, match=u'--follow'):
+            input_func([str(dir_path)], follow=True, sample_connections=0.5)
+
+
+def test_sample_connections():
+    path = os.path.join(os.path.dirname(__file__), 'tcpflow_data',
+                        'multiple_connections')
+    stats.reset()
+    for (rate, statuses) in [(0.5, [401]), (0.5, [401]), (0.8, [401, 402])]:
+        assert [exch.responses[0].status
+                for exch in tcpflow_input([path], sample_connections=rate)
+                if exch.responses] == statuses
+    # Connections that are not sampled are not even opened.
+    assert stats.snapshot()[u'sample.connections_skipped'] == 5
+    assert stats.snapshot()[u'files.sniffed'] == 8
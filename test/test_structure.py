@@ -1,8 +1,16 @@
 from datetime import datetime
+import gzip
 import io
 import os
+import zlib
+
+import brotli
+import pytest
 
 from httpolice import check_exchange, text_report
+import httpolice.codings
+from httpolice.codings import (DecodedTooLongError, iter_brotli, iter_deflate,
+                               iter_gzip)
 from httpolice.exchange import Exchange
 from httpolice.inputs.streams import combined_input
 from httpolice.known import altsvc, auth, cache, h, hsts, m, prefer
@@ -13,6 +21,11 @@ from httpolice.structure import (CaseInsensitive, FieldName, HTTPVersion,
                                  Unavailable, WarningValue, http10, http11)
 
 
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member
+
+
 def load_from_file(name):
     path = os.path.join(os.path.dirname(__file__), 'combined_data', name)
     return list(combined_input([path]))
@@ -243,6 +256,46 @@ def test_decode_brotli():
     assert exch1.responses[0].decoded_body.startswith(b'Lorem ipsum dolor')
 
 
+def test_decode_in_chunks():
+    data = b'Hello world! ' * 100000
+    for (iter_func, encoded) in [(iter_gzip, gzip.compress(data)),
+                                 (iter_deflate, zlib.compress(data)),
+                                 (iter_brotli, brotli.compress(data))]:
+        chunks = [encoded[i : i + 100] for i in range(0, len(encoded), 100)]
+        assert b''.join(iter_func(chunks)) == data
+        assert b''.join(iter_func(chunks, limit=len(data))) == data
+        with pytest.raises(DecodedTooLongError):
+            b''.join(iter_func(chunks, limit=len(data) - 1))
+        if iter_func is not iter_gzip:      # gzip tolerates truncation
+            with pytest.raises(Exception):
+                b''.join(iter_func(chunks[:-1]))
+
+
+def test_decode_chain_limit(tmp_path, monkeypatch):
+    # Nested codings share the limit of the body as received, so this
+    # goes over it in the second coding, while each coding on its own
+    # would be well within the limit for its input.
+    monkeypatch.setattr(httpolice.codings, 'RATIO_GRACE_SIZE', 0)
+    monkeypatch.setattr(httpolice.codings, 'MAX_RATIO', 1000)
+    inner = gzip.compress(b'\0' * 1024 * 1024, compresslevel=1)
+    for (header, body) in [(b'Content-Encoding: gzip, br',
+                            brotli.compress(inner)),
+                           (b'Transfer-Encoding: gzip, gzip',
+                            gzip.compress(inner))]:
+        path = tmp_path / 'chain'
+        path.write_bytes(
+            b'======== BEGIN INBOUND STREAM ========\r\n'
+            b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n'
+            b'======== BEGIN OUTBOUND STREAM ========\r\n'
+            b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n' +
+            header + b'\r\n\r\n' + body)
+        [exch] = list(combined_input([str(path)]))
+        resp = exch.responses[0]
+        assert isinstance(resp.decoded_body, Unavailable)
+        assert [notice.id for notice in resp.notices] == [1311]
+        assert 1000 * len(body) < 1024 * 1024 <= 1000 * len(inner)
+
+
 def test_singular_vs_plural():
     [exch] = load_from_file('1013_5')
     assert exch.request.headers.if_none_match == u'*'
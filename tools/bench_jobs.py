@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Benchmark for checking exchanges in worker processes with ``--jobs``.
+
+Run it from the repo root::
+
+  $ tools/bench_jobs.py
+  $ tools/bench_jobs.py --connections 20000 1 2 4 8
+
+It generates a synthetic tcpflow directory (in a temporary location,
+see ``bench_rearrange.py``) and measures how long the whole ``httpolice``
+command (reading, checking, and writing an HTML report) takes
+with every given number of jobs. It also makes sure that the reports
+are the same as without ``--jobs``.
+
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from bench_rearrange import make_tcpflow_dir
+
+import httpolice.cli
+from httpolice.util.text import MockStdio
+
+
+def measure(path, jobs):
+    args = httpolice.cli.parse_args(['httpolice', '-i', 'tcpflow',
+                                     '-o', 'html', '--jobs', str(jobs), path])
+    stdout = MockStdio()
+    before = time.perf_counter()
+    httpolice.cli.run_cli(args, stdout, MockStdio())
+    return (stdout.buffer.getvalue(), time.perf_counter() - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', metavar='N', type=int,
+                        default=5000, help='number of connections')
+    parser.add_argument('jobs', metavar='JOBS', type=int, nargs='*',
+                        default=[1, 2, 4], help='number of jobs')
+    args = parser.parse_args()
+    path = tempfile.mkdtemp(prefix='httpolice-bench-')
+    try:
+        make_tcpflow_dir(path, args.connections)
+        (expected, _) = measure(path, 1)
+        for jobs in args.jobs:
+            (report, elapsed) = measure(path, jobs)
+            assert report == expected
+            print('%3d jobs: %8.2f s' % (jobs, elapsed))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Benchmark for the memory taken by checked exchanges.
+
+Run it from the repo root::
+
+  $ tools/bench_memory.py
+  $ tools/bench_memory.py --repeat 10
+  $ tools/bench_memory.py --release
+
+It reads every file in the test corpora (``test/combined_data/``
+and ``test/har_data/``) `repeat` times, checks all the exchanges,
+and keeps them alive, as an HTML report or a program embedding HTTPolice
+would. Then it prints how many bytes (as seen by :mod:`tracemalloc`)
+they take, on average, per exchange. With ``--release``, every exchange
+is released (see ``Exchange.release``) after it is checked.
+
+The exchanges are read and checked once before measuring,
+so that module-level caches (such as those of the parser)
+are already filled and don't count.
+
+"""
+
+import argparse
+import gc
+import os
+import tracemalloc
+
+from httpolice.exchange import check_exchange
+from httpolice.inputs.har import har_input
+from httpolice.inputs.streams import combined_input
+
+
+# With ``parts=True``, input functions return parts instead of exchanges,
+# which confuses pylint.
+# pylint: disable=no-member
+
+
+base_path = os.path.join(os.path.dirname(__file__), os.pardir, 'test')
+
+
+def corpus_paths():
+    return sorted(os.path.join(base_path, section, fn)
+                  for section in ['combined_data', 'har_data']
+                  for fn in os.listdir(os.path.join(base_path, section)))
+
+
+def load_and_check(paths, release=False):
+    exchanges = list(har_input([p for p in paths if p.endswith('.har')]))
+    exchanges.extend(combined_input([p for p in paths
+                                     if not p.endswith('.har')]))
+    for exch in exchanges:
+        check_exchange(exch)
+        if release:
+            exch.release()
+    return exchanges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='how many times to read the corpora')
+    parser.add_argument('--release', action='store_true',
+                        help='release exchanges after checking')
+    args = parser.parse_args()
+    paths = corpus_paths()
+    load_and_check(paths)
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    exchanges = []
+    for _ in range(args.repeat):
+        exchanges.extend(load_and_check(paths, args.release))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print('%d exchanges: %d bytes per exchange' %
+          (len(exchanges), (after - before) // len(exchanges)))
+
+
+if __name__ == '__main__':
+    main()
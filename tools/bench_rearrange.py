@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Benchmark for interleaving many connections by time.
+
+Run it from the repo root::
+
+  $ tools/bench_rearrange.py
+  $ tools/bench_rearrange.py 1000 10000 100000
+
+For every given number of connections, it generates a synthetic tcpflow
+directory (in a temporary location) where every connection has
+a couple of exchanges with random ``Date`` headers, and measures
+how long it takes to read it with the ``tcpflow`` input format,
+with and without ``--no-reorder``. The difference between the two
+is the cost of interleaving, most of which is parsing ``Date`` headers
+(the checks would have to parse them anyway).
+
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from httpolice.inputs.streams import tcpflow_input
+
+
+START = datetime(2019, 6, 1)
+
+REQUEST = (b'GET /%d/%d HTTP/1.1\r\n'
+           b'Host: example.com\r\n'
+           b'\r\n')
+
+RESPONSE = (b'HTTP/1.1 200 OK\r\n'
+            b'Date: %s\r\n'
+            b'Content-Length: 0\r\n'
+            b'\r\n')
+
+
+def make_tcpflow_dir(path, n_connections, exchanges_per_connection=2):
+    rnd = random.Random(n_connections)
+    for i in range(n_connections):
+        begin = START + timedelta(seconds=rnd.randrange(24 * 3600))
+        timestamp = int((begin - datetime(1970, 1, 1)).total_seconds())
+        client = u'010.000.%03d.%03d-%05d' % (i // 50000, i // 250 % 200,
+                                             1024 + i % 50000)
+        server = u'010.001.000.001-00080'
+        requests = b''
+        responses = b''
+        for j in range(exchanges_per_connection):
+            date = begin + timedelta(seconds=j * rnd.randrange(1, 60))
+            requests += REQUEST % (i, j)
+            responses += RESPONSE % date.strftime(
+                '%a, %d %b %Y %H:%M:%S GMT').encode('ascii')
+        for (src, dest, data) in [(client, server, requests),
+                                  (server, client, responses)]:
+            name = u'%d-%s-%s-0' % (timestamp, src, dest)
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(data)
+
+
+def measure(path, reorder):
+    before = time.perf_counter()
+    n = sum(1 for _ in tcpflow_input([path], reorder=reorder))
+    return (n, time.perf_counter() - before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', metavar='N', type=int, nargs='*',
+                        default=[1000, 10000, 100000],
+                        help='number of connections')
+    args = parser.parse_args()
+    for n_connections in args.sizes:
+        path = tempfile.mkdtemp(prefix='httpolice-bench-')
+        try:
+            make_tcpflow_dir(path, n_connections)
+            (n, reordered) = measure(path, reorder=True)
+            (_, in_order) = measure(path, reorder=False)
+        finally:
+            shutil.rmtree(path)
+        print('%7d connections, %7d exchanges: %8.2f s reordered, '
+              '%8.2f s in order' % (n_connections, n, reordered, in_order))
+
+
+if __name__ == '__main__':
+    main()